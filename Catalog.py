@@ -0,0 +1,178 @@
+"""Persistent index of statement files."""
+from contextlib import closing
+import datetime
+import os
+import sqlite3
+
+from StatementCache import hash_file
+from Utils import find_account_name, find_statement_date
+
+
+class StatementCatalog:
+    """
+    SQLite index of the statements under a statement root
+
+    Rescans walk per-account and per-year subfolders but only list the directories whose
+    modification time changed since the last scan, and statement dates are answered from
+    an index instead of parsing filenames on every import
+    """
+
+    def __init__(self, db_path: str, root: str, accounts: dict):
+        """
+        Open a catalog, creating its tables if needed
+
+        :param db_path: Path of the SQLite database
+        :param root: Statement root folder
+        :param accounts: Dictionary of account names to account configuration
+        """
+
+        self.db_path = db_path
+        self.root = root
+        self.accounts = accounts
+
+        with closing(self._connect()) as conn, conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS statements (
+                    path TEXT PRIMARY KEY,
+                    directory TEXT NOT NULL,
+                    account TEXT,
+                    statement_date TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS statements_date ON statements (statement_date);
+                CREATE INDEX IF NOT EXISTS statements_directory ON statements (directory);
+                CREATE TABLE IF NOT EXISTS directories (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT,
+                    mtime_ns INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+                CREATE TABLE IF NOT EXISTS ingested (
+                    content_hash TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    ingested_at TEXT NOT NULL
+                );
+            ''')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def rescan(self):
+        """
+        Bring the catalog up to date with the statement root
+
+        :return: Number of statements added or updated
+        """
+
+        changed = 0
+        with closing(self._connect()) as conn, conn:
+            pending = [('', None)]
+            seen = set()
+            while pending:
+                directory, parent = pending.pop()
+                seen.add(directory)
+                changed += self._scan_directory(conn, directory, parent, pending)
+
+            # Forget directories that no longer exist along with their statements
+            for (directory,) in conn.execute('SELECT path FROM directories').fetchall():
+                if directory not in seen:
+                    conn.execute('DELETE FROM directories WHERE path = ?', (directory,))
+                    conn.execute('DELETE FROM statements WHERE directory = ?', (directory,))
+
+        return changed
+
+    def _scan_directory(self, conn: sqlite3.Connection, directory: str, parent: str,
+                        pending: list):
+        full_path = os.path.join(self.root, directory)
+        mtime_ns = os.stat(full_path).st_mtime_ns
+        row = conn.execute('SELECT mtime_ns FROM directories WHERE path = ?',
+                           (directory,)).fetchone()
+
+        # Unchanged directories keep their files and subdirectories
+        if row is not None and row[0] == mtime_ns:
+            pending.extend((child, directory) for (child,) in conn.execute(
+                'SELECT path FROM directories WHERE parent = ?', (directory,)))
+            return 0
+
+        known = {path: (size, mtime) for path, size, mtime in conn.execute(
+            'SELECT path, size, mtime_ns FROM statements WHERE directory = ?', (directory,))}
+        changed = 0
+        present = set()
+        with os.scandir(full_path) as entries:
+            for entry in entries:
+                path = os.path.join(directory, entry.name)
+                if entry.is_dir():
+                    pending.append((path, directory))
+                    continue
+
+                statement_date = find_statement_date(entry.name)
+                if statement_date is None:
+                    continue
+                present.add(path)
+
+                stat = entry.stat()
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                conn.execute(
+                    'INSERT OR REPLACE INTO statements VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (path, directory, self._find_account(entry.name),
+                     statement_date.date().isoformat(), stat.st_size, stat.st_mtime_ns,
+                     hash_file(entry.path)))
+                changed += 1
+
+        conn.executemany('DELETE FROM statements WHERE path = ?',
+                         [(path,) for path in known if path not in present])
+        conn.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?)',
+                     (directory, parent, mtime_ns))
+
+        return changed
+
+    def _find_account(self, filename: str):
+        try:
+            return find_account_name(self.accounts, filename)
+        except NameError:
+            return None
+
+    def find_statements(self, min_date: datetime.date, max_date: datetime.date = None,
+                        skip_ingested: bool = False):
+        """
+        Find statements dated within a range
+
+        :param min_date: Minimum statement date, inclusive
+        :param max_date: Maximum statement date, inclusive, or None for no maximum
+        :param skip_ingested: Whether to leave out statements already written to the ledger
+        :return: List of tuples of statement paths relative to the root and account names,
+                 with None for statements that match no account
+        """
+
+        query = 'SELECT path, account FROM statements WHERE statement_date >= ?'
+        if skip_ingested:
+            query += ' AND content_hash NOT IN (SELECT content_hash FROM ingested)'
+        params = [min_date.strftime('%Y-%m-%d')]
+        if max_date is not None:
+            query += ' AND statement_date <= ?'
+            params.append(max_date.strftime('%Y-%m-%d'))
+
+        with closing(self._connect()) as conn:
+            return conn.execute(query + ' ORDER BY path', params).fetchall()
+
+    def mark_ingested(self, paths: list):
+        """
+        Record that the transactions of statements were written to the ledger
+
+        Statements are recorded by content so renamed or moved copies are also skipped
+
+        :param paths: Statement paths relative to the root
+        """
+
+        ingested_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with closing(self._connect()) as conn, conn:
+            for path in paths:
+                row = conn.execute('SELECT content_hash FROM statements WHERE path = ?',
+                                   (path,)).fetchone()
+                content_hash = row[0] if row is not None \
+                    else hash_file(os.path.join(self.root, path))
+                conn.execute('INSERT OR REPLACE INTO ingested VALUES (?, ?, ?)',
+                             (content_hash, path, ingested_at))
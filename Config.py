@@ -0,0 +1,217 @@
+"""Validated and compiled config.json, shared by the apps and scripts."""
+import hashlib
+import json
+import operator
+import os
+import pickle
+import threading
+
+"""
+Version of CompiledConfig, bumped when its attributes change so stale compiled files
+are ignored
+"""
+compiled_version = 1
+
+"""
+Settings under Paths that the apps and scripts read, each a file or folder path
+"""
+path_keys = ['Statement Root', 'Transactions store', 'Transactions csv', 'Statement Catalog',
+             'Statement Cache', 'Pending Store', 'Job Queue', 'Profiles']
+
+"""
+URL prefixes that serveApps mounts each app at, by module name
+"""
+mount_prefixes = {}
+
+"""
+Compiled configs already loaded in this process, by absolute path
+"""
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def validate_config(config: dict):
+    """
+    Check that config.json has the settings the apps and scripts rely on
+
+    :param config: Parsed config.json
+    :return: List of problems found, empty if the config is valid
+    """
+
+    problems = []
+
+    paths = config.get('Paths')
+    if not isinstance(paths, dict):
+        problems.append('Paths must be an object')
+    else:
+        if 'Transactions store' not in paths and 'Transactions csv' not in paths:
+            problems.append('Paths needs a Transactions store or Transactions csv')
+        if 'Statement Root' not in paths:
+            problems.append('Paths needs a Statement Root')
+        for key in path_keys:
+            if key in paths and (not isinstance(paths[key], str) or not paths[key]):
+                problems.append(f'{key} in Paths must be a path')
+
+    accounts = config.get('Accounts')
+    if not isinstance(accounts, dict) or not accounts:
+        problems.append('Accounts must be an object with at least one account')
+        accounts = {}
+    for name, account_info in accounts.items():
+        if not isinstance(account_info, dict):
+            problems.append(f'Account {name} must be an object')
+            continue
+        if 'Type' not in account_info:
+            problems.append(f'Account {name} needs a Type')
+        if 'Statement Prefix' not in account_info:
+            problems.append(f'Account {name} needs a Statement Prefix, null if it has none')
+        pages = account_info.get('Statement Pages')
+        if pages is not None and not (isinstance(pages, list) and
+                                      all(isinstance(page, int) for page in pages)):
+            problems.append(f'Statement Pages of account {name} must be a list of numbers')
+        regions = account_info.get('Statement Regions')
+        if regions is not None and not (isinstance(regions, list) and all(
+                isinstance(region, list) and len(region) == 4 for region in regions)):
+            problems.append(f'Statement Regions of account {name} must be a list of '
+                            f'[x0, top, x1, bottom] boxes')
+
+    categories = config.get('Categories')
+    if not isinstance(categories, dict):
+        problems.append('Categories must be an object')
+        categories = {}
+    for name, category_info in categories.items():
+        if not isinstance(category_info, dict) or \
+                not isinstance(category_info.get('Subcategories'), list):
+            problems.append(f'Category {name} needs a list of Subcategories')
+
+    for key in ('Import Workers', 'Statement Cache MB', 'Ledger Compact Segments'):
+        value = config.get(key)
+        if value is not None and (isinstance(value, bool) or
+                                  not isinstance(value, (int, float)) or value <= 0):
+            problems.append(f'{key} must be a positive number')
+    if not isinstance(config.get('Metrics', False), bool):
+        problems.append('Metrics must be true or false')
+
+    return problems
+
+
+class CompiledConfig:
+    """
+    config.json after validation, with the dropdown options of the layouts worked out
+
+    Reads like the parsed JSON, so config['Paths'] and config.get('Metrics') still work
+    """
+
+    def __init__(self, settings: dict):
+        """
+        :param settings: Parsed and validated config.json
+        """
+
+        self.settings = settings
+        self.account_options = [{'label': account, 'value': account}
+                                for account in settings['Accounts']]
+        self.category_options = sorted(
+            [{'label': category, 'value': category} for category in settings['Categories']],
+            key=operator.itemgetter('label'))
+        self.subcategories = {category: category_info['Subcategories']
+                              for category, category_info in settings['Categories'].items()}
+
+        # Subcategory choices of the import table, one per category
+        self.subcategory_dropdowns = [{
+            'if': {
+                'column_id': 'subcategory',
+                'filter_query': f'{{category}} eq "{category}"'
+            },
+            'options': sorted([{'label': subcategory, 'value': subcategory}
+                               for subcategory in subcategories],
+                              key=operator.itemgetter('label'))
+        } for category, subcategories in self.subcategories.items()]
+
+    def __getitem__(self, key: str):
+        return self.settings[key]
+
+    def __contains__(self, key: str):
+        return key in self.settings
+
+    def get(self, key: str, default=None):
+        """
+        Get a top level setting
+
+        :param key: Setting name
+        :param default: Value if the setting is missing
+        :return: Value of the setting
+        """
+
+        return self.settings.get(key, default)
+
+
+def compiled_path(config_path: str):
+    """
+    Get the path the compiled form of a config is kept at
+
+    :param config_path: Path of config.json
+    :return: Path of the compiled config
+    """
+
+    return os.path.splitext(config_path)[0] + '.compiled'
+
+
+def load_config(config_path: str = 'config.json'):
+    """
+    Load, validate and compile config.json, only doing the work again if it changed
+
+    Compiled configs are kept in memory so apps served from one process share them, and
+    pickled next to the config keyed by a hash of its contents for the next start
+
+    :param config_path: Path of config.json
+    :return: CompiledConfig
+    :raises ValueError: If the config is missing settings or has invalid values
+    """
+
+    with open(config_path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    with _loaded_lock:
+        loaded = _loaded.get(os.path.abspath(config_path))
+        if loaded is not None and loaded[0] == digest:
+            return loaded[1]
+
+        config = None
+        try:
+            with open(compiled_path(config_path), 'rb') as f:
+                compiled = pickle.load(f)
+            if compiled['version'] == compiled_version and compiled['digest'] == digest:
+                config = compiled['config']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError):
+            pass
+
+        if config is None:
+            settings = json.loads(content)
+            problems = validate_config(settings)
+            if problems:
+                raise ValueError(f'Invalid {config_path}:\n' + '\n'.join(problems))
+            config = CompiledConfig(settings)
+
+            # Failing to save only costs compiling again on the next start
+            temp_path = f'{compiled_path(config_path)}.{os.getpid()}.tmp'
+            try:
+                with open(temp_path, 'wb') as f:
+                    pickle.dump({'version': compiled_version, 'digest': digest,
+                                 'config': config}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, compiled_path(config_path))
+            except OSError:
+                pass
+
+        _loaded[os.path.abspath(config_path)] = (digest, config)
+        return config
+
+
+def app_prefix(module: str):
+    """
+    Get the URL prefix an app's pages are requested under
+
+    :param module: Module name of the app
+    :return: Prefix set by serveApps, or '/' when the app runs on its own
+    """
+
+    return mount_prefixes.get(module, '/')
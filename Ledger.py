@@ -0,0 +1,1480 @@
+"""Persistence for the transaction ledger."""
+from collections import deque
+from contextlib import contextmanager
+from decimal import Decimal
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from Metrics import metrics
+from Records import TransactionBatch
+
+"""
+Columns the ledger is kept sorted by
+"""
+sort_columns = ['date', 'account']
+
+"""
+Columns with few distinct values that are stored as categoricals
+"""
+categorical_columns = ['account', 'category', 'subcategory']
+
+
+def normalize_ledger(transactions_df: pd.DataFrame):
+    """
+    Convert transaction columns to the explicit dtypes used by the ledger
+
+    Dates become datetime64, amounts are rounded to cents and low cardinality text columns
+    become categoricals
+
+    :param transactions_df: DataFrame containing transactions
+    :return: DataFrame with normalized dtypes
+    """
+
+    transactions_df = transactions_df.copy()
+    if 'date' in transactions_df:
+        transactions_df['date'] = pd.to_datetime(transactions_df['date'])
+    if 'amount' in transactions_df:
+        transactions_df['amount'] = transactions_df['amount'].astype('float64').round(2)
+    for column in categorical_columns:
+        if column in transactions_df:
+            transactions_df[column] = transactions_df[column].astype('category')
+
+    return transactions_df
+
+
+class CsvStorage:
+    """
+    Plain text storage, mainly for importing and exporting ledgers
+    """
+
+    extension = '.csv'
+
+    def read(self, path: str, columns: list = None):
+        """
+        Read transactions from a file
+
+        :param path: Path of the file
+        :param columns: Columns to read, or None for all columns
+        :return: DataFrame containing transactions
+        """
+
+        return normalize_ledger(pd.read_csv(path, usecols=columns))
+
+    def write(self, transactions_df: pd.DataFrame, path: str):
+        """
+        Write transactions to a file
+
+        :param transactions_df: DataFrame containing transactions
+        :param path: Path of the file
+        """
+
+        transactions_df.to_csv(path, index=False, date_format='%Y-%m-%d')
+
+
+class ArrowStorage:
+    """
+    Columnar binary storage that keeps explicit dtypes
+
+    Amounts are stored as integer cents so they keep a fixed precision, and only the
+    requested columns are read from disk
+    """
+
+    def __init__(self, file_format: str = 'parquet'):
+        """
+        :param file_format: Either parquet or feather
+        :raises ValueError: If the file format is not supported
+        """
+
+        if file_format not in ('parquet', 'feather'):
+            raise ValueError(f'Unsupported file format {file_format}')
+        self.file_format = file_format
+        self.extension = f'.{file_format}'
+
+    def read(self, path: str, columns: list = None):
+        """
+        Read transactions from a file
+
+        :param path: Path of the file
+        :param columns: Columns to read, or None for all columns
+        :return: DataFrame containing transactions
+        """
+
+        if self.file_format == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(path, columns=columns)
+        else:
+            import pyarrow.feather as feather
+            table = feather.read_table(path, columns=columns)
+
+        transactions_df = table.to_pandas()
+        if 'amount' in transactions_df:
+            transactions_df['amount'] = transactions_df['amount'] / 100
+
+        return transactions_df
+
+    def write(self, transactions_df: pd.DataFrame, path: str):
+        """
+        Write transactions to a file
+
+        :param transactions_df: DataFrame containing transactions
+        :param path: Path of the file
+        """
+
+        import pyarrow as pa
+
+        transactions_df = normalize_ledger(transactions_df)
+        if 'amount' in transactions_df:
+            transactions_df['amount'] = (transactions_df['amount'] * 100).round().astype('int64')
+        table = pa.Table.from_pandas(transactions_df, preserve_index=False)
+
+        if self.file_format == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, path)
+
+
+def storage_for_path(path: str):
+    """
+    Pick a storage backend from a file extension
+
+    :param path: Path of the ledger file
+    :return: Storage backend for the file
+    :raises ValueError: If the extension is not supported
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return CsvStorage()
+    if extension in ('.parquet', '.feather'):
+        return ArrowStorage(extension[1:])
+
+    raise ValueError(f'Unsupported ledger file extension {extension}')
+
+
+def sort_ledger(transactions_df: pd.DataFrame):
+    """
+    Sort transactions by date and account, keeping the existing order of ties
+
+    :param transactions_df: DataFrame containing transactions
+    :return: Sorted DataFrame
+    """
+
+    return transactions_df.sort_values(by=sort_columns, kind='mergesort', ignore_index=True)
+
+
+def is_sorted_ledger(transactions_df: pd.DataFrame):
+    """
+    Check that transactions are already in the order sort_ledger would put them in
+
+    :param transactions_df: DataFrame containing transactions
+    :return: Whether the rows are sorted by date and account
+    """
+
+    dates = transactions_df['date']
+    accounts = transactions_df['account']
+    if not dates.is_monotonic_increasing or dates.isna().any() or accounts.isna().any():
+        return False
+
+    # Categoricals sort by their codes, anything else by its text
+    if isinstance(accounts.dtype, pd.CategoricalDtype):
+        accounts = accounts.cat.codes.to_numpy()
+    else:
+        accounts = accounts.astype(str).to_numpy()
+    same_date = dates.to_numpy()[1:] == dates.to_numpy()[:-1]
+    return bool((accounts[1:][same_date] >= accounts[:-1][same_date]).all())
+
+
+def insertion_points(transactions_df: pd.DataFrame, dates: np.ndarray,
+                     entries_df: pd.DataFrame):
+    """
+    Find where sorted new rows go in a sorted ledger, the same way as sort_ledger would
+    place them after the existing rows
+
+    Each row is found with a binary search on the dates, then on the accounts of the rows
+    sharing its date, so the cost depends on the number of new rows
+
+    :param transactions_df: Sorted DataFrame containing the existing transactions
+    :param dates: Dates of the existing transactions as datetime64
+    :param entries_df: Sorted DataFrame containing the new transactions
+    :return: Array of the position of the existing row each new row goes before
+    """
+
+    new_dates = entries_df['date'].to_numpy(dtype='datetime64[ns]')
+    first = np.searchsorted(dates, new_dates, side='left')
+    last = np.searchsorted(dates, new_dates, side='right')
+
+    # Ties on the date are broken by the account, keeping existing rows first
+    before = last.copy()
+    accounts = entries_df['account'].astype(str).to_numpy()
+    for row in np.flatnonzero(last > first):
+        same_date = transactions_df['account'].iloc[first[row]:last[row]].astype(str)
+        before[row] = first[row] + np.searchsorted(same_date.to_numpy(), accounts[row],
+                                                   side='right')
+
+    return before
+
+
+def fsync_path(path: str):
+    """
+    Flush a file or folder to disk so it survives a crash
+
+    :param path: Path of the file or folder
+    """
+
+    # Folders can't be opened on Windows, where renames are durable anyway
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (IsADirectoryError, PermissionError):
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def process_alive(pid: int):
+    """
+    Check whether a process is still running
+
+    :param pid: Process id
+    :return: Whether the process is running, always True on Windows where it can't be
+             checked without side effects
+    """
+
+    if pid == os.getpid() or fcntl is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock:
+    """
+    Advisory lock on a file, shared between processes and between threads
+
+    Every acquisition opens the lock file again, so threads of the same process also
+    exclude each other. Windows only supports exclusive locks, so shared locks are
+    exclusive there.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the lock file, created if needed
+        """
+
+        self.path = path
+
+    @contextmanager
+    def _locked(self, shared: bool):
+        with open(self.path, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def shared(self):
+        """
+        Hold the lock together with other readers
+
+        :return: Context manager holding the lock
+        """
+
+        return self._locked(shared=True)
+
+    def exclusive(self):
+        """
+        Hold the lock alone
+
+        :return: Context manager holding the lock
+        """
+
+        return self._locked(shared=False)
+
+
+class LedgerWriter:
+    """
+    Append-only writer for the ledger
+
+    New rows are written as small sorted segment files next to the main file, so a write
+    only costs as much as the rows added. Once enough segments build up they are merged
+    into the main file in a background thread.
+
+    Writes from every process take an exclusive file lock and are first appended to a
+    journal and flushed to disk, so rows acknowledged as written survive a crash in the
+    middle of writing a segment. Reads take a shared lock so they never see a
+    half-finished compaction.
+    """
+
+    def __init__(self, path: str, compact_segments: int = 20, storage=None):
+        """
+        Open a ledger, finishing any write or compaction interrupted by a crash
+
+        :param path: Path of the main ledger file
+        :param compact_segments: Number of segments that triggers a background compaction
+        :param storage: Storage backend, or None to pick one from the file extension
+        """
+
+        self.path = path
+        self.storage = storage if storage is not None else storage_for_path(path)
+        self.segment_folder = f'{path}.segments'
+        self.compact_segments = compact_segments
+        self._lock = threading.Lock()
+        self._compaction = None
+        self.compaction_listeners = []
+
+        os.makedirs(self.segment_folder, exist_ok=True)
+        self.file_lock = FileLock(os.path.join(self.segment_folder, 'ledger.lock'))
+        with self._lock, self.file_lock.exclusive():
+            self._recover()
+
+    @property
+    def _journal_path(self):
+        return os.path.join(self.segment_folder, 'compaction.json')
+
+    @property
+    def _write_journal_path(self):
+        return os.path.join(self.segment_folder, 'journal.jsonl')
+
+    def _compacted_path(self, name: str):
+        return f'{self.path}.compacted-{name}'
+
+    def _recover(self):
+        # The listed segments are only part of the main file if it was replaced by the
+        # compacted file, which is checked against the signatures taken before the swap.
+        # Otherwise the main file is untouched and the segments are kept.
+        if os.path.exists(self._journal_path):
+            with open(self._journal_path) as f:
+                compaction = json.load(f)
+            compacted_path = self._compacted_path(compaction['name'])
+            if os.path.exists(compacted_path):
+                os.remove(compacted_path)
+            elif self._stat(self.path) != tuple(compaction['previous']) and \
+                    self._stat(self.path) == tuple(compaction['compacted']):
+                self._remove_segments(compaction['segments'])
+            os.remove(self._journal_path)
+
+        # Leftovers of compactions that never reached the swap, leaving alone the files of
+        # compactions still running in other processes
+        folder, basename = os.path.split(os.path.abspath(self.path))
+        for filename in os.listdir(folder):
+            if not filename.startswith(f'{basename}.compacted'):
+                continue
+            name = filename[len(f'{basename}.compacted-'):]
+            pid = name.split('-')[0]
+            if not pid.isdigit() or not process_alive(int(pid)):
+                os.remove(os.path.join(folder, filename))
+
+        self._replay_journal()
+
+    def _replay_journal(self):
+        # Write journaled rows whose segment never made it to disk. Writers remove their
+        # journal before releasing the exclusive lock, so with the lock held any journal
+        # left is from a writer that crashed.
+        if not os.path.exists(self._write_journal_path):
+            return
+        with open(self._write_journal_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # Torn final record of a write that was never acknowledged
+                if not os.path.exists(os.path.join(self.segment_folder, record['segment'])):
+                    self._write_segment(record['segment'],
+                                        normalize_ledger(pd.DataFrame(record['rows'])))
+        os.remove(self._write_journal_path)
+
+    def _remove_segments(self, segments: list):
+        for segment in segments:
+            try:
+                os.remove(os.path.join(self.segment_folder, segment))
+            except FileNotFoundError:
+                pass
+
+    def segments(self):
+        """
+        List segment files that have not been compacted yet, oldest first
+
+        :return: List of segment filenames
+        """
+
+        return sorted(filename for filename in os.listdir(self.segment_folder)
+                      if filename.startswith('segment-')
+                      and filename.endswith(self.storage.extension))
+
+    def _stat(self, path: str):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def signature(self):
+        """
+        Get the modification times and sizes of the files making up the ledger
+
+        :return: Tuple of the main file's signature and a dictionary of segment filenames
+                 to their signatures
+        """
+
+        with self._lock, self.file_lock.shared():
+            return (self._stat(self.path),
+                    {segment: self._stat(os.path.join(self.segment_folder, segment))
+                     for segment in self.segments()})
+
+    def _read_segments(self, segments: list, columns: list = None):
+        return [self.storage.read(os.path.join(self.segment_folder, segment), columns)
+                for segment in segments]
+
+    def read(self, columns: list = None):
+        """
+        Read the whole ledger, including rows that are not compacted yet
+
+        :param columns: Columns to read, or None for all columns
+        :return: DataFrame containing transactions sorted by date and account
+        """
+
+        with self._lock, self.file_lock.shared():
+            transactions_df = self.storage.read(self.path, columns)
+            segments = self.segments()
+            if not segments:
+                # The main file is only sorted once it has been compacted
+                if set(sort_columns).issubset(transactions_df.columns) and \
+                        not is_sorted_ledger(transactions_df):
+                    return sort_ledger(transactions_df)
+                return transactions_df
+            segment_dfs = self._read_segments(segments, columns)
+
+        transactions_df = pd.concat([transactions_df] + segment_dfs, ignore_index=True,
+                                    sort=False)
+        if not set(sort_columns).issubset(transactions_df.columns):
+            return transactions_df
+        return normalize_ledger(sort_ledger(transactions_df))
+
+    def _write_segment(self, segment: str, entries_df: pd.DataFrame):
+        path = os.path.join(self.segment_folder, segment)
+        self.storage.write(entries_df, f'{path}.tmp')
+        fsync_path(f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+        fsync_path(self.segment_folder)
+
+    def append(self, entries_df: pd.DataFrame):
+        """
+        Persist new transactions as a sorted segment
+
+        The rows are journaled and flushed to disk before the segment is written, so
+        callers can batch several writes into one call to share the cost of flushing
+
+        :param entries_df: DataFrame containing transactions to be added
+        :return: Tuple of the segment filename and its signature, or None if there was
+                 nothing to write
+        """
+
+        if entries_df.empty:
+            return None
+
+        entries_df = sort_ledger(normalize_ledger(entries_df))
+        with self._lock, self.file_lock.exclusive(), metrics.stage('ledger_write'):
+            # Rows of another process that crashed since this ledger was opened
+            self._replay_journal()
+
+            segment = f'segment-{time.time_ns():020d}{self.storage.extension}'
+            rows = entries_df.to_json(orient='records', date_format='iso')
+            with open(self._write_journal_path, 'a') as f:
+                f.write(f'{{"segment": {json.dumps(segment)}, "rows": {rows}}}\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._write_segment(segment, entries_df)
+            os.remove(self._write_journal_path)
+
+            segment_signature = self._stat(os.path.join(self.segment_folder, segment))
+            num_segments = len(self.segments())
+
+        if num_segments >= self.compact_segments:
+            self.compact_in_background()
+
+        return segment, segment_signature
+
+    def compact_in_background(self):
+        """
+        Start merging segments into the main file unless a compaction is already running
+        """
+
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+
+        self._compaction = threading.Thread(target=self.compact, daemon=True)
+        self._compaction.start()
+
+    def compact(self):
+        """
+        Merge all current segments into the main file
+
+        The merge only holds a shared lock, so other processes can keep reading while
+        writes wait. If another process compacted in the meantime, or the merged file is
+        gone, this merge is dropped. Listeners in compaction_listeners are called with the
+        main file's signature before and after the merge, and the merged segment
+        filenames. They are called before the locks are released, so no reader sees the
+        swapped files first, and must not block.
+        """
+
+        # Merge without holding the exclusive lock so reads can continue
+        name = f'{os.getpid()}-{time.time_ns()}'
+        with self.file_lock.shared():
+            segments = self.segments()
+            if not segments:
+                return
+            previous_signature = self._stat(self.path)
+            transactions_df = pd.concat(
+                [self.storage.read(self.path)] + self._read_segments(segments),
+                ignore_index=True, sort=False)
+            self.storage.write(sort_ledger(transactions_df), self._compacted_path(name))
+            fsync_path(self._compacted_path(name))
+
+        # Swap in the merged file, journaling first so a crash can't duplicate or lose rows
+        with self._lock, self.file_lock.exclusive():
+            compacted_path = self._compacted_path(name)
+            if not os.path.exists(compacted_path):
+                return
+            if self._stat(self.path) != previous_signature or \
+                    not set(segments).issubset(self.segments()):
+                os.remove(compacted_path)
+                return
+            new_signature = self._stat(compacted_path)
+            with open(self._journal_path, 'w') as f:
+                json.dump({'name': name, 'segments': segments,
+                           'previous': previous_signature, 'compacted': new_signature}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(compacted_path, self.path)
+            fsync_path(os.path.dirname(os.path.abspath(self.path)))
+            self._remove_segments(segments)
+            os.remove(self._journal_path)
+
+            for listener in self.compaction_listeners:
+                listener(previous_signature, new_signature, segments)
+
+
+def amounts_to_cents(amounts: pd.Series):
+    """
+    Convert amounts to whole cents so they can be summed exactly
+
+    :param amounts: Series of amounts in dollars
+    :return: Series of integer cents, with missing amounts as 0
+    """
+
+    return (amounts.astype('float64').fillna(0) * 100).round().astype('int64')
+
+
+class BalanceIndex:
+    """
+    Running balance of every account, kept in integer cents
+    """
+
+    def __init__(self, transactions_df: pd.DataFrame = None):
+        """
+        :param transactions_df: DataFrame containing transactions to build the balances from
+        """
+
+        self.cents = {}
+        if transactions_df is not None:
+            self.build(transactions_df)
+
+    def _sum_by_account(self, transactions_df: pd.DataFrame):
+        if transactions_df.empty:
+            return {}
+        cents = amounts_to_cents(transactions_df['amount'])
+        return cents.groupby(transactions_df['account'].astype(str), sort=False).sum().to_dict()
+
+    def build(self, transactions_df: pd.DataFrame):
+        """
+        Calculate every balance in a single grouped pass
+
+        :param transactions_df: DataFrame containing all transactions
+        """
+
+        self.cents = {account: int(cents)
+                      for account, cents in self._sum_by_account(transactions_df).items()}
+
+    def update(self, entries_df: pd.DataFrame):
+        """
+        Add new transactions to the balances
+
+        :param entries_df: DataFrame containing only the new transactions
+        """
+
+        for account, cents in self._sum_by_account(entries_df).items():
+            self.cents[account] = self.cents.get(account, 0) + int(cents)
+
+    def balance(self, account: str):
+        """
+        Get the balance of an account
+
+        :param account: Account name
+        :return: Balance as a Decimal with two decimal places
+        """
+
+        return Decimal(self.cents.get(account, 0)).scaleb(-2)
+
+
+"""
+Columns the rollup cells are grouped by
+"""
+rollup_dimensions = ['month', 'account', 'category', 'subcategory']
+
+
+class RollupCube:
+    """
+    Sums and counts of transactions by month, account, category and subcategory
+
+    Charts are drawn from these cells instead of scanning the ledger, and new transactions
+    are added to the cells they fall in. Months are kept as integers like 202203 and
+    amounts as integer cents.
+    """
+
+    def __init__(self, transactions_df: pd.DataFrame = None):
+        """
+        :param transactions_df: DataFrame containing transactions to build the cells from
+        """
+
+        self.cells = self._roll_up(pd.DataFrame(columns=['date', 'account', 'amount']))
+        if transactions_df is not None:
+            self.build(transactions_df)
+
+    def _roll_up(self, transactions_df: pd.DataFrame):
+        dates = pd.to_datetime(transactions_df['date'])
+        keys = pd.DataFrame({
+            'month': (dates.dt.year * 100 + dates.dt.month).astype('int64'),
+            'account': transactions_df['account'].astype(str),
+        }, index=transactions_df.index)
+
+        # Uncategorized transactions are kept under empty names
+        for column in ['category', 'subcategory']:
+            if column in transactions_df:
+                keys[column] = transactions_df[column].astype(object).fillna('').astype(str)
+            else:
+                keys[column] = ''
+        keys['cents'] = amounts_to_cents(transactions_df['amount'])
+        keys['count'] = 1
+
+        return keys.groupby(rollup_dimensions, sort=True)[['cents', 'count']].sum()
+
+    def build(self, transactions_df: pd.DataFrame):
+        """
+        Calculate every cell in a single grouped pass
+
+        :param transactions_df: DataFrame containing all transactions
+        """
+
+        self.cells = self._roll_up(transactions_df)
+
+    def update(self, entries_df: pd.DataFrame):
+        """
+        Add new transactions to their cells
+
+        :param entries_df: DataFrame containing only the new transactions
+        """
+
+        if entries_df.empty:
+            return
+        self.cells = self.cells.add(self._roll_up(entries_df), fill_value=0) \
+            .astype('int64').sort_index()
+
+    def query(self, by: str = 'category', accounts: list = None, category: str = None,
+              start_month: int = None, end_month: int = None):
+        """
+        Total the cells by month and one other dimension
+
+        :param by: Dimension to group by besides the month
+        :param accounts: Accounts to include, or None for every account
+        :param category: Category to include, or None for every category
+        :param start_month: First month to include as an integer like 202203, or None
+        :param end_month: Last month to include as an integer like 202203, or None
+        :return: DataFrame with month, the grouped dimension, amount and count columns
+        """
+
+        cells = self.cells.reset_index()
+        mask = pd.Series(True, index=cells.index)
+        if accounts:
+            mask &= cells['account'].isin(accounts)
+        if category is not None:
+            mask &= cells['category'] == category
+        if start_month is not None:
+            mask &= cells['month'] >= start_month
+        if end_month is not None:
+            mask &= cells['month'] <= end_month
+
+        totals = cells[mask].groupby(['month', by], sort=True)[['cents', 'count']] \
+            .sum().reset_index()
+        totals['amount'] = totals.pop('cents') / 100
+
+        return totals
+
+
+def merchant_keys(stores: pd.Series):
+    """
+    Normalize store names into keys that match variants of the same merchant
+
+    Case, digits such as store numbers and punctuation are ignored. Besides the full name,
+    the first two words and the first word (if it is long enough) are used as fallbacks.
+
+    :param stores: Series of store names
+    :return: DataFrame with one column of keys per level, from most to least specific,
+             and empty keys where a level doesn't apply
+    """
+
+    names = stores.astype(object).fillna('').astype(str).str.upper()
+    names = names.str.replace(r'[^A-Z&]+', ' ', regex=True).str.strip()
+    words = names.str.split(' ', n=2, expand=True).reindex(columns=range(3)).fillna('')
+
+    two_words = (words[0] + ' ' + words[1]).str.strip()
+    one_word = words[0].where(words[0].str.len() >= 4, '')
+
+    return pd.DataFrame({'name': names, 'two_words': two_words, 'one_word': one_word},
+                        index=stores.index)
+
+
+class MerchantIndex:
+    """
+    Most frequent category and subcategory of each merchant in the ledger
+
+    Counts are kept for every key level of merchant_keys so imported stores are matched
+    on their full name first, then on their leading words
+    """
+
+    def __init__(self, transactions_df: pd.DataFrame = None):
+        """
+        :param transactions_df: DataFrame containing transactions to build the index from
+        """
+
+        self.counts = {}
+        self.best = {}
+        if transactions_df is not None:
+            self.build(transactions_df)
+
+    def _count(self, transactions_df: pd.DataFrame, weights: pd.Series = None):
+        if transactions_df.empty or not {'store', 'category'}.issubset(transactions_df):
+            return {}
+        categories = transactions_df['category'].astype(object).fillna('').astype(str)
+        categorized = categories != ''
+        if not categorized.any():
+            return {}
+        subcategories = transactions_df.get('subcategory', pd.Series('', index=categories.index))
+        if weights is None:
+            weights = pd.Series(1, index=categories.index)
+        labels = pd.DataFrame({
+            'category': categories[categorized],
+            'subcategory': subcategories[categorized].astype(object).fillna('').astype(str),
+            'weight': weights[categorized].astype('int64'),
+        })
+
+        # Each distinct store name is only normalized once, after adding up its labels
+        codes, uniques = pd.factorize(transactions_df.loc[categorized, 'store']
+                                      .astype(object).fillna(''))
+        labels = labels.assign(store=codes).groupby(
+            ['store', 'category', 'subcategory'], as_index=False, sort=False)['weight'].sum()
+        keys = merchant_keys(pd.Series(uniques, dtype=object))
+        counts = {}
+        for level in keys.columns:
+            level_df = labels.assign(key=keys[level].to_numpy()[labels['store'].to_numpy()])
+            level_df = level_df[level_df['key'] != '']
+            counts[level] = level_df.groupby(['key', 'category', 'subcategory'])['weight'].sum()
+
+        return counts
+
+    def _pick_best(self, level: str, keys):
+        # Ties go to the alphabetically first category and subcategory
+        level_counts = self.counts[level]
+        best = self.best.setdefault(level, {})
+        for key in keys:
+            best[key] = min(level_counts[key].items(), key=lambda item: (-item[1], item[0]))[0]
+
+    def build(self, transactions_df: pd.DataFrame, weights: pd.Series = None):
+        """
+        Count the categories of every merchant
+
+        :param transactions_df: DataFrame containing all transactions
+        :param weights: Number of transactions each row stands for, eg. when the rows are
+                        already grouped, or None to count every row once
+        """
+
+        self.counts = {}
+        self.best = {}
+        for level, counts in self._count(transactions_df, weights).items():
+            level_counts = self.counts[level] = {}
+            for (key, category, subcategory), weight in counts.items():
+                level_counts.setdefault(key, {})[(category, subcategory)] = int(weight)
+
+            # The counts are sorted by key and label, so a stable sort keeps the first
+            # label among ties like _pick_best
+            ranked = counts.sort_values(ascending=False, kind='mergesort').reset_index()
+            ranked = ranked.drop_duplicates('key')
+            self.best[level] = dict(zip(ranked['key'],
+                                        zip(ranked['category'], ranked['subcategory'])))
+
+    def update(self, entries_df: pd.DataFrame):
+        """
+        Add the categories of new transactions to the counts
+
+        Only the merchants of the new transactions are ranked again
+
+        :param entries_df: DataFrame containing only the new transactions
+        """
+
+        for level, counts in self._count(entries_df).items():
+            level_counts = self.counts.setdefault(level, {})
+            for (key, category, subcategory), weight in counts.items():
+                labels = level_counts.setdefault(key, {})
+                labels[(category, subcategory)] = labels.get((category, subcategory), 0) + \
+                    int(weight)
+            self._pick_best(level, counts.index.unique(level='key'))
+
+    def lookup(self, stores: pd.Series):
+        """
+        Find the most likely category and subcategory for each store
+
+        :param stores: Series of store names
+        :return: DataFrame with category and subcategory columns aligned to the stores,
+                 with None for stores that match no known merchant
+        """
+
+        # Each distinct store name is only matched once
+        codes, uniques = pd.factorize(stores.astype(object).fillna(''))
+        keys = merchant_keys(pd.Series(uniques, dtype=object))
+        categories = np.full(len(keys), None, dtype=object)
+        subcategories = np.full(len(keys), None, dtype=object)
+        for level in keys.columns:
+            if level not in self.best:
+                continue
+            missing = np.flatnonzero(pd.isna(categories))
+            if not len(missing):
+                break
+            level_best = self.best[level]
+            for position, key in zip(missing, keys[level].to_numpy()[missing]):
+                match = level_best.get(key)
+                if match is not None:
+                    categories[position], subcategories[position] = match
+
+        found = pd.DataFrame({'category': categories, 'subcategory': subcategories},
+                             dtype=object)
+        return found.take(codes).set_axis(stores.index)
+
+
+def transaction_keys(transactions_df: pd.DataFrame):
+    """
+    Hash the identifying fields of transactions
+
+    Transactions with the same account, date, amount in cents and store (ignoring case and
+    spacing) get the same key
+
+    :param transactions_df: DataFrame containing transactions
+    :return: Series of 64 bit hashes, one per transaction
+    """
+
+    stores = transactions_df['store'].astype(str).str.upper()
+    stores = stores.str.replace(r'\s+', ' ', regex=True).str.strip()
+    fields = pd.DataFrame({
+        'account': transactions_df['account'].astype(str),
+        'date': pd.to_datetime(transactions_df['date']).dt.strftime('%Y-%m-%d'),
+        'cents': amounts_to_cents(transactions_df['amount']),
+        'store': stores,
+    })
+
+    return pd.util.hash_pandas_object(fields, index=False)
+
+
+def new_positions(keys: pd.Series, counts, seen: dict):
+    """
+    Find the transactions that outnumber the identical transactions already in the ledger
+
+    :param keys: Series of transaction keys
+    :param counts: Function giving the number of transactions in the ledger for each of
+                   an array of distinct keys
+    :param seen: Counts of keys seen in earlier batches of the same import, updated in place
+    :return: Array of the positions of the new transactions
+    """
+
+    # Number each transaction among the identical ones, counting earlier batches too
+    # Only the keys of this batch are looked up, so the cost doesn't grow with the ledger
+    keys = keys.reset_index(drop=True)
+    unique = keys.unique()
+    previous = pd.Series([seen.get(key, 0) for key in unique], index=unique, dtype='int64')
+    in_ledger = pd.Series(np.asarray(counts(unique), dtype='int64'), index=unique)
+    occurrence = keys.groupby(keys, sort=False).cumcount() + 1 + keys.map(previous)
+    new = occurrence > keys.map(in_ledger)
+    for key, count in keys.value_counts(sort=False).items():
+        seen[key] = seen.get(key, 0) + count
+
+    return np.flatnonzero(new.to_numpy())
+
+
+class TransactionIndex:
+    """
+    Counts of the transactions in the ledger by their identifying fields
+
+    The keys are kept as a sorted array of hashes with their counts, so looking up a batch
+    is a binary search per transaction
+    """
+
+    def __init__(self, transactions_df: pd.DataFrame = None):
+        """
+        :param transactions_df: DataFrame containing transactions to build the index from
+        """
+
+        self.keys = np.array([], dtype=np.uint64)
+        self.key_counts = np.array([], dtype=np.int64)
+        if transactions_df is not None:
+            self.build(transactions_df)
+
+    def build(self, transactions_df: pd.DataFrame):
+        """
+        Index all transactions
+
+        :param transactions_df: DataFrame containing all transactions
+        """
+
+        self.keys = np.array([], dtype=np.uint64)
+        self.key_counts = np.array([], dtype=np.int64)
+        if transactions_df.empty:
+            return
+        self.keys, self.key_counts = np.unique(
+            transaction_keys(transactions_df).to_numpy(dtype=np.uint64), return_counts=True)
+
+    def update(self, entries_df: pd.DataFrame):
+        """
+        Add new transactions to the index
+
+        :param entries_df: DataFrame containing only the new transactions
+        """
+
+        if entries_df.empty:
+            return
+        keys, counts = np.unique(transaction_keys(entries_df).to_numpy(dtype=np.uint64),
+                                 return_counts=True)
+        positions = np.searchsorted(self.keys, keys)
+        known = positions < len(self.keys)
+        known[known] = self.keys[positions[known]] == keys[known]
+        self.key_counts[positions[known]] += counts[known]
+        self.keys = np.insert(self.keys, positions[~known], keys[~known])
+        self.key_counts = np.insert(self.key_counts, positions[~known], counts[~known])
+
+    def counts(self, keys: np.ndarray):
+        """
+        Count the transactions in the ledger with each of the given keys
+
+        :param keys: Array of transaction keys
+        :return: Array of the number of transactions with each key
+        """
+
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, self.key_counts[positions], 0)
+
+    def filter_new(self, entries: TransactionBatch, seen: dict = None):
+        """
+        Drop transactions that are already in the ledger
+
+        Repeated identical transactions are kept when there are more of them than the
+        ledger already has, eg. two identical purchases on the same day
+
+        :param entries: TransactionBatch of transactions
+        :param seen: Counts of keys seen in earlier batches of the same import, updated in
+                     place, or None if this is the only batch
+        :return: TransactionBatch of the transactions that are not in the ledger yet
+        """
+
+        if not len(entries):
+            return entries
+
+        seen = {} if seen is None else seen
+        keys = transaction_keys(entries.to_frame())
+        return entries.take(new_positions(keys, self.counts, seen))
+
+
+"""
+Columns with a secondary index in the ledger index
+"""
+indexed_columns = ['account', 'category']
+
+
+class LedgerIndex:
+    """
+    Row positions of the sorted ledger by date, account and category
+
+    The ledger is sorted by date so a date range is a contiguous run of positions found
+    by binary search. Each account and category keeps its row positions in ledger order,
+    so the rows of one account within a date range are another pair of binary searches.
+    """
+
+    def __init__(self, transactions_df: pd.DataFrame = None):
+        """
+        :param transactions_df: Sorted DataFrame containing transactions to index
+        """
+
+        self.dates = np.array([], dtype='datetime64[ns]')
+        self.positions = {column: {} for column in indexed_columns}
+        if transactions_df is not None:
+            self.build(transactions_df)
+
+    def _group_positions(self, transactions_df: pd.DataFrame, column: str,
+                         positions: np.ndarray):
+        if column not in transactions_df or not len(positions):
+            return {}
+        values = transactions_df[column].iloc[positions].to_numpy(dtype=object)
+        codes, uniques = pd.factorize(pd.Series(values).fillna(''))
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+        return {str(value): positions[order[bounds[code]:bounds[code + 1]]]
+                for code, value in enumerate(uniques)}
+
+    def build(self, transactions_df: pd.DataFrame):
+        """
+        Index every row
+
+        :param transactions_df: Sorted DataFrame containing all transactions
+        """
+
+        if 'date' not in transactions_df:
+            self.dates = np.array([], dtype='datetime64[ns]')
+            self.positions = {column: {} for column in indexed_columns}
+            return
+        self.dates = transactions_df['date'].to_numpy(dtype='datetime64[ns]')
+        all_positions = np.arange(len(transactions_df))
+        self.positions = {column: self._group_positions(transactions_df, column, all_positions)
+                          for column in indexed_columns}
+
+    def update(self, transactions_df: pd.DataFrame, before: np.ndarray):
+        """
+        Move indexed rows to their new positions and index the added rows
+
+        Only the rows after the first insertion point move, so adding recent transactions
+        leaves most of each position array untouched
+
+        :param transactions_df: Sorted DataFrame containing all transactions
+        :param before: Sorted positions of the previous rows each added row was inserted
+                       before, from insertion_points
+        """
+
+        if not len(before):
+            return
+        added = before + np.arange(len(before))
+        self.dates = np.insert(self.dates, before, transactions_df['date'].iloc[added]
+                               .to_numpy(dtype='datetime64[ns]'))
+
+        # A previous row moves down by the number of rows inserted at or before it
+        for column, index in self.positions.items():
+            for value, positions in index.items():
+                start = np.searchsorted(positions, before[0])
+                if start < len(positions):
+                    moved = positions[start:]
+                    index[value] = np.concatenate([
+                        positions[:start],
+                        moved + np.searchsorted(before, moved, side='right')])
+            for value, positions in self._group_positions(transactions_df, column,
+                                                          added).items():
+                if value in index:
+                    index[value] = np.insert(index[value],
+                                             np.searchsorted(index[value], positions),
+                                             positions)
+                else:
+                    index[value] = positions
+
+    def query(self, start=None, end=None, accounts: list = None, categories: list = None):
+        """
+        Find the rows in a date range, optionally only for some accounts and categories
+
+        :param start: First date to include, or None for no minimum
+        :param end: Last date to include, or None for no maximum
+        :param accounts: Accounts to include, or None for every account
+        :param categories: Categories to include, with '' for uncategorized rows, or None
+                           for every category
+        :return: Array of row positions in ledger order
+        """
+
+        first = 0 if start is None else \
+            np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side='left')
+        last = len(self.dates) if end is None else \
+            np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), side='right')
+
+        result = None
+        for column, values in (('account', accounts), ('category', categories)):
+            if values is None:
+                continue
+            runs = []
+            for value in values:
+                positions = self.positions[column].get(value, np.array([], dtype=np.int64))
+                runs.append(positions[np.searchsorted(positions, first):
+                                      np.searchsorted(positions, last)])
+            matched = np.sort(np.concatenate(runs)) if runs else np.array([], dtype=np.int64)
+            result = matched if result is None else \
+                np.intersect1d(result, matched, assume_unique=True)
+
+        return np.arange(first, last) if result is None else result
+
+
+"""
+Number of written rows the resident ledger buffers before merging them into its sorted
+frame
+"""
+tail_rows = 1000
+
+
+class ResidentLedger:
+    """
+    Ledger kept in memory for the lifetime of an app process
+
+    Writes update the in-memory copy in place. The backing files are only read again
+    when another process changes them, which is detected from modification times and
+    sizes.
+
+    Written rows are kept in a small sorted tail, so a write only updates the indexes
+    with its own rows. The tail is merged into the sorted frame once it grows past
+    tail_rows or the whole frame is read.
+    """
+
+    def __init__(self, writer: LedgerWriter):
+        """
+        Load the ledger
+
+        :param writer: Writer for the backing ledger files
+        """
+
+        self.writer = writer
+        self.reloads = 0
+        self._lock = threading.RLock()
+        self._pending_lock = threading.Lock()
+        self._pending = []
+        self._transactions_df = None
+        self._tail_df = None
+        self._signature = None
+        self._compactions = deque()
+        self.balances = BalanceIndex()
+        self.transaction_index = None
+        self.rollups = RollupCube()
+        self.ledger_index = LedgerIndex()
+        self.merchants = None
+
+        writer.compaction_listeners.append(self._on_compacted)
+        self.reload()
+
+    def reload(self):
+        """
+        Read the whole ledger from the backing files
+        """
+
+        with self._lock:
+            # Take the signature first so a change during the read causes another reload
+            self._compactions.clear()
+            self._signature = self.writer.signature()
+            with metrics.stage('ledger_read'):
+                self._transactions_df = self.writer.read()
+            self._tail_df = None
+            self.transaction_index = None
+            self.merchants = None
+            with metrics.stage('index_build'):
+                self.balances.build(self._transactions_df)
+                self.rollups.build(self._transactions_df)
+                self.ledger_index.build(self._transactions_df)
+            self.reloads += 1
+            metrics.count('ledger_reloads')
+
+    def _refresh(self):
+        signature = self.writer.signature()
+        if signature == self._signature:
+            return
+
+        # Our own compactions don't change the contents so there's no need to reload
+        while self._compactions:
+            previous_signature, new_signature, segments = self._compactions.popleft()
+            main_signature, segment_signatures = self._signature
+            if main_signature != previous_signature or \
+                    not set(segments).issubset(segment_signatures):
+                continue
+            self._signature = (new_signature,
+                               {segment: segment_signature
+                                for segment, segment_signature in segment_signatures.items()
+                                if segment not in segments})
+        if signature != self._signature:
+            self.reload()
+
+    def _on_compacted(self, previous_signature: tuple, new_signature: tuple, segments: list):
+        # Called with the writer's locks held, so only queue the compaction for _refresh
+        self._compactions.append((previous_signature, new_signature, segments))
+
+    @property
+    def account_balances(self):
+        """
+        Balances of every account, rebuilt if the backing files changed
+        """
+
+        with self._lock:
+            self._refresh()
+            return self.balances
+
+    @property
+    def category_rollups(self):
+        """
+        Monthly totals by account, category and subcategory, rebuilt if the backing files
+        changed
+        """
+
+        with self._lock:
+            self._refresh()
+            return self.rollups
+
+    @property
+    def merchant_categories(self):
+        """
+        Most frequent category of each merchant, rebuilt if the backing files changed
+        """
+
+        with self._lock:
+            self._refresh()
+
+            # Only imports categorize transactions, so the index is built on first use
+            if self.merchants is None:
+                with metrics.stage('index_build'):
+                    self.merchants = MerchantIndex(self._merge_tail())
+            return self.merchants
+
+    def filter_new(self, entries: TransactionBatch, seen: dict = None):
+        """
+        Drop transactions that are already in the ledger, checking for outside changes first
+
+        :param entries: TransactionBatch of transactions
+        :param seen: Counts of keys seen in earlier batches of the same import, updated in
+                     place, or None if this is the only batch
+        :return: TransactionBatch of the transactions that are not in the ledger yet
+        """
+
+        with self._lock:
+            self._refresh()
+
+            # Only imports look for duplicates, so the index is built on first use
+            if self.transaction_index is None:
+                with metrics.stage('index_build'):
+                    self.transaction_index = TransactionIndex(self._merge_tail())
+            return self.transaction_index.filter_new(entries, seen)
+
+    @property
+    def transactions(self):
+        """
+        DataFrame containing all transactions, reloaded if the backing files changed
+        """
+
+        with self._lock:
+            self._refresh()
+            return self._merge_tail()
+
+    def add(self, entries_df: pd.DataFrame):
+        """
+        Persist new transactions and add them to the in-memory ledger
+
+        Calls made while another write is in progress are committed as a group: the next
+        call to get the lock writes the rows of every waiting call with a single journal
+        flush and segment
+
+        :param entries_df: DataFrame containing transactions to be added
+        :raises Exception: Whatever the group's write raised, in every call of the group
+        """
+
+        batch = {'entries': entries_df, 'committed': False, 'error': None}
+        with self._pending_lock:
+            self._pending.append(batch)
+
+        with self._lock:
+            if batch['error'] is not None:
+                raise batch['error']
+            if batch['committed']:
+                return
+
+            with self._pending_lock:
+                group, self._pending = self._pending, []
+            try:
+                self._commit(pd.concat([waiting['entries'] for waiting in group],
+                                       ignore_index=True, sort=False))
+            except Exception as e:
+                for waiting in group:
+                    waiting['error'] = e
+                raise
+            for waiting in group:
+                waiting['committed'] = True
+            metrics.count('group_commits')
+            metrics.count('batches_committed', len(group))
+
+    def _commit(self, entries_df: pd.DataFrame):
+        self._refresh()
+        written = self.writer.append(entries_df)
+        if written is None:
+            return
+
+        # Later writes go after earlier ones with the same date and account
+        with metrics.stage('sort'):
+            entries_df = sort_ledger(entries_df)
+            self._tail_df = entries_df if self._tail_df is None else sort_ledger(
+                pd.concat([self._tail_df, entries_df], ignore_index=True, sort=False))
+        with metrics.stage('index_update'):
+            self.balances.update(entries_df)
+            if self.transaction_index is not None:
+                self.transaction_index.update(entries_df)
+            self.rollups.update(entries_df)
+            if self.merchants is not None:
+                self.merchants.update(entries_df)
+        if len(self._tail_df) >= tail_rows:
+            self._merge_tail()
+        metrics.count('rows_written', len(entries_df))
+
+        segment, segment_signature = written
+        self._signature[1][segment] = segment_signature
+
+    def _merge_tail(self):
+        # The tail is merged into the sorted ledger rather than sorting it again
+        if self._tail_df is None:
+            return self._transactions_df
+        tail_df, self._tail_df = self._tail_df, None
+
+        with metrics.stage('merge'):
+            num_previous = len(self._transactions_df)
+            rebuild = num_previous == 0 or 'date' not in self._transactions_df
+            if not rebuild:
+                before = insertion_points(self._transactions_df, self.ledger_index.dates,
+                                          tail_df)
+            transactions_df = pd.concat([self._transactions_df, tail_df],
+                                        ignore_index=True, sort=False)
+            if rebuild:
+                self._transactions_df = sort_ledger(transactions_df)
+                self.ledger_index.build(self._transactions_df)
+            else:
+                order = np.insert(np.arange(num_previous), before,
+                                  np.arange(num_previous, len(transactions_df)))
+                self._transactions_df = transactions_df.take(order).reset_index(drop=True)
+                self.ledger_index.update(self._transactions_df, before)
+
+        return self._transactions_df
+
+    def _query_tail(self, start, end, accounts: list, categories: list):
+        # Matches the rows of the tail the same way LedgerIndex.query matches the ledger
+        tail_df = self._tail_df
+        matched = pd.Series(True, index=tail_df.index)
+        if start is not None:
+            matched &= tail_df['date'] >= pd.Timestamp(start)
+        if end is not None:
+            matched &= tail_df['date'] <= pd.Timestamp(end)
+        for column, values in (('account', accounts), ('category', categories)):
+            if values is None:
+                continue
+            if column not in tail_df:
+                return tail_df.iloc[0:0]
+            matched &= tail_df[column].astype(object).fillna('').astype(str).isin(
+                [str(value) for value in values])
+        return tail_df[matched]
+
+    def query(self, start=None, end=None, accounts: list = None, categories: list = None,
+              columns: list = None):
+        """
+        Get the transactions in a date range, optionally only for some accounts and
+        categories, without scanning the whole ledger
+
+        :param start: First date to include, or None for no minimum
+        :param end: Last date to include, or None for no maximum
+        :param accounts: Accounts to include, or None for every account
+        :param categories: Categories to include, with '' for uncategorized transactions,
+                           or None for every category
+        :param columns: Columns to return, or None for all columns
+        :return: DataFrame containing the matching transactions sorted by date and account
+        """
+
+        with self._lock:
+            self._refresh()
+            positions = self.ledger_index.query(start, end, accounts, categories)
+            transactions_df = self._transactions_df
+            if columns is not None:
+                transactions_df = transactions_df[columns]
+            transactions_df = transactions_df.take(positions)
+
+            # Rows still in the tail are merged into the result only
+            if self._tail_df is not None:
+                tail_df = self._query_tail(start, end, accounts, categories)
+                if not tail_df.empty:
+                    if columns is not None:
+                        tail_df = tail_df[columns]
+                    transactions_df = pd.concat([transactions_df, tail_df], sort=False)
+                    if set(sort_columns).issubset(transactions_df.columns):
+                        transactions_df = transactions_df.sort_values(by=sort_columns,
+                                                                      kind='mergesort')
+            return transactions_df
+
+    def stats(self):
+        """
+        Get counters for the resident ledger
+
+        :return: Dictionary of the number of reloads and rows held in memory
+        """
+
+        with self._lock:
+            tail_rows_held = 0 if self._tail_df is None else len(self._tail_df)
+            return {'reloads': self.reloads,
+                    'rows': len(self._transactions_df) + tail_rows_held}
+
+
+def convert_ledger(source: str, destination: str):
+    """
+    Convert a ledger between storage backends, eg. to import or export a csv file
+
+    SQLite databases ending in .sqlite or .db can be read or written too
+
+    :param source: Path of the ledger to read, including uncompacted segments
+    :param destination: Path of the file to write, or of the database to add rows to
+    """
+
+    from LedgerDatabase import SqliteLedger
+
+    if os.path.splitext(source)[1].lower() in ('.sqlite', '.db'):
+        transactions_df = SqliteLedger(source).transactions
+    else:
+        transactions_df = LedgerWriter(source).read()
+    if set(sort_columns).issubset(transactions_df.columns) and \
+            not is_sorted_ledger(transactions_df):
+        transactions_df = sort_ledger(transactions_df)
+
+    if os.path.splitext(destination)[1].lower() in ('.sqlite', '.db'):
+        SqliteLedger(destination).add(transactions_df)
+    else:
+        storage_for_path(destination).write(transactions_df, destination)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert a ledger between file formats')
+    parser.add_argument('source', help='Ledger to read (.csv, .parquet, .feather or .sqlite)')
+    parser.add_argument('destination',
+                        help='File to write (.csv, .parquet, .feather or .sqlite)')
+    args = parser.parse_args()
+
+    convert_ledger(args.source, args.destination)
@@ -0,0 +1,322 @@
+"""SQLite storage for the transaction ledger, shared by any number of processes."""
+from contextlib import closing
+import sqlite3
+import threading
+import pandas as pd
+
+from Ledger import BalanceIndex, MerchantIndex, amounts_to_cents, new_positions, \
+    normalize_ledger, rollup_dimensions, transaction_keys
+from Metrics import metrics
+from Records import TransactionBatch
+
+"""
+Columns stored for each transaction, in table order
+"""
+ledger_columns = ['date', 'store', 'description', 'account', 'amount', 'category',
+                  'subcategory', 'notes']
+
+"""
+Largest number of parameters used in a single IN clause
+"""
+max_parameters = 500
+
+
+def signed_keys(transactions_df: pd.DataFrame):
+    """
+    Hash transactions into keys that fit in an SQLite integer
+
+    :param transactions_df: DataFrame containing transactions
+    :return: List of signed 64 bit keys from transaction_keys
+    """
+
+    return transaction_keys(transactions_df).to_numpy().view('int64').tolist()
+
+
+class SqliteRollups:
+    """
+    Monthly totals answered by SQL aggregates, with the same query as RollupCube
+    """
+
+    def __init__(self, ledger):
+        """
+        :param ledger: SqliteLedger to aggregate
+        """
+
+        self.ledger = ledger
+
+    def query(self, by: str = 'category', accounts: list = None, category: str = None,
+              start_month: int = None, end_month: int = None):
+        """
+        Total the transactions by month and one other dimension
+
+        :param by: Dimension to group by besides the month
+        :param accounts: Accounts to include, or None for every account
+        :param category: Category to include, or None for every category
+        :param start_month: First month to include as an integer like 202203, or None
+        :param end_month: Last month to include as an integer like 202203, or None
+        :return: DataFrame with month, the grouped dimension, amount and count columns
+        :raises ValueError: If the dimension is not a rollup dimension
+        """
+
+        if by not in rollup_dimensions or by == 'month':
+            raise ValueError(f'Cannot group by {by}')
+
+        conditions = []
+        params = []
+        if accounts:
+            conditions.append(f'account IN ({", ".join("?" * len(accounts))})')
+            params += accounts
+        if category is not None:
+            conditions.append('category = ?')
+            params.append(category)
+        if start_month is not None:
+            conditions.append('date >= ?')
+            params.append(f'{start_month // 100:04d}-{start_month % 100:02d}-01')
+        if end_month is not None:
+            conditions.append('date < ?')
+            next_month = end_month + 1 if end_month % 100 < 12 else end_month + 89
+            params.append(f'{next_month // 100:04d}-{next_month % 100:02d}-01')
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        query = f'''
+            SELECT CAST(strftime('%Y%m', date) AS INTEGER) AS month, {by},
+                   SUM(cents) AS cents, COUNT(*) AS count
+            FROM transactions {where}
+            GROUP BY month, {by}
+            ORDER BY month, {by}
+        '''
+        with closing(self.ledger._connect()) as conn:
+            totals = pd.read_sql_query(query, conn, params=params)
+        totals['amount'] = totals.pop('cents') / 100
+
+        return totals
+
+
+class SqliteLedger:
+    """
+    Ledger kept in an SQLite database in WAL mode
+
+    Nothing but cached merchant categories is held in memory, so any number of serving
+    processes can share one ledger. Writes are single transactions, totals and queries
+    are SQL aggregates over indexed columns, and readers never block the writer.
+    Offers the same methods as ResidentLedger.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Open a ledger, creating its tables if needed
+
+        :param db_path: Path of the SQLite database
+        """
+
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._merchants = None
+        self._merchants_signature = None
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY,
+                    date TEXT NOT NULL,
+                    store TEXT,
+                    description TEXT,
+                    account TEXT NOT NULL,
+                    cents INTEGER NOT NULL,
+                    category TEXT NOT NULL DEFAULT '',
+                    subcategory TEXT NOT NULL DEFAULT '',
+                    notes TEXT,
+                    key INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS transactions_date_account
+                    ON transactions (date, account);
+                CREATE INDEX IF NOT EXISTS transactions_account_date
+                    ON transactions (account, date);
+                CREATE INDEX IF NOT EXISTS transactions_category
+                    ON transactions (category, subcategory);
+                CREATE INDEX IF NOT EXISTS transactions_key ON transactions (key);
+            ''')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA busy_timeout = 30000')
+        return conn
+
+    def _read(self, query: str, params: list = ()):
+        with closing(self._connect()) as conn:
+            transactions_df = pd.read_sql_query(query, conn, params=params)
+        transactions_df.insert(4, 'amount', transactions_df.pop('cents') / 100)
+
+        return normalize_ledger(transactions_df)
+
+    def _signature(self, conn: sqlite3.Connection):
+        return conn.execute('SELECT MAX(id), COUNT(*) FROM transactions').fetchone()
+
+    def add(self, entries_df: pd.DataFrame):
+        """
+        Insert new transactions in a single transaction
+
+        :param entries_df: DataFrame containing transactions to be added
+        """
+
+        if entries_df.empty:
+            return
+
+        entries_df = entries_df.reindex(columns=ledger_columns)
+        rows_df = pd.DataFrame({
+            'date': pd.to_datetime(entries_df['date']).dt.strftime('%Y-%m-%d'),
+            'store': entries_df['store'],
+            'description': entries_df['description'],
+            'account': entries_df['account'].astype(str),
+            'cents': amounts_to_cents(entries_df['amount']),
+            'category': entries_df['category'].astype(object).fillna('').astype(str),
+            'subcategory': entries_df['subcategory'].astype(object).fillna('').astype(str),
+            'notes': entries_df['notes'],
+            'key': signed_keys(entries_df),
+        }).astype(object)
+        rows = rows_df.where(rows_df.notna(), None).itertuples(index=False, name=None)
+
+        with metrics.stage('ledger_write'), self._lock, closing(self._connect()) as conn:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                previous_signature = self._signature(conn)
+                conn.executemany(
+                    'INSERT INTO transactions (date, store, description, account, cents, '
+                    'category, subcategory, notes, key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows)
+                signature = self._signature(conn)
+
+            # Keep the cached merchants if nothing else was written since they were read
+            if self._merchants is not None and previous_signature == self._merchants_signature:
+                self._merchants.update(entries_df)
+                self._merchants_signature = signature
+        metrics.count('rows_written', len(entries_df))
+
+    @property
+    def account_balances(self):
+        """
+        Balances of every account, summed by the database
+        """
+
+        with metrics.stage('balances_query'), closing(self._connect()) as conn:
+            balances = BalanceIndex()
+            balances.cents = dict(conn.execute(
+                'SELECT account, SUM(cents) FROM transactions GROUP BY account'))
+
+        return balances
+
+    @property
+    def category_rollups(self):
+        """
+        Monthly totals by account, category and subcategory, summed by the database
+        """
+
+        return SqliteRollups(self)
+
+    @property
+    def merchant_categories(self):
+        """
+        Most frequent category of each merchant, rebuilt if the database changed
+        """
+
+        with self._lock:
+            with closing(self._connect()) as conn:
+                signature = self._signature(conn)
+                if self._merchants is not None and signature == self._merchants_signature:
+                    return self._merchants
+                merchants_df = pd.read_sql_query(
+                    "SELECT store, category, subcategory, COUNT(*) AS count "
+                    "FROM transactions WHERE category != '' "
+                    "GROUP BY store, category, subcategory", conn)
+
+            with metrics.stage('index_build'):
+                self._merchants = MerchantIndex()
+                self._merchants.build(merchants_df, merchants_df['count'])
+            self._merchants_signature = signature
+
+            return self._merchants
+
+    def filter_new(self, entries: TransactionBatch, seen: dict = None):
+        """
+        Drop transactions that are already in the ledger
+
+        Repeated identical transactions are kept when there are more of them than the
+        ledger already has, eg. two identical purchases on the same day
+
+        :param entries: TransactionBatch of transactions
+        :param seen: Counts of keys seen in earlier batches of the same import, updated in
+                     place, or None if this is the only batch
+        :return: TransactionBatch of the transactions that are not in the ledger yet
+        """
+
+        if not len(entries):
+            return entries
+
+        keys = signed_keys(entries.to_frame())
+        distinct = sorted(set(keys))
+        counts = {}
+        with closing(self._connect()) as conn:
+            for start in range(0, len(distinct), max_parameters):
+                chunk = distinct[start:start + max_parameters]
+                counts.update(conn.execute(
+                    f'SELECT key, COUNT(*) FROM transactions '
+                    f'WHERE key IN ({", ".join("?" * len(chunk))}) GROUP BY key', chunk))
+
+        seen = {} if seen is None else seen
+        return entries.take(new_positions(pd.Series(keys, dtype='int64'),
+                                          lambda unique: [counts.get(key, 0) for key in unique],
+                                          seen))
+
+    def query(self, start=None, end=None, accounts: list = None, categories: list = None,
+              columns: list = None):
+        """
+        Get the transactions in a date range, optionally only for some accounts and
+        categories, using the database indexes
+
+        :param start: First date to include, or None for no minimum
+        :param end: Last date to include, or None for no maximum
+        :param accounts: Accounts to include, or None for every account
+        :param categories: Categories to include, with '' for uncategorized transactions,
+                           or None for every category
+        :param columns: Columns to return, or None for all columns
+        :return: DataFrame containing the matching transactions sorted by date and account
+        """
+
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append('date >= ?')
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            conditions.append('date <= ?')
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        for column, values in (('account', accounts), ('category', categories)):
+            if values is not None:
+                conditions.append(f'{column} IN ({", ".join("?" * len(values))})')
+                params += values
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        transactions_df = self._read(
+            'SELECT date, store, description, account, cents, category, subcategory, notes '
+            f'FROM transactions {where} ORDER BY date, account, id', params)
+
+        return transactions_df if columns is None else transactions_df[columns]
+
+    @property
+    def transactions(self):
+        """
+        DataFrame containing all transactions, read from the database
+        """
+
+        return self.query()
+
+    def stats(self):
+        """
+        Get counters for the ledger
+
+        :return: Dictionary of the number of reloads, always 0, and rows in the database
+        """
+
+        with closing(self._connect()) as conn:
+            return {'reloads': 0, 'rows': self._signature(conn)[1]}
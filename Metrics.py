@@ -0,0 +1,290 @@
+"""Lightweight timing and counter hooks for the import and write pipeline."""
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+import bisect
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+"""
+Upper bounds in seconds of the buckets in each stage's histogram
+"""
+histogram_bounds = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+
+"""
+Context manager used for stages while metrics are disabled
+"""
+_disabled_stage = nullcontext()
+
+
+class Histogram:
+    """
+    Bucketed durations of a single stage
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(histogram_bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        """
+        Add a duration
+
+        :param seconds: Duration in seconds
+        """
+
+        self.buckets[bisect.bisect_left(histogram_bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction: float):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in
+
+        :param fraction: Quantile between 0 and 1
+        :return: Duration in seconds, capped at the largest duration seen
+        """
+
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(histogram_bounds, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Summarize the histogram
+
+        :return: Dictionary of the count, total, mean, estimated median and 95th
+                 percentile, maximum and bucket counts keyed by upper bound
+        """
+
+        labels = [f'<={bound}' for bound in histogram_bounds] + [f'>{histogram_bounds[-1]}']
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else 0.0,
+            'p50_seconds': self.quantile(0.5),
+            'p95_seconds': self.quantile(0.95),
+            'max_seconds': self.max,
+            'buckets': {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class Metrics:
+    """
+    Per-stage duration histograms, counters and recent per-file timings
+
+    Hooks cost a single attribute check while disabled. Samples recorded inside capture()
+    are also collected in a list so they can be sent back from a worker process and
+    merged into the parent's metrics.
+    """
+
+    def __init__(self, enabled: bool = False, max_files: int = 200):
+        """
+        :param enabled: Whether hooks record anything
+        :param max_files: Number of most recent files to keep per-file timings for
+        """
+
+        self.enabled = enabled
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._captures = []
+        self.reset()
+
+        # A forked job copies the lock as it was, possibly held by another thread
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._captures = []
+
+    def reset(self):
+        """
+        Forget everything recorded so far
+        """
+
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.files = OrderedDict()
+
+    def _record(self, kind: str, name: str, key: str, value: float):
+        with self._lock:
+            if kind == 'stage':
+                self.stages.setdefault(name, Histogram()).add(value)
+                if key is not None:
+                    file_stages = self.files.pop(key, {})
+                    file_stages[name] = file_stages.get(name, 0.0) + value
+                    self.files[key] = file_stages
+                    if len(self.files) > self.max_files:
+                        self.files.popitem(last=False)
+            else:
+                self.counters[name] = self.counters.get(name, 0) + value
+            for samples in self._captures:
+                samples.append((kind, name, key, value))
+
+    @contextmanager
+    def _timed(self, name: str, key: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record('stage', name, key, time.perf_counter() - start)
+
+    def stage(self, name: str, key: str = None):
+        """
+        Time a block of code as a stage
+
+        :param name: Stage name
+        :param key: File the work belongs to, or None if it isn't for a single file
+        :return: Context manager timing the block
+        """
+
+        if not self.enabled:
+            return _disabled_stage
+        return self._timed(name, key)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Increase a counter
+
+        :param name: Counter name
+        :param value: Amount to increase the counter by
+        """
+
+        if self.enabled:
+            self._record('count', name, None, value)
+
+    @contextmanager
+    def capture(self):
+        """
+        Collect the samples recorded within a block
+
+        :return: Context manager giving the list of samples, filled in as they are recorded
+        """
+
+        samples = []
+        with self._lock:
+            self._captures.append(samples)
+        try:
+            yield samples
+        finally:
+            with self._lock:
+                self._captures.remove(samples)
+
+    def merge(self, samples: list):
+        """
+        Add samples recorded elsewhere, eg. in a worker process
+
+        :param samples: List of samples from capture()
+        """
+
+        for kind, name, key, value in samples:
+            self._record(kind, name, key, value)
+
+    def unwrap(self, captured: tuple):
+        """
+        Merge the samples from run_captured and return the function's result
+
+        :param captured: Tuple of a result and its samples from run_captured
+        :return: Result of the function
+        """
+
+        result, samples = captured
+        self.merge(samples)
+        return result
+
+    def snapshot(self):
+        """
+        Summarize everything recorded so far
+
+        :return: Dictionary of whether metrics are enabled, stage histogram summaries,
+                 counters and per-file stage durations
+        """
+
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'stages': {name: histogram.summary()
+                           for name, histogram in sorted(self.stages.items())},
+                'counters': dict(sorted(self.counters.items())),
+                'files': {key: dict(file_stages) for key, file_stages in self.files.items()},
+            }
+
+
+"""
+Metrics shared by the pipeline in this process
+"""
+metrics = Metrics()
+
+
+def run_captured(function, *args):
+    """
+    Run a function in a worker process with metrics enabled
+
+    :param function: Module-level function to run
+    :param args: Arguments for the function
+    :return: Tuple of the function's result and the samples it recorded
+    """
+
+    metrics.enabled = True
+    with metrics.capture() as samples:
+        result = function(*args)
+
+    return result, samples
+
+
+def profile_call(function, *args, limit: int = 30):
+    """
+    Run a function under cProfile
+
+    :param function: Function to run
+    :param args: Arguments for the function
+    :param limit: Number of functions to list in the report
+    :return: Tuple of the function's result, the profile statistics and a text report of
+             the functions with the highest cumulative time
+    """
+
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args)
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(limit)
+
+    return result, stats, report.getvalue()
+
+
+def register_metrics_routes(server, ledger, before_snapshot=None):
+    """
+    Serve the metrics snapshot at /metrics and the ledger counters at /ledger-stats
+
+    :param server: Flask server of an app
+    :param ledger: ResidentLedger or SqliteLedger the app writes to
+    :param before_snapshot: Function called before each snapshot, eg. to merge metrics
+                            queued by background jobs, or None
+    """
+
+    import flask
+
+    @server.route('/metrics')
+    def metrics_json():
+        # Per-stage histograms, counters and per-file timings of the pipeline
+        if before_snapshot is not None:
+            before_snapshot()
+        return flask.jsonify(metrics.snapshot())
+
+    @server.route('/ledger-stats')
+    def ledger_stats():
+        # Number of reloads and rows, eg. to confirm writes don't reload the ledger
+        return flask.jsonify(ledger.stats())
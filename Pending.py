@@ -0,0 +1,256 @@
+"""Server-side storage for pending transactions shown in the preview tables."""
+import contextlib
+import math
+import operator
+import re
+import uuid
+import pandas as pd
+
+"""
+Comparison operators supported in DataTable filter queries
+"""
+filter_operators = {
+    'eq': operator.eq, '=': operator.eq,
+    'ne': operator.ne, '!=': operator.ne,
+    'lt': operator.lt, '<': operator.lt,
+    'le': operator.le, '<=': operator.le,
+    'gt': operator.gt, '>': operator.gt,
+    'ge': operator.ge, '>=': operator.ge,
+}
+
+"""
+Matcher for a single condition of a DataTable filter query
+"""
+filter_matcher = re.compile(r'\{(?P<column>[^}]+)\}\s+(?P<operator>\S+)\s+(?P<value>.+)')
+
+
+def new_session_id():
+    """
+    Create an id for a page session
+
+    :return: Random hex string
+    """
+
+    return uuid.uuid4().hex
+
+
+def format_date(value):
+    """
+    Format a date the way pending rows store it
+
+    Imported rows carry dates while edited rows come back from the browser as text, so
+    both are kept as YYYY-MM-DD text to sort and filter alike
+
+    :param value: Date, timestamp or date text
+    :return: YYYY-MM-DD text, or the value unchanged if it is empty or not a date
+    """
+
+    if value is None or value == '':
+        return value
+    try:
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+    except (ValueError, TypeError):
+        return value
+
+
+def filter_rows(rows_df: pd.DataFrame, filter_query: str):
+    """
+    Filter rows with a DataTable filter query
+
+    Supports the comparison operators, contains and datestartswith joined with &&. An
+    operator may be prefixed with s to match case-sensitively, as the DataTable sends them
+    by default, or with i to ignore case.
+
+    :param rows_df: DataFrame of rows
+    :param filter_query: Filter query from the DataTable
+    :return: DataFrame of matching rows
+    """
+
+    for part in filter_query.split(' && '):
+        match = filter_matcher.match(part.strip())
+        if match is None:
+            continue
+        column = match.group('column')
+        value = match.group('value').strip().strip('"\'')
+        if column not in rows_df:
+            return rows_df.iloc[0:0]
+
+        # Strip the case prefix of operators like scontains, s= or ieq
+        name = match.group('operator')
+        ignore_case = False
+        if name[:1] in ('s', 'i') and (name[1:] in filter_operators or
+                                      name[1:] in ('contains', 'datestartswith')):
+            ignore_case = name[0] == 'i'
+            name = name[1:]
+
+        values = rows_df[column]
+        text = values.astype(str)
+        if ignore_case:
+            text = text.str.lower()
+            value = value.lower()
+        if name == 'contains':
+            mask = text.str.contains(value, regex=False)
+        elif name == 'datestartswith':
+            mask = text.str.startswith(value)
+        elif name in filter_operators:
+            compare = filter_operators[name]
+            try:
+                mask = compare(pd.to_numeric(values, errors='coerce'), float(value))
+            except ValueError:
+                mask = compare(text, value)
+        else:
+            continue
+
+        rows_df = rows_df[mask.fillna(False)]
+
+    return rows_df
+
+
+class PendingStore:
+    """
+    Transactions waiting to be written, kept on the server for each page session
+
+    Rows are stored in a diskcache cache so background jobs and other worker processes
+    share them. Each row gets an id so edits on a single page can be matched back.
+    """
+
+    def __init__(self, cache):
+        """
+        :param cache: diskcache.Cache to keep the rows in
+        """
+
+        self.cache = cache
+
+    def _key(self, session: str):
+        return f'pending-{session}'
+
+    def get(self, session: str):
+        """
+        Get all pending rows of a session
+
+        :param session: Session id
+        :return: List of dictionaries representing transactions
+        """
+
+        return self.cache.get(self._key(session), [])
+
+    def add(self, session: str, rows: list, statements: list = None):
+        """
+        Add rows to a session
+
+        :param session: Session id
+        :param rows: List of dictionaries representing transactions
+        :param statements: Statement filenames the rows were imported from, recorded even
+                           if they had no new rows, or None if the rows were entered by hand
+        :return: Number of pending rows in the session
+        """
+
+        with self.cache.transact():
+            if statements:
+                recorded = self.cache.get(f'{self._key(session)}-statements', [])
+                self.cache.set(f'{self._key(session)}-statements',
+                               sorted(set(recorded) | set(statements)))
+            next_id = self.cache.get(f'{self._key(session)}-next', 0)
+            stored = self.get(session)
+            for row in rows:
+                stored.append({**row, 'date': format_date(row.get('date')), 'id': next_id})
+                next_id += 1
+            self.cache.set(self._key(session), stored)
+            self.cache.set(f'{self._key(session)}-next', next_id)
+
+        return len(stored)
+
+    def clear(self, session: str):
+        """
+        Remove all pending rows and statements of a session
+
+        :param session: Session id
+        """
+
+        with self.cache.transact():
+            self.cache.delete(self._key(session))
+            self.cache.delete(f'{self._key(session)}-statements')
+
+    @contextlib.contextmanager
+    def writing(self, session: str):
+        """
+        Get the pending rows of a session to write, removing them once written
+
+        The rows stay pending if the block raises, so a failed write can be tried again.
+        Rows added while writing are kept.
+
+        :param session: Session id
+        :return: Context manager giving a tuple of a list of dictionaries representing
+                 transactions, without their row ids, and a list of the statement filenames
+                 they were imported from
+        """
+
+        with self.cache.transact():
+            rows = self.get(session)
+            statements = self.cache.get(f'{self._key(session)}-statements', [])
+        yield ([{column: value for column, value in row.items() if column != 'id'}
+                for row in rows], statements)
+
+        written = {row['id'] for row in rows}
+        with self.cache.transact():
+            self.cache.set(self._key(session), [row for row in self.get(session)
+                                                if row['id'] not in written])
+            self.cache.set(f'{self._key(session)}-statements', sorted(
+                set(self.cache.get(f'{self._key(session)}-statements', [])) -
+                set(statements)))
+
+    def apply_edits(self, session: str, data: list, data_previous: list):
+        """
+        Save cell edits and row deletions made on the displayed page
+
+        :param session: Session id
+        :param data: Rows on the page after the edit
+        :param data_previous: Rows on the page before the edit
+        """
+
+        current = {row['id']: {**row, 'date': format_date(row.get('date'))}
+                   for row in data or []}
+        deleted = {row['id'] for row in data_previous or []} - current.keys()
+
+        with self.cache.transact():
+            rows = [current.get(row['id'], row) for row in self.get(session)
+                    if row['id'] not in deleted]
+            self.cache.set(self._key(session), rows)
+
+    def page(self, session: str, page_current: int, page_size: int, sort_by: list = None,
+             filter_query: str = None):
+        """
+        Get a single page of pending rows
+
+        :param session: Session id
+        :param page_current: 0-based page number
+        :param page_size: Number of rows per page
+        :param sort_by: DataTable sort_by list of column_id and direction
+        :param filter_query: DataTable filter query
+        :return: Tuple of the list of rows on the page and the number of pages
+        """
+
+        rows = self.get(session)
+        if not rows:
+            return [], 1
+
+        rows_df = pd.DataFrame(rows)
+        if filter_query:
+            rows_df = filter_rows(rows_df, filter_query)
+
+        # Default to the order of the ledger
+        sort_by = [sort for sort in sort_by or [] if sort['column_id'] in rows_df]
+        if not sort_by:
+            sort_by = [{'column_id': column, 'direction': 'asc'}
+                       for column in ('date', 'account') if column in rows_df]
+        if sort_by:
+            rows_df = rows_df.sort_values(
+                [sort['column_id'] for sort in sort_by],
+                ascending=[sort['direction'] == 'asc' for sort in sort_by],
+                kind='mergesort')
+
+        page_count = max(1, math.ceil(len(rows_df) / page_size))
+        start = (page_current or 0) * page_size
+        page_df = rows_df.iloc[start:start + page_size].astype(object)
+
+        return page_df.where(page_df.notna(), None).to_dict('records'), page_count
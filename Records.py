@@ -0,0 +1,157 @@
+"""Compact column-backed batches of transactions."""
+import numpy as np
+import pandas as pd
+
+"""
+Columns stored as integer codes into a small set of distinct values
+"""
+coded_columns = ['account', 'category', 'subcategory', 'statement']
+
+
+class TransactionBatch:
+    """
+    Transactions held as columns instead of one dictionary per transaction
+
+    Dates are datetime64 and amounts float64. Accounts, categories and statement
+    filenames are categoricals, stored as small integer codes. Batches are built, stamped
+    and sorted a column at a time, and only turned into dictionaries for Dash.
+    """
+
+    def __init__(self, frame: pd.DataFrame = None):
+        """
+        :param frame: DataFrame of transactions, or None for an empty batch
+        """
+
+        if frame is None:
+            frame = pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'),
+                                  'store': pd.Series(dtype=object),
+                                  'amount': pd.Series(dtype='float64')})
+        self.frame = frame.reset_index(drop=True)
+        for column in coded_columns:
+            if column in self.frame and self.frame[column].dtype != 'category':
+                self.frame[column] = self.frame[column].astype('category')
+
+    @classmethod
+    def from_records(cls, records: list):
+        """
+        Create a batch from dictionaries
+
+        :param records: List of dictionaries representing transactions
+        :return: TransactionBatch
+        """
+
+        if not records:
+            return cls()
+        frame = pd.DataFrame(records)
+        frame['date'] = pd.to_datetime(frame['date'])
+
+        return cls(frame)
+
+    @classmethod
+    def concat(cls, batches: list):
+        """
+        Join batches into one
+
+        :param batches: List of TransactionBatch
+        :return: TransactionBatch with the transactions of every batch in order
+        """
+
+        frames = [batch.frame for batch in batches if len(batch)]
+        if not frames:
+            return cls()
+
+        # Categoricals with different values are joined as plain strings and coded again
+        return cls(pd.concat(frames, ignore_index=True, sort=False))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def stamp(self, column: str, value):
+        """
+        Set a column to the same value for every transaction, in place
+
+        :param column: Column name
+        :param value: Value for every transaction
+        """
+
+        if column in coded_columns:
+            self.frame[column] = pd.Categorical.from_codes(
+                np.zeros(len(self.frame), dtype='int8'), categories=[value])
+        else:
+            self.frame[column] = value
+
+    def sorted(self):
+        """
+        Sort by date and account, keeping the existing order of ties
+
+        :return: Sorted TransactionBatch
+        """
+
+        # Coded columns keep their values sorted by name, so codes sort in name order
+        # Batches that were never stamped with an account, eg. empty ones, sort by date
+        columns = [column for column in ('date', 'account') if column in self.frame]
+        return TransactionBatch(self.frame.sort_values(columns, kind='mergesort'))
+
+    def take(self, positions: np.ndarray):
+        """
+        Select transactions by position
+
+        :param positions: Array of positions
+        :return: TransactionBatch of the selected transactions
+        """
+
+        return TransactionBatch(self.frame.take(positions))
+
+    def column(self, column: str):
+        """
+        Get a column, with missing columns as empty values
+
+        :param column: Column name
+        :return: Series of the column
+        """
+
+        if column in self.frame:
+            return self.frame[column]
+        return pd.Series(None, index=self.frame.index, dtype=object)
+
+    def fill(self, column: str, values: pd.Series):
+        """
+        Fill in missing or empty values of a column, in place
+
+        :param column: Column name
+        :param values: Series aligned to the batch with the values to fill in, None where
+                       there is no value
+        """
+
+        current = self.column(column).astype(object)
+        missing = current.isna() | (current == '')
+        self.frame[column] = current.where(~missing, values).astype('category') \
+            if column in coded_columns else current.where(~missing, values)
+
+    def clear(self):
+        """
+        Remove every transaction, in place
+        """
+
+        self.frame = self.frame.iloc[0:0]
+
+    def to_frame(self):
+        """
+        Get the transactions as a DataFrame
+
+        :return: DataFrame of transactions
+        """
+
+        return self.frame
+
+    def to_records(self):
+        """
+        Convert to dictionaries for Dash
+
+        :return: List of dictionaries representing transactions, with dates as
+                 datetime.date and None for missing values
+        """
+
+        frame = self.frame.astype(object)
+        frame['date'] = self.frame['date'].dt.date
+        return frame.where(frame.notna(), None).to_dict('records')
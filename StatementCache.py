@@ -0,0 +1,205 @@
+"""Persistent cache of lines and transactions parsed from statements."""
+import hashlib
+import json
+import os
+import pickle
+import time
+
+"""
+Version of the parsing pipeline, bumped when the same settings would parse differently
+"""
+parser_version = 4
+
+
+def hash_file(filepath: str):
+    """
+    Hash the contents of a file
+
+    :param filepath: Path of the file to hash
+    :return: Hex digest of the file contents
+    """
+
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hash_extract_settings(account_info: dict):
+    """
+    Hash the account configuration that changes which lines are read from a statement
+
+    :param account_info: Configuration of the account the statement belongs to
+    :return: Hex digest of the extraction settings
+    """
+
+    settings = {
+        'end_marker': account_info.get('End Marker'),
+        'pages': account_info.get('Statement Pages'),
+        'regions': account_info.get('Statement Regions'),
+    }
+
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def hash_matchers(matchers: list):
+    """
+    Hash the entry matchers, eg. to key the layouts pinned for them
+
+    :param matchers: Compiled regular expressions used to match transactions
+    :return: Hex digest of the matcher patterns
+    """
+
+    patterns = [matcher.pattern for matcher in matchers]
+    return hashlib.sha256(json.dumps(patterns).encode()).hexdigest()
+
+
+def hash_parse_settings(matchers: list, account_info: dict, filename: str):
+    """
+    Hash everything apart from the statement contents that changes how a statement parses
+
+    :param matchers: Compiled regular expressions used to match transactions
+    :param account_info: Configuration of the account the statement belongs to
+    :param filename: Filename of the statement, which holds the date years are resolved from
+    :return: Hex digest of the parse settings
+    """
+
+    settings = {
+        'version': parser_version,
+        'filename': filename,
+        'matchers': [matcher.pattern for matcher in matchers],
+        'type': account_info['Type'],
+        'negative_separator': account_info.get('Negative Separator'),
+        'extract': hash_extract_settings(account_info),
+    }
+
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+class StatementCache:
+    """
+    Size bounded on-disk cache with least recently used eviction
+
+    Values are pickled into one file each, and an index file keeps track of their sizes
+    and when they were last used
+    """
+
+    index_filename = 'index.json'
+
+    def __init__(self, folder: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Open a cache, creating the folder if needed
+
+        :param folder: Folder to keep the cache in
+        :param max_bytes: Maximum total size of the cached values
+        """
+
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(folder, exist_ok=True)
+        self.index = self._read_index()
+
+    def _path(self, key: str):
+        return os.path.join(self.folder, f'{key}.pkl')
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.folder, self.index_filename)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _merge_index(self):
+        # Values added by other processes since the index was read, skipping ones whose
+        # file was evicted since
+        for key, item in self._read_index().items():
+            if key not in self.index and os.path.exists(self._path(key)):
+                self.index[key] = item
+
+    def get(self, key: str):
+        """
+        Get a value from the cache
+
+        :param key: Key of the value
+        :return: The cached value, or None if it is not cached
+        """
+
+        # Another process, eg. an earlier import job, may have cached it since
+        if key not in self.index:
+            self._merge_index()
+        if key not in self.index:
+            self.misses += 1
+            return None
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            del self.index[key]
+            self.misses += 1
+            return None
+
+        self.index[key]['last_used'] = time.time()
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        """
+        Add a value to the cache, evicting the least recently used values if it is full
+
+        :param key: Key of the value
+        :param value: Picklable value to cache
+        """
+
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+
+        with open(self._path(key), 'wb') as f:
+            f.write(data)
+        self.index[key] = {'size': len(data), 'last_used': time.time()}
+        self._evict()
+
+    def _evict(self):
+        total = sum(item['size'] for item in self.index.values())
+        if total <= self.max_bytes:
+            return
+
+        for key in sorted(self.index, key=lambda key: self.index[key]['last_used']):
+            total -= self.index.pop(key)['size']
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            if total <= self.max_bytes:
+                break
+
+    def flush(self):
+        """
+        Persist the index so usage survives restarts, keeping values other processes added
+        """
+
+        self._merge_index()
+        index_path = os.path.join(self.folder, self.index_filename)
+        with open(f'{index_path}.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(f'{index_path}.tmp', index_path)
+
+    def stats(self):
+        """
+        Get usage counters for the cache
+
+        :return: Dictionary of hits, misses, number of values and total size in bytes
+        """
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.index),
+            'bytes': sum(item['size'] for item in self.index.values()),
+        }
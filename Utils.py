@@ -1,9 +1,18 @@
-from dash import html
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
 import datetime
 import os
 import pandas as pd
-import pdfplumber
 import re
+import threading
+
+from Ledger import BalanceIndex, LedgerWriter, MerchantIndex, ResidentLedger, \
+    normalize_ledger
+from LedgerDatabase import SqliteLedger
+from Metrics import metrics, run_captured
+from Records import TransactionBatch
+from StatementCache import StatementCache, hash_extract_settings, hash_file, \
+    hash_matchers, hash_parse_settings
 
 """
 Matchers to match for a transaction
@@ -13,45 +22,66 @@ entry_matchers = [
     re.compile('\s(?P<date>\w{3} \d{2})\s+(?P<purchase>[^$]+)\s+(?P<price>[-$ ]*[\d,]+\.\d{2})'),
 ]
 
+"""
+Matcher for the statement date in a statement filename
+"""
+statement_date_matcher = re.compile('(?P<date>\d{4}-\d{2}-\d{2})\.pdf')
 
-def find_files(filepath: str, min_date: datetime.date):
+
+def find_files(filepath: str, min_date: datetime.date, max_date: datetime.date = None):
     """
     Find files from later than the provided date
 
     :param filepath: Folder to check for files
     :param min_date: Minimum date that the files should be after
+    :param max_date: Maximum date that the files should be before, or None for no maximum
     :return: List of filenames
     """
 
-    date_matcher = re.compile('(?P<date>\d{4}-\d{2}-\d{2})\.pdf')
-
     relevant_files = []
-    for filename in os.listdir(filepath):
+    with metrics.stage('find_files'):
+        for filename in os.listdir(filepath):
 
-        # Check if has file has date
-        match = date_matcher.search(filename)
-        if match is None:
-            continue
+            # Check if has file has date
+            parsed_date = find_statement_date(filename)
+            if parsed_date is None:
+                continue
 
-        # Only save files more recent than the given date
-        parsed_date = datetime.datetime.strptime(match.group('date'), '%Y-%m-%d')
-        if parsed_date >= min_date:
-            relevant_files.append(filename)
+            # Only save files more recent than the given date
+            if parsed_date >= min_date and (max_date is None or parsed_date <= max_date):
+                relevant_files.append(filename)
 
+    metrics.count('files_found', len(relevant_files))
     return relevant_files
 
 
+def find_statement_date(filename: str):
+    """
+    Find the statement date in a statement filename
+
+    :param filename: Filename ending in the date as YYYY-MM-DD.pdf
+    :return: datetime.datetime of the statement date, or None if the filename has no date
+    """
+
+    match = statement_date_matcher.search(filename)
+    if match is None:
+        return None
+
+    return datetime.datetime.strptime(match.group('date'), '%Y-%m-%d')
+
+
 def find_account_name(accounts: list, filename: str):
     """
     Find matching account name given a filename
 
     :param accounts: List of dictionaries with account names as keys, containing expected
                      filename prefixes
-    :param filename: Filename to be matched with
+    :param filename: Filename to be matched with, optionally inside subfolders
     :return: Matched account name
     :raises NameError: If no known account prefix matches the file name
     """
 
+    filename = os.path.basename(filename)
     for account_name in accounts:
 
         prefix = accounts[account_name]['Statement Prefix']
@@ -64,21 +94,93 @@ def find_account_name(accounts: list, filename: str):
     raise NameError('File name does not match any known account statement prefix')
 
 
-def read_pdf_to_lines(folder: str, filename: str):
+def crop_page(page, region: list):
     """
-    Read a PDF file
+    Crop a pdfplumber page to a region, clamped to the page boundaries
+
+    :param page: pdfplumber page
+    :param region: Bounding box as [x0, top, x1, bottom] in PDF points
+    :return: Cropped pdfplumber page
+    """
+
+    x0, top, x1, bottom = page.bbox
+    return page.crop((max(region[0], x0), max(region[1], top),
+                      min(region[2], x1), min(region[3], bottom)))
+
+
+def extract_page_text(page, regions: list = None):
+    """
+    Extract the text of a page, optionally only from some regions of it
+
+    :param page: pdfplumber page
+    :param regions: Bounding boxes as [x0, top, x1, bottom] to read in order, or None to
+                    read the whole page
+    :return: Text of the page or regions
+    """
+
+    if not regions:
+        return page.extract_text() or ''
+
+    return '\n'.join(crop_page(page, region).extract_text() or '' for region in regions)
+
+
+def iter_pdf_pages(folder: str, filename: str, end_marker: str = None, pages: list = None,
+                   regions: list = None):
+    """
+    Read a PDF file one page at a time
+
+    Each page is released once its text is extracted, and no further pages are read
+    after the end marker
 
     :param folder: Folder containing the file
     :param filename: Filename of the PDF file
-    :return: List of lines from the PDF
+    :param end_marker: Line marking the end of the transactions, or None to read all pages
+    :param pages: 1-based page numbers to read, negative numbers counting from the end, or
+                  None to read all pages
+    :param regions: Bounding boxes as [x0, top, x1, bottom] to read on each page, or None
+                    to read whole pages
+    :return: Generator of lists of lines on each page, stopping before the end marker
     """
 
+    # The PDF stack is slow to import, so it is only loaded once a statement is read
+    import pdfplumber
+
     filepath = os.path.join(folder, filename)
     with pdfplumber.open(filepath) as pdf:
-        lines = []
+        num_pages = len(pdf.pages)
+        if pages is None:
+            page_numbers = range(num_pages)
+        else:
+            page_numbers = sorted({number - 1 if number > 0 else num_pages + number
+                                   for number in pages} & set(range(num_pages)))
+
+        for page_number in page_numbers:
+            with metrics.stage('extract_page', filename):
+                page = pdf.pages[page_number]
+                lines = extract_page_text(page, regions).split('\n')
+                page.flush_cache()
+            metrics.count('pages_read')
+
+            if end_marker is not None and end_marker in lines:
+                yield lines[:lines.index(end_marker)]
+                return
+            yield lines
+
+
+def read_pdf_to_lines(folder: str, filename: str, end_marker: str = None):
+    """
+    Read a PDF file
+
+    :param folder: Folder containing the file
+    :param filename: Filename of the PDF file
+    :param end_marker: Line marking the end of the transactions, or None to read all pages
+    :return: List of lines from the PDF
+    """
 
-        for page in pdf.pages:
-            lines += [line for line in page.extract_text().split('\n')]
+    lines = []
+    with metrics.stage('read_pdf', filename):
+        for page_lines in iter_pdf_pages(folder, filename, end_marker):
+            lines.extend(page_lines)
 
     return lines
 
@@ -110,30 +212,207 @@ def find_entries(lines: list, reverse_amount=False):
     :raises ValueError: If no matcher matches on the transactions in the statement
     """
 
-    # Find a matcher to use
-    matcher = None
-    for test_matcher in entry_matchers:
-        if any(test_matcher.search(line) is not None for line in lines):
-            matcher = test_matcher
-            break
-    if matcher is None:
-        raise ValueError('No suitable matchers found')
-
-    # Parse for transactions
-    entries = []
-    for match in map(lambda line: matcher.search(line), lines):
-        if match is None:
-            continue
-        amount = format_price(match.group('price'))
-        amount = amount if not reverse_amount else -amount
-        entries.append({
-            'date': parse_date(match.group('date')),  # format to datetime.date
-            'store': match.group('purchase'),
-            'amount': amount})
+    with metrics.stage('find_entries'):
+        matcher = find_matcher(lines)
+
+        # Parse for transactions
+        entries = []
+        for match in map(lambda line: matcher.search(line), lines):
+            if match is None:
+                continue
+            amount = format_price(match.group('price'))
+            amount = amount if not reverse_amount else -amount
+            entries.append({
+                'date': parse_date(match.group('date')),  # format to datetime.date
+                'store': match.group('purchase'),
+                'amount': amount})
 
     return entries
 
 
+def find_matcher(lines: list):
+    """
+    Find the first entry matcher that matches any of the given lines
+
+    :param lines: Lines to be parsed for transactions
+    :return: Compiled regular expression from entry_matchers
+    :raises ValueError: If no matcher matches on the transactions in the statement
+    """
+
+    for matcher in entry_matchers:
+        if any(matcher.search(line) is not None for line in lines):
+            return matcher
+
+    raise ValueError('No suitable matchers found')
+
+
+class MatcherEngine:
+    """
+    Matches every known statement layout in a single pass over the lines
+
+    All entry matchers are combined into one alternation with a named branch per layout.
+    The layout found for each account is remembered so later statements from the same
+    account only run that layout's matcher.
+    """
+
+    def __init__(self, matchers: list):
+        """
+        :param matchers: Compiled regular expressions with date, purchase and price groups
+        """
+
+        self.matchers = matchers
+        self.pinned = {}
+
+        # Give each layout's groups a unique name so they can share one expression
+        branches = []
+        for layout, matcher in enumerate(matchers):
+            pattern = re.sub(r'\(\?P<(\w+)>', rf'(?P<\1_{layout}>', matcher.pattern)
+            branches.append(f'(?P<layout_{layout}>{pattern})')
+        self.combined = re.compile('|'.join(branches))
+
+    def _select(self, matches: pd.DataFrame, layout: int):
+        return matches[[f'date_{layout}', f'purchase_{layout}', f'price_{layout}']] \
+            .set_axis(['date', 'purchase', 'price'], axis=1)
+
+    def extract(self, lines: list, layout: int = None, detect: bool = True):
+        """
+        Extract the date, purchase and price of every transaction line
+
+        :param lines: Lines to be parsed for transactions
+        :param layout: Layout to try first, eg. the one pinned for the account
+        :param detect: Whether to detect the layout if the given layout matches no line, or
+                       less than half of the lines that match any layout
+        :return: Tuple of the index of the layout used and a DataFrame of matched lines
+                 indexed by line number
+        :raises ValueError: If no layout matches on the transactions in the statement
+        """
+
+        series = pd.Series(lines, dtype=object)
+
+        # Skip detection if the layout is already known, unless it misses most of the
+        # lines, eg. when it was pinned from a summary line of another layout
+        if layout is not None:
+            matches = series.str.extract(self.matchers[layout].pattern)
+            matches = matches.dropna(subset=['price'])
+            if not detect or (not matches.empty and
+                              len(matches) * 2 >= len(self.candidates(lines))):
+                return layout, matches[['date', 'purchase', 'price']]
+
+        # Use the first layout in order that matches any line
+        extracted = series.str.extract(self.combined.pattern)
+        for layout in range(len(self.matchers)):
+            found = extracted[f'layout_{layout}'].notna()
+            if found.any():
+                break
+        else:
+            raise ValueError('No suitable matchers found')
+        matches = self._select(extracted[found], layout)
+
+        # Lines where another layout matched earlier in the line may still match this one
+        others = extracted.filter(like='layout_').notna().any(axis=1) & ~found
+        if others.any():
+            rematched = series[others].str.extract(self.matchers[layout].pattern)
+            rematched = rematched.dropna(subset=['price'])[['date', 'purchase', 'price']]
+            matches = pd.concat([matches, rematched]).sort_index()
+
+        return layout, matches
+
+    def candidates(self, lines: list):
+        """
+        Find the lines that match any layout, so the layout can be detected once every
+        page of a statement is read without keeping the other lines
+
+        :param lines: Lines to be parsed for transactions
+        :return: List of the positions of the matching lines
+        """
+
+        search = self.combined.search
+        return [position for position, line in enumerate(lines)
+                if isinstance(line, str) and search(line) is not None]
+
+    def pin(self, account: str, layout: int):
+        """
+        Remember the layout used by an account
+
+        :param account: Account name
+        :param layout: Index of the layout in the matchers
+        """
+
+        self.pinned[account] = layout
+
+
+"""
+Engine used to parse statements with the entry matchers
+"""
+matcher_engine = MatcherEngine(entry_matchers)
+
+
+def entries_from_matches(matches: pd.DataFrame, reverse_amount=False,
+                         statement_date: datetime.date = None, split_index: int = None):
+    """
+    Convert matched transaction lines to transactions, parsing whole columns at once
+
+    :param matches: DataFrame of date, purchase and price strings indexed by line number
+    :param reverse_amount: Whether to reverse the amount shown on the statement, or a
+                           boolean Series of whether to reverse each line by line number
+    :param statement_date: Date of the statement, or None to use today
+    :param split_index: Line number from which amounts are reversed the other way, or None
+    :return: TransactionBatch of transactions
+    :raises ValueError: If a date cannot be parsed
+    """
+
+    if matches.empty:
+        return TransactionBatch()
+    if statement_date is None:
+        statement_date = datetime.date.today()
+
+    # Convert prices as a whole column
+    amounts = matches['price'].str.replace('[$,]', '', regex=True).str.strip().astype('float64')
+    reverse = pd.Series(reverse_amount, index=matches.index)
+    if split_index is not None:
+        reverse = reverse ^ (matches.index >= split_index)
+    amounts = amounts.where(~reverse, -amounts)
+
+    # Parse month and day with a leap year so February 29th is accepted
+    month_days = pd.to_datetime('2000/' + matches['date'], format='%Y/%m/%d', errors='coerce')
+    month_days = month_days.fillna(
+        pd.to_datetime('2000 ' + matches['date'], format='%Y %b %d', errors='coerce'))
+    if month_days.isna().any():
+        raise ValueError('Could not parse date')
+
+    # Transactions after the statement date are from the year before
+    # Eg. december transactions on a january statement
+    after_statement = (month_days.dt.month * 100 + month_days.dt.day >
+                       statement_date.month * 100 + statement_date.day)
+    years = statement_date.year - after_statement.astype('int64')
+    dates = pd.to_datetime(pd.DataFrame({
+        'year': years, 'month': month_days.dt.month, 'day': month_days.dt.day}))
+
+    return TransactionBatch(pd.DataFrame({
+        'date': dates,
+        'store': matches['purchase'],
+        'amount': amounts,
+    }))
+
+
+def find_entries_batch(lines: list, reverse_amount=False, statement_date: datetime.date = None):
+    """
+    Find transactions from a list of strings, parsing whole columns at once
+
+    Produces the same transactions as find_entries, except that the year of each
+    transaction is resolved against the statement date rather than today
+
+    :param lines: Lines to be parsed for transactions
+    :param reverse_amount: Whether to reverse the amount shown on the statement
+    :param statement_date: Date of the statement, or None to use today
+    :return: TransactionBatch of transactions
+    :raises ValueError: If no matcher matches on the transactions in the statement
+    """
+
+    _, matches = matcher_engine.extract(lines)
+    return entries_from_matches(matches, reverse_amount, statement_date)
+
+
 def parse_date(date_string: str):
     """
     Parse a date string into a datetime object
@@ -185,39 +464,471 @@ def add_account_to_entries(entries: list, account: str):
         entry['account'] = account
 
 
-def save_entries_to_dataframe(transactions_df: pd.DataFrame, data: list):
+def parse_statement(folder: str, filename: str, account_name: str, account_info: dict,
+                    lines: list = None, layout: int = None, keep_lines: bool = False):
+    """
+    Read a single statement and parse it for transactions
+
+    Pages are read one at a time and only their transaction lines are kept, unless all
+    lines are kept for caching. The layout is detected over the whole statement, as lines
+    on a summary page can match a different layout than the transactions.
+
+    :param folder: Folder containing the statement
+    :param filename: Filename of the statement
+    :param account_name: Account the statement belongs to
+    :param account_info: Configuration of the account the statement belongs to
+    :param lines: Previously read lines of the statement, to skip reading the PDF
+    :param layout: Index of the entry matcher last used for the account, if known
+    :param keep_lines: Whether to return the lines read from the PDF
+    :return: Tuple of the lines read from the PDF (None unless kept), the TransactionBatch
+             of transactions and the index of the entry matcher used
+    :raises ValueError: If no matcher matches or the Negative Separator is missing
+    """
+
+    if lines is None:
+        pages = iter_pdf_pages(folder, filename, account_info.get('End Marker'),
+                               account_info.get('Statement Pages'),
+                               account_info.get('Statement Regions'))
+    else:
+        pages = [lines]
+        keep_lines = False
+    kept_lines = [] if keep_lines else None
+
+    statement_date = find_statement_date(filename)
+    if statement_date is not None:
+        statement_date = statement_date.date()
+
+    # Special case for statements that don't show negative amounts
+    reverse = account_info['Type'] == 'Credit'
+    separator = account_info.get('Negative Separator')
+    separator_found = separator is None
+
+    candidate_lines = []
+    candidate_reverse = []
+    for page_lines in pages:
+        if kept_lines is not None:
+            kept_lines.extend(page_lines)
+
+        # Flip the sign from the separator line onwards
+        split_index = None
+        if not separator_found and separator in page_lines:
+            split_index = page_lines.index(separator)
+            separator_found = True
+
+        with metrics.stage('match', filename):
+            for position in matcher_engine.candidates(page_lines):
+                candidate_lines.append(page_lines[position])
+                candidate_reverse.append(
+                    reverse != (split_index is not None and position >= split_index))
+
+        if split_index is not None:
+            reverse = not reverse
+
+    if not separator_found:
+        raise ValueError('No matching lines found')
+    with metrics.stage('match', filename):
+        detected, matches = matcher_engine.extract(candidate_lines, layout)
+        entries = entries_from_matches(matches, pd.Series(candidate_reverse, dtype=bool),
+                                       statement_date)
+
+    entries.stamp('account', account_name)
+    metrics.count('statements_parsed')
+    metrics.count('transactions_parsed', len(entries))
+    return kept_lines, entries, detected
+
+
+def parse_statements(folder: str, filenames: list, accounts: dict, workers: int = None,
+                     cache: StatementCache = None, account_names: dict = None,
+                     progress=None):
+    """
+    Read and parse statements for transactions, spreading the work over a process pool
+
+    A statement that fails to parse is reported in the errors instead of aborting the
+    whole batch
+
+    :param folder: Folder containing the statements
+    :param filenames: Filenames of the statements
+    :param accounts: Dictionary of account names to account configuration
+    :param workers: Number of worker processes. 1 parses in the current process and None
+                    uses every core
+    :param cache: Cache of previously read lines and parsed transactions
+    :param account_names: Already known account names of the statements, eg. from a catalog
+    :param progress: Function called as each statement finishes, with the filename, its
+                     TransactionBatch (None if it failed) and the error message (None if
+                     it succeeded)
+    :return: Tuple of the TransactionBatch of transactions sorted by date and account, each
+             noting the filename of its statement, and a dictionary of filenames to error
+             messages
+    :raises ValueError: If the number of workers is not positive
+    """
+
+    if workers is not None and workers < 1:
+        raise ValueError('Number of workers must be positive')
+
+    results = {}
+    errors = {}
+
+    def finish(filename, entries=None, error=None):
+        if error is not None:
+            errors[filename] = error
+        else:
+            entries.stamp('statement', filename)
+            results[filename] = entries
+        if progress is not None:
+            progress(filename, entries, error)
+
+    # Match accounts up front so that unknown files don't need a worker
+    jobs = []
+    for filename in filenames:
+        try:
+            if account_names is not None and account_names.get(filename) is not None:
+                account_name = account_names[filename]
+            else:
+                account_name = find_account_name(accounts, filename)
+        except NameError as e:
+            finish(filename, error=str(e))
+            continue
+        jobs.append((filename, account_name, accounts[account_name]))
+
+    # Layouts pinned by earlier imports, which may have run in other processes
+    pins_key = f'pinned-{hash_matchers(entry_matchers)}'
+    if cache is not None:
+        matcher_engine.pinned.update(cache.get(pins_key) or {})
+
+    # Skip statements that are unchanged since they were last parsed
+    pending = []
+    cache_keys = {}
+    for filename, account_name, account_info in jobs:
+        lines = None
+        if cache is not None:
+            try:
+                content_hash = hash_file(os.path.join(folder, filename))
+            except OSError as e:
+                finish(filename, error=f'{type(e).__name__}: {e}')
+                continue
+            settings_hash = hash_parse_settings(entry_matchers, account_info, filename)
+            lines_key = f'lines-{content_hash}-{hash_extract_settings(account_info)}'
+            entries_key = f'entries-{content_hash}-{settings_hash}-{account_name}'
+            cache_keys[filename] = (lines_key, entries_key)
+
+            with metrics.stage('cache_lookup', filename):
+                entries = cache.get(entries_key)
+                if entries is None:
+                    lines = cache.get(lines_key)
+            if entries is not None:
+                metrics.count('statements_cached')
+                finish(filename, entries)
+                continue
+
+        pending.append((filename, account_name, account_info, lines))
+
+    def collect(filename, account_name, parse):
+        try:
+            lines, entries, layout = parse()
+        except Exception as e:
+            finish(filename, error=f'{type(e).__name__}: {e}')
+            return
+        matcher_engine.pin(account_name, layout)
+        if filename in cache_keys:
+            lines_key, entries_key = cache_keys[filename]
+            if lines is not None:
+                cache.put(lines_key, lines)
+            cache.put(entries_key, entries)
+        finish(filename, entries)
+
+    # Parse in the current process
+    if workers == 1 or len(pending) <= 1:
+        for filename, account_name, account_info, lines in pending:
+            collect(filename, account_name, lambda: parse_statement(
+                folder, filename, account_name, account_info, lines,
+                matcher_engine.pinned.get(account_name), cache is not None))
+    # Parse in parallel, collecting statements as they finish
+    # Worker processes send back their metrics along with the results
+    else:
+        captured = metrics.enabled
+        parse = partial(run_captured, parse_statement) if captured else parse_statement
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+
+            def submit(filename, account_name, account_info, lines):
+                future = executor.submit(parse, folder, filename, account_name, account_info,
+                                         lines, matcher_engine.pinned.get(account_name),
+                                         cache is not None)
+                futures[future] = (filename, account_name)
+
+            # Accounts without a known layout parse one statement first, so the others
+            # start with the layout it finds
+            held = {}
+            for job in pending:
+                account_name = job[1]
+                if account_name in held:
+                    held[account_name].append(job)
+                    continue
+                if account_name not in matcher_engine.pinned:
+                    held[account_name] = []
+                submit(*job)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename, account_name = futures.pop(future)
+                    if captured:
+                        collect(filename, account_name,
+                                lambda: metrics.unwrap(future.result()))
+                    else:
+                        collect(filename, account_name, future.result)
+                    for job in held.pop(account_name, []):
+                        submit(*job)
+
+    if cache is not None:
+        cache.put(pins_key, dict(matcher_engine.pinned))
+        cache.flush()
+
+    # Combine in file order so ties sort the same as a sequential import
+    data = TransactionBatch.concat([results[filename] for filename, _, _ in jobs
+                                    if filename in results])
+
+    return data.sorted(), errors
+
+
+def categorize_entries(merchants: MerchantIndex, entries: list):
+    """
+    Fill in the category and subcategory of transactions in place from the history of
+    their merchants, leaving categories that are already set
+
+    :param merchants: Most frequent category of each merchant in the ledger
+    :param entries: TransactionBatch of transactions
+    """
+
+    if not len(entries):
+        return
+
+    with metrics.stage('categorize'):
+        found = merchants.lookup(entries.column('store'))
+        current = entries.column('category').astype(object)
+        guessed = (current.isna() | (current == '')) & found['category'].notna()
+        entries.fill('category', found['category'].where(guessed))
+        entries.fill('subcategory', found['subcategory'].where(guessed))
+    metrics.count('transactions_categorized', int(guessed.sum()))
+
+
+"""
+Ledgers already opened in this process, by absolute path
+"""
+_opened_ledgers = {}
+_opened_ledgers_lock = threading.Lock()
+
+
+def _forget_opened_ledgers():
+    # A forked job must not use the parent's ledgers, whose locks another thread may
+    # have held at the time of the fork
+    global _opened_ledgers_lock
+    _opened_ledgers.clear()
+    _opened_ledgers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_opened_ledgers)
+
+
+def open_ledger(config: dict):
+    """
+    Open the configured ledger
+
+    A Transactions store ending in .sqlite or .db is kept in an SQLite database that
+    several serving processes can share. Other paths are loaded into memory.
+
+    Apps served from one process share the ledger opened first, so the transactions are
+    only held in memory once and each app sees what the others add. A forked process
+    opens its own.
+
+    :param config: Parsed config.json
+    :return: SqliteLedger or ResidentLedger
+    """
+
+    ledger_path = config['Paths'].get('Transactions store') or \
+        config['Paths']['Transactions csv']
+    with _opened_ledgers_lock:
+        ledger = _opened_ledgers.get(os.path.abspath(ledger_path))
+        if ledger is None:
+            if os.path.splitext(ledger_path)[1].lower() in ('.sqlite', '.db'):
+                ledger = SqliteLedger(ledger_path)
+            else:
+                ledger = ResidentLedger(LedgerWriter(
+                    ledger_path, config.get('Ledger Compact Segments', 20)))
+            _opened_ledgers[os.path.abspath(ledger_path)] = ledger
+
+    return ledger
+
+
+def save_entries_to_dataframe(ledger, data):
     """
-    Add more transactions in list form to the dataframe and persist the changes
+    Add more transactions to the ledger and persist the changes
+
+    Only the new transactions are written, so the cost depends on the number of rows
+    added rather than the size of the ledger
 
-    :param transactions_df: Original DataFrame containing transactions
-    :param data: List of dictionaries representing transactions to be added
-    :return: The modified transactions_df
+    :param ledger: ResidentLedger or SqliteLedger
+    :param data: TransactionBatch or list of dictionaries representing transactions to
+                 be added
     """
 
-    entries_df = pd.DataFrame(data)
-    transactions_df = pd.concat([transactions_df, entries_df], ignore_index=True, sort=False)
-    transactions_df.sort_values(by=['date', 'account'], inplace=True)
-    transactions_df.to_csv('data.csv', index=False)
+    # The statement is only tracked while importing and isn't part of the ledger
+    with metrics.stage('save'):
+        entries_df = data.to_frame() if isinstance(data, TransactionBatch) else pd.DataFrame(data)
+        entries_df = entries_df.drop(columns=['statement'], errors='ignore')
+        ledger.add(normalize_ledger(entries_df))
     data.clear()
 
-    return transactions_df
 
+def open_statement_stores(config: dict, root: str):
+    """
+    Open the configured statement catalog and cache of parsed statements
+
+    :param config: Parsed config.json
+    :param root: Statement root folder
+    :return: Tuple of the StatementCatalog and the StatementCache, each None if it is
+             not configured
+    """
+
+    # The catalog reads statement names with the helpers in this module
+    from Catalog import StatementCatalog
+
+    statement_catalog = None
+    if 'Statement Catalog' in config['Paths']:
+        statement_catalog = StatementCatalog(config['Paths']['Statement Catalog'], root,
+                                             config['Accounts'])
+    statement_cache = None
+    if 'Statement Cache' in config['Paths']:
+        statement_cache = StatementCache(config['Paths']['Statement Cache'],
+                                         config.get('Statement Cache MB', 256) * 1024 * 1024)
+
+    return statement_catalog, statement_cache
 
-def calculate_totals(transactions_df: pd.DataFrame, account_options: list):
+
+def discover_statements(statement_catalog, root: str, min_date: datetime.date,
+                        max_date: datetime.date = None):
     """
-    Calculate the total amounts for each account given using the transactions given
+    Find the statements to import in a date range
+
+    With a catalog, only statements that were not ingested yet are returned
+
+    :param statement_catalog: StatementCatalog, or None to list the statement root
+    :param root: Statement root folder
+    :param min_date: Minimum statement date
+    :param max_date: Maximum statement date, or None for no maximum
+    :return: Tuple of the list of statement filenames and a dictionary of filenames to
+             account names, or None without a catalog
+    """
+
+    if statement_catalog is None:
+        return find_files(root, min_date, max_date), None
+
+    statement_catalog.rescan()
+    account_names = dict(statement_catalog.find_statements(min_date, max_date,
+                                                           skip_ingested=True))
+    return list(account_names), account_names
+
+
+def save_imported_entries(ledger, data, statement_catalog, statements: list):
+    """
+    Add imported transactions to the ledger and mark their statements as ingested
+
+    :param ledger: ResidentLedger or SqliteLedger
+    :param data: TransactionBatch or list of dictionaries representing transactions to
+                 be added
+    :param statement_catalog: StatementCatalog, or None if statements are not tracked
+    :param statements: Filenames of every imported statement, including ones with no new
+                       transactions
+    """
+
+    save_entries_to_dataframe(ledger, data)
+    if statement_catalog is not None:
+        statement_catalog.mark_ingested(statements)
 
-    :param transactions_df: DataFrame containing transactions
+
+def calculate_totals(balances: BalanceIndex, account_options: list):
+    """
+    Show the total amounts for each account given
+
+    :param balances: Running balances of every account
     :param account_options: Accounts to generate balances for
     :return: Balances as a  Dash html paragraph
     """
 
+    # Dash is only imported by the apps, so scripts using Utils don't pay for it
+    from dash import html
+
     total_strs = ['New account balances:']
 
-    # Calculate balances for each account given
-    for account in sorted(account_options):
-        account_transactions = transactions_df[transactions_df['account'] == account]
-        total_strs.append(html.Br())
-        total_strs.append(f'\t{account}: {round(sum(account_transactions["amount"]), 2)}')
+    # Look up balances for each account given
+    with metrics.stage('totals'):
+        for account in sorted(account_options):
+            total_strs.append(html.Br())
+            total_strs.append(f'\t{account}: {balances.balance(account)}')
 
     return html.P(total_strs)
+
+
+def diagnostics_panel(children: list = None):
+    """
+    Create a collapsible panel showing the pipeline metrics
+
+    :param children: Extra components to show in the panel
+    :return: Dash html details element
+    """
+
+    from dash import dash_table as dt, html
+
+    return html.Details([
+        html.Summary('Diagnostics'),
+        html.Button('Refresh', id='refresh-metrics'),
+        dt.DataTable(
+            id='metrics-table',
+            columns=[
+                {'name': 'Stage', 'id': 'stage', 'type': 'text'},
+                {'name': 'Count', 'id': 'count', 'type': 'numeric'},
+                {'name': 'Total (s)', 'id': 'total', 'type': 'numeric'},
+                {'name': 'Mean (ms)', 'id': 'mean', 'type': 'numeric'},
+                {'name': 'p50 (ms)', 'id': 'p50', 'type': 'numeric'},
+                {'name': 'p95 (ms)', 'id': 'p95', 'type': 'numeric'},
+                {'name': 'Max (ms)', 'id': 'max', 'type': 'numeric'},
+            ],
+            style_cell={'textAlign': 'left'},
+            style_as_list_view=True,
+            data=[]
+        ),
+        html.Div(id='metrics-counters'),
+    ] + (children or []))
+
+
+def format_metrics(snapshot: dict):
+    """
+    Format a metrics snapshot for the diagnostics panel
+
+    :param snapshot: Snapshot from Metrics.snapshot
+    :return: Tuple of the rows for the metrics table and the counters as a Dash html
+             paragraph
+    """
+
+    from dash import html
+
+    if not snapshot['enabled']:
+        return [], html.P('Metrics are disabled, set "Metrics" to true in config.json')
+
+    rows = [{
+        'stage': stage,
+        'count': summary['count'],
+        'total': round(summary['total_seconds'], 3),
+        'mean': round(summary['mean_seconds'] * 1000, 2),
+        'p50': round(summary['p50_seconds'] * 1000, 2),
+        'p95': round(summary['p95_seconds'] * 1000, 2),
+        'max': round(summary['max_seconds'] * 1000, 2),
+    } for stage, summary in snapshot['stages'].items()]
+
+    counter_strs = ['Counters:']
+    for counter, value in snapshot['counters'].items():
+        counter_strs.append(html.Br())
+        counter_strs.append(f'\t{counter}: {value}')
+
+    return rows, html.P(counter_strs)
@@ -3,26 +3,59 @@ from dash import dash_table as dt, dcc
 from dash import html
 from dash.dash_table.Format import Format, Symbol
 from dash.dependencies import Input, Output, State
+from Config import app_prefix, load_config
+from Metrics import metrics, profile_call, register_metrics_routes
+from Pending import PendingStore, new_session_id
 from Utils import *
 import dash
 import datetime
-import json
-import operator
-import pandas as pd
+import diskcache
+import functools
+import os
+
+app = dash.Dash(__name__, requests_pathname_prefix=app_prefix('addData'))
+
+
+def open_stores():
+    """
+    Open the ledger, the statement catalog and cache and the pending and job stores from
+    their configured paths
+
+    Background imports are forked from the app, so they open their own instead of using
+    the app's, whose locks and database connections may have been in use by a request
+    thread at the time of the fork
+
+    :return: Tuple of the ledger, the StatementCatalog or None, the StatementCache or
+             None, the PendingStore and the job cache
+    """
+
+    statement_catalog, statement_cache = open_statement_stores(config, path)
+    pending_store = PendingStore(diskcache.Cache(config['Paths'].get('Pending Store',
+                                                                     'pending')))
+    job_cache = diskcache.Cache(config['Paths'].get('Job Queue', 'jobs'))
+
+    return open_ledger(config), statement_catalog, statement_cache, pending_store, job_cache
 
-app = dash.Dash(__name__)
 
 # Get configuration items
-with open('config.json') as f:
-    config = json.load(f)
-    path = config['Paths']['Statement Root']
-    transactions_csv = config['Paths']['Transactions csv']
-    category_options = [{'label': category, 'value': category} for category in config['Categories']]
-    category_options = sorted(category_options, key=operator.itemgetter('label'))
-
-# Create app layout
-app.layout = html.Div(
-    [
+config = load_config()
+metrics.enabled = config.get('Metrics', False)
+path = config['Paths']['Statement Root']
+import_workers = config.get('Import Workers')
+ledger, statement_catalog, statement_cache, pending_store, job_cache = open_stores()
+background_manager = dash.DiskcacheManager(job_cache)
+profile_folder = config['Paths'].get('Profiles', 'profiles')
+
+
+@functools.lru_cache(maxsize=None)
+def build_layout():
+    """
+    Create the app layout once, on the first page load rather than at startup
+
+    :return: Dash html div containing the layout shared by every page load
+    """
+
+    return html.Div([
         html.Big('Minimum date for statements'),
         dcc.DatePickerSingle(
             id='min-date',
@@ -78,110 +111,300 @@ app.layout = html.Div(
                     'backgroundColor': 'orangered'
                 }
             ],
-            dropdown={'category': {'options': category_options}},
-            dropdown_conditional=[{
-                    'if': {
-                        'column_id': 'subcategory',
-                        'filter_query': f'{{category}} eq "{category}"'
-                    },
-                    'options': sorted([
-                        {'label': subcategory, 'value': subcategory}
-                        for subcategory in config['Categories'][category]['Subcategories']
-                    ], key=operator.itemgetter('label'))
-                } for category in config['Categories']],
+            dropdown={'category': {'options': config.category_options}},
+            dropdown_conditional=config.subcategory_dropdowns,
             editable=True,  # No validation in table
             row_deletable=True,
+            page_action='custom',  # Pending rows are paged, sorted and filtered on the server
+            page_current=0,
             page_size=20,
+            page_count=1,
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             style_as_list_view=True,
             data=[]
         ),
         html.Br(),
         html.Button('Import statements', id='import-statements'),
         html.Button('Write', id='write'),
+        dcc.Checklist(
+            id='profile-import',
+            options=[{'label': 'Profile the next import', 'value': 'profile'}],
+            value=[],
+            inline=True
+        ),
+        html.Br(),
+        html.Progress(id='import-progress', value='0', max='1'),
+        html.Div(id='import-status'),
         html.Div('No changes yet', id='write-status'),
-    ]
+        dcc.Store(id='import-partial'),
+        dcc.Store(id='import-done'),
+        html.Br(),
+        diagnostics_panel([html.Pre(id='import-profile')]),
+    ])
+
+
+def serve_layout():
+    """
+    Create the layout for a page load, with its own session for pending rows
+
+    :return: Dash html div containing the app layout
+    """
+
+    return html.Div([build_layout(), dcc.Store(id='session-id', data=new_session_id())])
+
+
+app.layout = serve_layout
+
+
+@app.callback(
+    Output('import-done', 'data'),
+    Input('import-statements', 'n_clicks'),
+    State('min-date', 'date'),
+    State('profile-import', 'value'),
+    State('session-id', 'data'),
+    background=True,
+    manager=background_manager,
+    progress=[
+        Output('import-partial', 'data'),
+        Output('import-progress', 'value'),
+        Output('import-progress', 'max'),
+        Output('import-status', 'children'),
+    ],
+    running=[(Output('import-statements', 'disabled'), True, False)],
+    prevent_initial_call=True
 )
+def import_in_background(set_progress, import_statement, min_date, profile, session):
+    """
+    Import statements in a background job, streaming rows to the pending store as each
+    statement finishes
+
+    The job runs in a process forked from the app, so it opens its own ledger and stores
+    and queues its metrics in the job cache for the app to collect. A profiled import
+    saves its cProfile statistics to the profile folder.
+
+    :param set_progress: Function to send progress to the page
+    :param import_statement: (unused) Button info for the import-statement button
+    :param min_date: Minimum date for statements
+    :param profile: Selected options of the profile-import checklist
+    :param session: Session id for the pending rows
+    :return: Number of imported transactions
+    """
+
+    job_ledger, job_catalog, job_statement_cache, job_pending_store, job_queue = open_stores()
+    job_pending_store.clear(session)
+
+    def report(done, total, entries, errors, statement):
+        num_rows = job_pending_store.add(session, entries.to_records(),
+                                         [statement] if statement is not None else None)
+        set_progress((num_rows, str(done), str(max(total, 1)),
+                      format_import_progress(done, total, errors)))
+
+    with metrics.capture() as samples:
+        args = (min_date, job_ledger, job_catalog, job_statement_cache, report)
+        if profile:
+            (data, _), stats, profile_report = profile_call(import_statements_to_table, *args)
+            os.makedirs(profile_folder, exist_ok=True)
+            profile_path = os.path.join(profile_folder,
+                                        f'import-{datetime.datetime.now():%Y%m%d-%H%M%S}.prof')
+            stats.dump_stats(profile_path)
+            job_queue.set('import-profile', f'Saved to {profile_path}\n\n{profile_report}')
+        else:
+            data, _ = import_statements_to_table(*args)
+    if samples:
+        job_queue.push(samples, prefix='metrics')
+
+    return len(data)
 
 
 @app.callback(
     Output('added-rows', 'data'),
+    Output('added-rows', 'page_count'),
     Output('write-status', 'children'),
-    Input('import-statements', 'n_clicks'),
+    Input('import-partial', 'data'),
+    Input('import-done', 'data'),
     Input('write', 'n_clicks'),
+    Input('added-rows', 'data_timestamp'),
+    Input('added-rows', 'page_current'),
+    Input('added-rows', 'page_size'),
+    Input('added-rows', 'sort_by'),
+    Input('added-rows', 'filter_query'),
     State('added-rows', 'data'),
-    State('min-date', 'date'),
+    State('added-rows', 'data_previous'),
+    State('session-id', 'data'),
     prevent_initial_call=True
 )
-def import_or_write(import_statement, write, entries, min_date):
+def import_or_write(partial, imported, write, data_timestamp, page_current, page_size,
+                    sort_by, filter_query, data, data_previous, session):
     """
-    Import statements or persist entered changes
+    Show imported statements or persist entered changes
 
-    Create new editable entries that can be persisted in to the backing csv file
+    Only the displayed page is sent to the browser. Pending rows stay in the server-side
+    store until they are written to the backing file
 
-    :param import_statement: (unused) Button info for the import-statement button
+    :param partial: (unused) Number of rows imported so far by a running import
+    :param imported: (unused) Number of rows from a finished import
     :param write: (unused) Button info for the write button
-    :param min_date: Minimum date for statements
-    :return: Tuple containing data to be displayed and a status message
+    :param data_timestamp: (unused) Time of the last edit in the table
+    :param page_current: Page displayed in the table
+    :param page_size: Number of rows per page
+    :param sort_by: Columns to sort the rows by
+    :param filter_query: Query to filter the rows with
+    :param data: Rows on the displayed page
+    :param data_previous: Rows on the displayed page before the last edit
+    :param session: Session id for the pending rows
+    :return: Tuple containing the page of data to be displayed, the number of pages and
+             a status message
     """
 
     # Get the trigger
     trigger = dash.callback_context.triggered[0]['prop_id']
+    status = dash.no_update
+
+    # Show imported statements
+    if trigger in ('import-partial.data', 'import-done.data'):
+        status = 'No changes yet'
 
-    # Import statements
-    if trigger == 'import-statements.n_clicks':
-        return (import_statements_to_table(min_date), 'No changes yet')
+    # Keep edits and deleted rows
+    if trigger == 'added-rows.data_timestamp':
+        pending_store.apply_edits(session, data, data_previous)
 
     # Write changes to csv
     if trigger == 'write.n_clicks':
-        return ([], append_data_to_csv(entries, [acct for acct in config['Accounts']]))
+        with pending_store.writing(session) as (entries, statements):
+            status = append_data_to_csv(entries, [acct for acct in config['Accounts']],
+                                        statements)
+
+    page, page_count = pending_store.page(session, page_current, page_size, sort_by,
+                                          filter_query)
+    return (page, page_count, status)
 
 
-def import_statements_to_table(min_date: str):
+def import_statements_to_table(min_date: str, ledger, statement_catalog,
+                               statement_cache, progress=None):
     """
     Import statements after a given date into a table for editing
 
     :param min_date: Minimum date to search for statements
-    :return: List of dictionaries representing transactions
+    :param ledger: ResidentLedger or SqliteLedger to leave out existing transactions with
+    :param statement_catalog: StatementCatalog to find statements with, or None to list
+                              the statement folder
+    :param statement_cache: StatementCache of previously parsed statements, or None
+    :param progress: Function called as each statement finishes, with the number of
+                     statements done, the total, the TransactionBatch of new transactions
+                     from the statement, a dictionary of filenames to error messages so
+                     far and the filename of the statement if it was imported, else None
+    :return: Tuple of the TransactionBatch of new transactions and a dictionary of
+             filenames to error messages for statements that could not be imported
     """
 
     # Get relevant files
-    min_date_as_date = datetime.datetime.strptime(min_date, '%Y-%m-%d')
-    files = find_files(path, min_date_as_date)
-
-    # Get all entries
-    data = []
-    for filename in files:
-        account_name = find_account_name(config['Accounts'], filename)
-        lines = read_pdf_to_lines(path, filename)
-
-        # Special case for statements that don't show negative amounts
-        account_info = config['Accounts'][account_name]
-        negate = account_info['Type'] == 'Credit'
-        if 'Negative Separator' in account_info:
-            split_index = find_matching_line(lines, account_info['Negative Separator'])
-            entries = find_entries(lines[:split_index], negate)
-            entries += find_entries(lines[split_index:], not negate)
-        # Parse normally
+    files, account_names = discover_statements(
+        statement_catalog, path, datetime.datetime.strptime(min_date, '%Y-%m-%d'))
+
+    # Get all entries, leaving out ones already in the ledger and guessing categories from
+    # their merchants as each statement finishes
+    batches = []
+    errors = {}
+    seen = {}
+    done = 0
+
+    def report(filename, entries, error):
+        nonlocal done
+        done += 1
+        new_entries = TransactionBatch()
+        if error is not None:
+            errors[filename] = error
         else:
-            entries = find_entries(lines, negate)
+            new_entries = ledger.filter_new(entries, seen).sorted()
+            categorize_entries(ledger.merchant_categories, new_entries)
+            batches.append(new_entries)
+        if progress is not None:
+            progress(done, len(files), new_entries, errors,
+                     filename if error is None else None)
 
-        add_account_to_entries(entries, account_name)
-        data += entries
+    parse_statements(path, files, config['Accounts'], import_workers, statement_cache,
+                     account_names, report)
+    if progress is not None and not files:
+        progress(0, 0, TransactionBatch(), errors, None)
 
-    return sorted(data, key=operator.itemgetter('date', 'account'))
+    return TransactionBatch.concat(batches).sorted(), errors
 
 
-def append_data_to_csv(entries: list, account_options: list):
+def format_import_progress(done: int, total: int, errors: dict):
+    """
+    Format the progress of an import and the statements that failed as a status message
+
+    :param done: Number of statements finished
+    :param total: Number of statements to import
+    :param errors: Dictionary of filenames to error messages
+    :return: Status message as a Dash html paragraph
+    """
+
+    error_strs = [f'Imported {done}/{total} statements']
+    if errors:
+        error_strs.append(html.Br())
+        error_strs.append('Failed to import:')
+    for filename in sorted(errors):
+        error_strs.append(html.Br())
+        error_strs.append(f'\t{filename}: {errors[filename]}')
+
+    return html.P(error_strs)
+
+
+def append_data_to_csv(entries: list, account_options: list, statements: list):
     """
     Write entries to backing csv file
 
     :param entries: Transactions to add to backing csv file
     :param account_options: Accounts to calculate the balances for
+    :param statements: Filenames of every statement imported into the entries, including
+                       ones with no new transactions, to mark as ingested
     :return: Dash html paragraph containing balances of each account
     """
 
-    transactions_df = save_entries_to_dataframe(pd.read_csv(transactions_csv), entries)
-    return calculate_totals(transactions_df, account_options)
+    save_imported_entries(ledger, entries, statement_catalog, statements)
+    return calculate_totals(ledger.account_balances, account_options)
+
+
+def collect_job_metrics():
+    """
+    Merge the metrics queued by finished background imports
+    """
+
+    while True:
+        _, samples = job_cache.pull(prefix='metrics')
+        if samples is None:
+            return
+        metrics.merge(samples)
+
+
+@app.callback(
+    Output('metrics-table', 'data'),
+    Output('metrics-counters', 'children'),
+    Output('import-profile', 'children'),
+    Input('refresh-metrics', 'n_clicks'),
+    Input('import-done', 'data'),
+)
+def refresh_metrics(refresh, imported):
+    """
+    Show the pipeline metrics and the report of the last profiled import
+
+    :param refresh: (unused) Button info for the refresh button
+    :param imported: (unused) Number of rows from a finished import
+    :return: Tuple containing the rows of the metrics table, the counters and the
+             profile report
+    """
+
+    collect_job_metrics()
+    rows, counters = format_metrics(metrics.snapshot())
+    return rows, counters, job_cache.get('import-profile', '')
+
+
+register_metrics_routes(app.server, ledger, collect_job_metrics)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,134 @@
+"""Import statements straight into the ledger without starting the UI."""
+import argparse
+import datetime
+import os
+import time
+
+from Config import load_config
+from Utils import discover_statements, open_ledger, open_statement_stores, \
+    parse_statements, save_imported_entries
+
+
+def parse_date_argument(date_string: str):
+    """
+    Parse a date given on the command line
+
+    :param date_string: Date as YYYY-MM-DD
+    :return: datetime.datetime object
+    :raises argparse.ArgumentTypeError: If the date is not in the expected format
+    """
+
+    try:
+        return datetime.datetime.strptime(date_string, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected a date as YYYY-MM-DD, got {date_string}')
+
+
+def batch_ingest(config: dict, root: str, min_date: datetime.datetime,
+                 max_date: datetime.datetime = None, workers: int = None,
+                 dry_run: bool = False):
+    """
+    Import statements in a date range and write their new transactions to the ledger
+
+    :param config: Parsed config.json
+    :param root: Statement root folder
+    :param min_date: Minimum statement date
+    :param max_date: Maximum statement date, or None for no maximum
+    :param workers: Number of worker processes, or None to use every core
+    :param dry_run: Whether to parse without writing to the ledger
+    :return: Dictionary with the number of statements, rows and errors, the error
+             messages and the seconds spent in each stage
+    """
+
+    timings = {}
+
+    # Open the ledger and optional catalog and cache
+    start = time.perf_counter()
+    ledger = open_ledger(config)
+    statement_catalog, statement_cache = open_statement_stores(config, root)
+    timings['load'] = time.perf_counter() - start
+
+    # Find statements
+    start = time.perf_counter()
+    files, account_names = discover_statements(statement_catalog, root, min_date, max_date)
+    timings['scan'] = time.perf_counter() - start
+
+    # Read and parse statements
+    start = time.perf_counter()
+    data, errors = parse_statements(root, files, config['Accounts'], workers,
+                                    statement_cache, account_names)
+    timings['parse'] = time.perf_counter() - start
+
+    # Leave out transactions already in the ledger
+    start = time.perf_counter()
+    data = ledger.filter_new(data)
+    timings['filter'] = time.perf_counter() - start
+
+    # Write to the ledger
+    start = time.perf_counter()
+    num_rows = len(data)
+    statements = sorted(set(files) - set(errors))
+    if not dry_run:
+        save_imported_entries(ledger, data, statement_catalog, statements)
+    timings['save'] = time.perf_counter() - start
+
+    return {
+        'statements': len(files),
+        'rows': num_rows,
+        'errors': errors,
+        'timings': timings,
+    }
+
+
+def print_report(report: dict):
+    """
+    Print the throughput and per-stage timing of an import
+
+    :param report: Result from batch_ingest
+    """
+
+    total = sum(report['timings'].values())
+    parse_seconds = report['timings']['parse'] or float('nan')
+
+    print(f'Imported {report["rows"]} rows from {report["statements"]} statements '
+          f'in {total:.2f}s')
+    print(f'  {report["statements"] / parse_seconds:.1f} statements/s, '
+          f'{report["rows"] / parse_seconds:.1f} rows/s while parsing')
+    for stage, seconds in report['timings'].items():
+        print(f'  {stage:>8}: {seconds:.3f}s')
+
+    if report['errors']:
+        print(f'Failed to import {len(report["errors"])} statements:')
+        for filename in sorted(report['errors']):
+            print(f'  {filename}: {report["errors"][filename]}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Import statements into the ledger')
+    parser.add_argument('--config', default='config.json', help='Configuration file')
+    parser.add_argument('--root', help='Statement root, defaults to the configured one')
+    parser.add_argument('--from', dest='min_date', type=parse_date_argument,
+                        default=datetime.datetime(1900, 1, 1),
+                        help='Minimum statement date as YYYY-MM-DD')
+    parser.add_argument('--to', dest='max_date', type=parse_date_argument,
+                        help='Maximum statement date as YYYY-MM-DD')
+    parser.add_argument('--workers', type=int,
+                        help='Number of worker processes, defaults to every core')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Parse statements without writing to the ledger')
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config)
+    except ValueError as e:
+        parser.error(str(e))
+    root = args.root if args.root is not None else config['Paths']['Statement Root']
+    if not os.path.isdir(root):
+        parser.error(f'Statement root {root} is not a folder')
+
+    report = batch_ingest(config, root, args.min_date, args.max_date, args.workers,
+                          args.dry_run)
+    print_report(report)
+    if report['errors']:
+        raise SystemExit(1)
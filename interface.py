@@ -3,32 +3,40 @@ from dash import dash_table as dt, dcc
 from dash import html
 from dash.dash_table.Format import Format, Symbol
 from dash.dependencies import Input, Output, State
+from Config import app_prefix, load_config
+from Metrics import metrics, register_metrics_routes
+from Pending import PendingStore, new_session_id
 from Utils import *
 import dash
 import datetime
-import json
+import diskcache
+import functools
 import pandas as pd
+import plotly.graph_objects as go
 
 from Utils import save_entries_to_dataframe
 
-app = dash.Dash(__name__)
+app = dash.Dash(__name__, requests_pathname_prefix=app_prefix('interface'))
 
 # TODO: add last 4 digits to make unique
-# TODO: add json validation
 # Get configuration items
-with open('config.json') as f:
-    config = json.load(f)
-    transactions_csv = config['Paths']['Transactions csv']
-    account_options = [{'label': account, 'value': account} for account in config['Accounts']]
-    category_options = [{'label': category, 'value': category} for category in config['Categories']]
-    subcategory_options = {category: config['Categories'][category]['Subcategories']
-                           for category in config['Categories']}
+config = load_config()
+metrics.enabled = config.get('Metrics', False)
+ledger = open_ledger(config)
+pending_store = PendingStore(diskcache.Cache(config['Paths'].get('Pending Store', 'pending')))
+
 
 # TODO: fix layout
-# TODO: add chart to view old items
-app.layout = html.Div(
-    [
-        dcc.Dropdown(id='account', options=account_options),
+@functools.lru_cache(maxsize=None)
+def build_layout():
+    """
+    Create the app layout once, on the first page load rather than at startup
+
+    :return: Dash html div containing the layout shared by every page load
+    """
+
+    return html.Div([
+        dcc.Dropdown(id='account', options=config.account_options),
         dcc.DatePickerSingle(
             id='date',
             min_date_allowed=datetime.date(2020, 1, 1),
@@ -38,7 +46,7 @@ app.layout = html.Div(
         dcc.Input(id='store', type='text', placeholder='Store'),
         dcc.Input(id='description', type='text', placeholder='Description'),
         dcc.Input(id='amount', type='number', placeholder='Amount'),
-        dcc.Dropdown(id='category', options=category_options),
+        dcc.Dropdown(id='category', options=config.category_options),
         dcc.Dropdown(id='subcategory', options=[]),
         dcc.Input(id='notes', type='text', placeholder='Notes'),
         html.Br(),
@@ -88,7 +96,15 @@ app.layout = html.Div(
             ],
             editable=False,  # No validation in table
             row_deletable=True,
+            page_action='custom',  # Pending rows are paged, sorted and filtered on the server
+            page_current=0,
             page_size=20,
+            page_count=1,
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             style_as_list_view=True,
             data=[]
         ),
@@ -96,8 +112,51 @@ app.layout = html.Div(
         html.Button('Write', id='write'),
         html.Div('No changes yet', id='write_status'),
         html.Div(id='totals'),
-    ]
-)
+        html.Br(),
+        html.Big('History'),
+        dcc.Dropdown(id='history-accounts', options=config.account_options, multi=True,
+                     placeholder='All accounts'),
+        dcc.Dropdown(id='history-category', options=config.category_options,
+                     placeholder='All categories'),
+        dcc.DatePickerRange(id='history-dates'),
+        dcc.Graph(id='history-chart'),
+        dt.DataTable(
+            id='history-rows',
+            columns=[
+                {'name': 'Date', 'id': 'date', 'type': 'datetime'},
+                {'name': 'Store', 'id': 'store', 'type': 'text'},
+                {'name': 'Description', 'id': 'description', 'type': 'text'},
+                {'name': 'Account', 'id': 'account', 'type': 'text'},
+                {
+                    'name': 'Amount',
+                    'id': 'amount',
+                    'type': 'numeric',
+                    'format': Format(symbol=Symbol.yes).scheme('f').precision(2)},
+                {'name': 'Category', 'id': 'category', 'type': 'text'},
+                {'name': 'Subcategory', 'id': 'subcategory', 'type': 'text'},
+                {'name': 'Notes', 'id': 'notes', 'type': 'text'}
+            ],
+            style_cell={'textAlign': 'left'},
+            page_size=20,
+            style_as_list_view=True,
+            data=[]
+        ),
+        html.Br(),
+        diagnostics_panel(),
+    ])
+
+
+def serve_layout():
+    """
+    Create the layout for a page load, with its own session for pending rows
+
+    :return: Dash html div containing the app layout
+    """
+
+    return html.Div([build_layout(), dcc.Store(id='session-id', data=new_session_id())])
+
+
+app.layout = serve_layout
 
 
 @app.callback(
@@ -115,11 +174,12 @@ def set_sub_category(category):
         return []
     else:
         return [{'label': subcategory, 'value': subcategory}
-                for subcategory in subcategory_options[category]]
+                for subcategory in config.subcategories[category]]
 
 
 @app.callback(
     Output('added_rows', 'data'),
+    Output('added_rows', 'page_count'),
     Output('date', 'date'),
     Output('store', 'value'),
     Output('description', 'value'),
@@ -131,7 +191,14 @@ def set_sub_category(category):
     Output('totals', 'children'),
     Input('add', 'n_clicks'),
     Input('write', 'n_clicks'),
+    Input('added_rows', 'data_timestamp'),
+    Input('added_rows', 'page_current'),
+    Input('added_rows', 'page_size'),
+    Input('added_rows', 'sort_by'),
+    Input('added_rows', 'filter_query'),
     State('added_rows', 'data'),
+    State('added_rows', 'data_previous'),
+    State('session-id', 'data'),
     State('account', 'value'),
     State('date', 'date'),
     State('store', 'value'),
@@ -145,7 +212,14 @@ def set_sub_category(category):
 def add_or_write(
         add,
         write,
+        data_timestamp,
+        page_current,
+        page_size,
+        sort_by,
+        filter_query,
         data,
+        data_previous,
+        session,
         account,
         date,
         store,
@@ -158,9 +232,19 @@ def add_or_write(
     Add a new row or write the rows of displayed changes to the backing DataFrame
     and csv file. Since both modify the DataTable we must use the same callback
 
+    Pending rows are kept on the server and only the displayed page is sent to the
+    browser
+
     :param add: (unused) Button info for the add button
     :param write: (unused) Button info for the write button
-    :param data: Entered transactions
+    :param data_timestamp: (unused) Time of the last edit in the table
+    :param page_current: Page displayed in the table
+    :param page_size: Number of rows per page
+    :param sort_by: Columns to sort the rows by
+    :param filter_query: Query to filter the rows with
+    :param data: Rows on the displayed page
+    :param data_previous: Rows on the displayed page before the last edit
+    :param session: Session id for the pending rows
     :param account: Selected account
     :param date: Selected transaction date
     :param store: Merchant for transaction
@@ -173,10 +257,11 @@ def add_or_write(
 
     # Get the trigger
     trigger = dash.callback_context.triggered[0]['prop_id']
+    form = (dash.no_update,) * 9
 
-    # If adding a row we return the new data to the DataTable
+    # If adding a row we save it and clear the form
     if trigger == 'add.n_clicks':
-        data.append({
+        num_rows = pending_store.add(session, [{
             'date': date,
             'store': store,
             'description': description,
@@ -185,22 +270,139 @@ def add_or_write(
             'category': category,
             'subcategory': subcategory,
             'notes': notes,
-        })
-        return (data, datetime.date.today(), '', '', None,
-                None, None, '', f'Added {len(data)} rows', '')
+        }])
+        form = (datetime.date.today(), '', '', None,
+                None, None, '', f'Added {num_rows} rows', '')
+
+    # Deleted rows are removed from the pending rows
+    if trigger == 'added_rows.data_timestamp':
+        pending_store.apply_edits(session, data, data_previous)
 
     # If writing then we write to the main DataFrame, write to file,
     # and clear the DataTables
     if trigger == 'write.n_clicks':
 
         # Write to main DataFrame and backing file
-        num_changes = len(data)
-        transactions_df = save_entries_to_dataframe(pd.read_csv(transactions_csv), data)
-        totals_str = calculate_totals(transactions_df, [acct for acct in config['Accounts']])
+        with pending_store.writing(session) as (entries, _):
+            num_changes = len(entries)
+            save_entries_to_dataframe(ledger, entries)
+        totals_str = calculate_totals(ledger.account_balances,
+                                      [acct for acct in config['Accounts']])
 
-        return (data, date, store, description, amount, category, subcategory,
+        form = (date, store, description, amount, category, subcategory,
                 notes, f'Wrote {num_changes} rows', totals_str)
 
+    page, page_count = pending_store.page(session, page_current, page_size, sort_by,
+                                          filter_query)
+    return (page, page_count) + form
+
+
+def month_number(date: str):
+    """
+    Convert a date to the month number used by the rollups
+
+    :param date: Date as YYYY-MM-DD, or None
+    :return: Month as an integer like 202203, or None
+    """
+
+    if date is None:
+        return None
+    date = datetime.date.fromisoformat(date[:10])
+    return date.year * 100 + date.month
+
+
+@app.callback(
+    Output('history-chart', 'figure'),
+    Input('history-accounts', 'value'),
+    Input('history-category', 'value'),
+    Input('history-dates', 'start_date'),
+    Input('history-dates', 'end_date'),
+    Input('totals', 'children'),
+)
+def update_history_chart(accounts, category, start_date, end_date, totals):
+    """
+    Chart monthly totals from the rollups, by category or by the subcategories of the
+    selected category
+
+    :param accounts: Selected accounts, or None for every account
+    :param category: Selected category to drill into, or None for every category
+    :param start_date: First date to chart
+    :param end_date: Last date to chart
+    :param totals: (unused) Balances shown after a write
+    :return: Figure with a stacked bar per month
+    """
+
+    by = 'category' if category is None else 'subcategory'
+    monthly_df = ledger.category_rollups.query(by, accounts, category,
+                                               month_number(start_date),
+                                               month_number(end_date))
+
+    figure = go.Figure()
+    for value, group_df in monthly_df.groupby(by, sort=True):
+        figure.add_trace(go.Bar(
+            x=[f'{month // 100}-{month % 100:02d}' for month in group_df['month']],
+            y=group_df['amount'],
+            name=value or 'Uncategorized',
+            customdata=[value] * len(group_df),
+            hovertemplate='%{x}: %{y:$,.2f}',
+        ))
+    figure.update_layout(barmode='relative', xaxis_type='category', clickmode='event')
+
+    return figure
+
+
+@app.callback(
+    Output('history-rows', 'data'),
+    Input('history-chart', 'clickData'),
+    State('history-accounts', 'value'),
+    State('history-category', 'value'),
+)
+def show_history_rows(click_data, accounts, category):
+    """
+    Show the transactions behind a clicked bar
+
+    :param click_data: Point clicked in the history chart
+    :param accounts: Selected accounts, or None for every account
+    :param category: Selected category, or None for every category
+    :return: List of dictionaries representing transactions
+    """
+
+    if not click_data:
+        return []
+    point = click_data['points'][0]
+    start = pd.Timestamp(point['x'] + '-01')
+    end = start + pd.offsets.MonthEnd(1)
+
+    # Only the indexed rows of the clicked month are read
+    if category is None:
+        rows_df = ledger.query(start, end, accounts or None, [point['customdata']])
+    else:
+        rows_df = ledger.query(start, end, accounts or None, [category])
+        rows_df = rows_df[rows_df['subcategory'].astype(object).fillna('') ==
+                          point['customdata']]
+
+    rows_df = rows_df.assign(date=rows_df['date'].dt.strftime('%Y-%m-%d')).astype(object)
+    return rows_df.where(rows_df.notna(), None).to_dict('records')
+
+
+@app.callback(
+    Output('metrics-table', 'data'),
+    Output('metrics-counters', 'children'),
+    Input('refresh-metrics', 'n_clicks'),
+)
+def refresh_metrics(refresh):
+    """
+    Show the pipeline metrics
+
+    :param refresh: (unused) Button info for the refresh button
+    :return: Tuple containing the rows of the metrics table and the counters
+    """
+
+    return format_metrics(metrics.snapshot())
+
+
+register_metrics_routes(app.server, ledger)
+
 
 if __name__ == '__main__':
 
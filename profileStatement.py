@@ -0,0 +1,131 @@
+"""Report text extraction cost per page to tune statement page and region settings."""
+import argparse
+import json
+import os
+import pdfplumber
+import time
+
+from Utils import extract_page_text, find_account_name, matcher_engine
+
+
+def profile_statement(filepath: str, regions: list = None):
+    """
+    Time text extraction on every page of a statement
+
+    :param filepath: Path of the statement PDF
+    :param regions: Bounding boxes as [x0, top, x1, bottom] to also time cropped extraction
+    :return: List of dictionaries with the page number, extraction time, character count
+             and number of transaction lines for each page, and the same for the cropped
+             regions if given
+    """
+
+    results = []
+    with pdfplumber.open(filepath) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            start = time.perf_counter()
+            text = extract_page_text(page)
+            result = {
+                'page': number,
+                'seconds': time.perf_counter() - start,
+                'characters': len(text),
+                'transactions': count_transaction_lines(text),
+            }
+            page.flush_cache()
+
+            if regions:
+                start = time.perf_counter()
+                text = extract_page_text(page, regions)
+                result.update({
+                    'cropped_seconds': time.perf_counter() - start,
+                    'cropped_characters': len(text),
+                    'cropped_transactions': count_transaction_lines(text),
+                })
+                page.flush_cache()
+
+            results.append(result)
+
+    return results
+
+
+def count_transaction_lines(text: str):
+    """
+    Count lines in the text that match any entry matcher
+
+    :param text: Extracted text
+    :return: Number of matching lines
+    """
+
+    return sum(matcher_engine.combined.search(line) is not None for line in text.split('\n'))
+
+
+def print_profile(filename: str, results: list, pages: list = None):
+    """
+    Print a per-page extraction report
+
+    :param filename: Filename of the statement
+    :param results: Results from profile_statement
+    :param pages: Configured 1-based page numbers, marked with * in the report
+    """
+
+    num_pages = len(results)
+    selected = None
+    if pages is not None:
+        selected = {number if number > 0 else num_pages + number + 1 for number in pages}
+    cropped = any('cropped_seconds' in result for result in results)
+
+    print(filename)
+    header = f'{"page":>6} {"ms":>9} {"chars":>8} {"txns":>5}'
+    if cropped:
+        header += f' {"crop ms":>9} {"crop chars":>10} {"crop txns":>9}'
+    print(header)
+
+    for result in results:
+        mark = '*' if selected is not None and result['page'] in selected else ' '
+        row = (f'{mark}{result["page"]:>5} {result["seconds"] * 1000:>9.1f} '
+               f'{result["characters"]:>8} {result["transactions"]:>5}')
+        if cropped:
+            row += (f' {result["cropped_seconds"] * 1000:>9.1f} '
+                    f'{result["cropped_characters"]:>10} {result["cropped_transactions"]:>9}')
+        print(row)
+
+    total = sum(result['seconds'] for result in results)
+    summary = f'Total {total * 1000:.1f} ms'
+    if selected is not None:
+        selected_total = sum(result['cropped_seconds' if cropped else 'seconds']
+                             for result in results if result['page'] in selected)
+        summary += f', {selected_total * 1000:.1f} ms with the configured settings'
+    print(summary)
+    print()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Time text extraction on each page of statements to tune the '
+                    'Statement Pages and Statement Regions account settings')
+    parser.add_argument('statements', nargs='+', help='Statement PDFs to profile')
+    parser.add_argument('--config', default='config.json',
+                        help='Configuration to read account settings from')
+    parser.add_argument('--regions', type=json.loads,
+                        help='Regions to try instead of the configured ones, '
+                             'eg. "[[0, 150, 612, 700]]"')
+    args = parser.parse_args()
+
+    accounts = {}
+    if os.path.exists(args.config):
+        with open(args.config) as f:
+            accounts = json.load(f)['Accounts']
+
+    for statement in args.statements:
+
+        # Use the settings of the matching account if there is one
+        account_info = {}
+        try:
+            account_info = accounts[find_account_name(accounts, os.path.basename(statement))]
+        except NameError:
+            pass
+
+        regions = args.regions if args.regions is not None \
+            else account_info.get('Statement Regions')
+        print_profile(statement, profile_statement(statement, regions),
+                      account_info.get('Statement Pages'))
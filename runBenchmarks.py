@@ -0,0 +1,258 @@
+"""Benchmark statement extraction, parsing, saving and totals on synthetic data."""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from Ledger import LedgerWriter, ResidentLedger
+from syntheticData import synthetic_ledger, synthetic_statement_lines, \
+    write_synthetic_statements
+from Utils import calculate_totals, find_entries, find_entries_batch, parse_statement, \
+    read_pdf_to_lines, save_entries_to_dataframe
+
+
+def measure(function, repeats: int):
+    """
+    Time a function and track its peak memory
+
+    :param function: Function to call without arguments
+    :param repeats: Number of timed calls
+    :return: Dictionary of the median and minimum seconds per call and the peak traced
+             memory in bytes of a separate call
+    """
+
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    # Trace memory separately since tracing slows the calls down
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'median_seconds': statistics.median(seconds),
+        'min_seconds': min(seconds),
+        'peak_bytes': peak_bytes,
+    }
+
+
+def benchmark_statements(folder: str, statements: int, repeats: int):
+    """
+    Benchmark PDF extraction and statement parsing
+
+    :param folder: Folder to write synthetic statements to
+    :param statements: Number of statements per account
+    :param repeats: Number of timed calls
+    :return: List of results
+    """
+
+    results = []
+    accounts = write_synthetic_statements(folder, statements)
+    filenames = sorted(os.listdir(folder))
+
+    def extract_all():
+        for filename in filenames:
+            read_pdf_to_lines(folder, filename)
+
+    results.append({'name': 'extract', 'params': {'statements': len(filenames)},
+                    **measure(extract_all, repeats)})
+
+    # Parse already extracted lines for each kind of account
+    for account_name, account_info in accounts.items():
+        filename = next(filename for filename in filenames
+                        if filename.startswith(account_info['Statement Prefix']))
+        lines = read_pdf_to_lines(folder, filename)
+        results.append({
+            'name': 'parse_statement',
+            'params': {'account': account_name, 'lines': len(lines)},
+            **measure(lambda: parse_statement(folder, filename, account_name, account_info,
+                                              lines), repeats)})
+
+    # Compare row by row and batched parsing on long statements
+    statement_date = datetime.date(2022, 3, 1)
+    for layout in ('slash', 'month'):
+        for count in (1000, 10000):
+            pages = synthetic_statement_lines(statement_date, count, layout)
+            lines = [line for page in pages for line in page]
+            params = {'layout': layout, 'lines': len(lines)}
+            results.append({'name': 'find_entries', 'params': params,
+                            **measure(lambda: find_entries(lines), repeats)})
+            results.append({'name': 'find_entries_batch', 'params': params,
+                            **measure(lambda: find_entries_batch(lines, False, statement_date),
+                                      repeats)})
+
+    return results
+
+
+def benchmark_startup(folder: str, repeats: int):
+    """
+    Benchmark cold starts of scripts and of both apps, each in a fresh interpreter
+
+    :param folder: Folder to write a config and an empty ledger for the apps to
+    :param repeats: Number of timed starts
+    :return: List of results, without peak memory since each start is another process
+    :raises RuntimeError: If a start fails, with the error output of the process
+    """
+
+    os.makedirs(folder, exist_ok=True)
+    config = {
+        'Paths': {
+            'Statement Root': folder,
+            'Transactions store': os.path.join(folder, 'ledger.sqlite'),
+            'Pending Store': os.path.join(folder, 'pending'),
+            'Job Queue': os.path.join(folder, 'jobs'),
+        },
+        'Accounts': {'Checking': {'Statement Prefix': 'Checking', 'Type': 'Debit'}},
+        'Categories': {'Food': {'Subcategories': ['Groceries', 'Restaurants']}},
+    }
+    with open(os.path.join(folder, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(
+        filter(None, [repo, os.environ.get('PYTHONPATH')]))}
+    commands = {
+        'import_utils': [sys.executable, '-c', 'import Utils'],
+        'start_apps': [sys.executable, os.path.join(repo, 'serveApps.py'), '--measure'],
+    }
+
+    results = []
+    for name, command in commands.items():
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            completed = subprocess.run(command, cwd=folder, env=env, capture_output=True,
+                                       text=True)
+            seconds.append(time.perf_counter() - start)
+            if completed.returncode != 0:
+                raise RuntimeError(f'Cold start {name} failed:\n{completed.stderr}')
+        result = {'name': name, 'params': {}, 'median_seconds': statistics.median(seconds),
+                  'min_seconds': min(seconds), 'peak_bytes': None}
+        if name == 'start_apps':
+            result['report'] = json.loads(completed.stdout)
+        results.append(result)
+
+    return results
+
+
+def benchmark_ledger(folder: str, rows: int, extension: str, repeats: int):
+    """
+    Benchmark loading, saving and totals on a synthetic ledger
+
+    :param folder: Folder to write the ledger to
+    :param rows: Number of transactions in the ledger
+    :param extension: File extension picking the storage backend
+    :param repeats: Number of timed calls
+    :return: List of results
+    """
+
+    results = []
+    params = {'rows': rows, 'format': extension}
+
+    transactions_df = synthetic_ledger(rows)
+    path = os.path.join(folder, f'ledger-{rows}{extension}')
+    writer = LedgerWriter(path, compact_segments=10 ** 9)
+    writer.storage.write(transactions_df, path)
+    accounts = sorted(transactions_df['account'].unique())
+    new_rows = synthetic_ledger(50, seed=1).to_dict('records')
+    del transactions_df
+
+    results.append({'name': 'load', 'params': params,
+                    **measure(lambda: ResidentLedger(writer), repeats)})
+
+    ledger = ResidentLedger(writer)
+    results.append({'name': 'save', 'params': {**params, 'new_rows': len(new_rows)},
+                    **measure(lambda: save_entries_to_dataframe(ledger, list(new_rows)),
+                              repeats)})
+    results.append({'name': 'totals_build', 'params': params,
+                    **measure(lambda: ledger.balances.build(ledger.transactions), repeats)})
+    results.append({'name': 'totals', 'params': params,
+                    **measure(lambda: calculate_totals(ledger.account_balances, accounts),
+                              repeats)})
+
+    return results
+
+
+def compare(results: list, previous: list):
+    """
+    Print how each result changed since a previous run
+
+    :param results: Results of this run
+    :param previous: Results of the previous run
+    """
+
+    previous_by_key = {(result['name'], json.dumps(result['params'], sort_keys=True)): result
+                       for result in previous}
+    for result in results:
+        key = (result['name'], json.dumps(result['params'], sort_keys=True))
+        if key not in previous_by_key:
+            continue
+        ratio = result['median_seconds'] / previous_by_key[key]['median_seconds']
+        flag = '  SLOWER' if ratio > 1.1 else ''
+        print(f'{result["name"]:>20} {key[1]}: {ratio:.2f}x of previous{flag}')
+
+
+def print_results(results: list):
+    """
+    Print benchmark results
+
+    :param results: List of results
+    """
+
+    for result in results:
+        peak = '' if result['peak_bytes'] is None else \
+            f', {result["peak_bytes"] / 1024 / 1024:.1f} MiB peak'
+        print(f'{result["name"]:>20} {json.dumps(result["params"])}: '
+              f'{result["median_seconds"] * 1000:.2f} ms median{peak}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run benchmarks on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Ledger sizes in rows')
+    parser.add_argument('--formats', nargs='+', default=['.csv', '.parquet'],
+                        help='Ledger file extensions to benchmark')
+    parser.add_argument('--statements', type=int, default=12,
+                        help='Synthetic statements per account')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed calls per benchmark')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='File to append the results to')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        results = benchmark_statements(os.path.join(folder, 'statements'), args.statements,
+                                       args.repeats)
+        results += benchmark_startup(os.path.join(folder, 'startup'), args.repeats)
+        for extension in args.formats:
+            for rows in args.sizes:
+                results += benchmark_ledger(folder, rows, extension, args.repeats)
+    print_results(results)
+
+    # Keep every run so later runs can be compared for regressions
+    runs = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            runs = json.load(f)
+        if runs:
+            print('\nCompared with the previous run:')
+            compare(results, runs[-1]['results'])
+    runs.append({
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    })
+    with open(args.output, 'w') as f:
+        json.dump(runs, f, indent=2)
@@ -0,0 +1,85 @@
+"""Serve the bookkeeping and statement import UIs from a single process."""
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.serving import run_simple
+import argparse
+import importlib
+import json
+import sys
+import time
+
+from Config import load_config, mount_prefixes
+
+"""
+Apps to serve by module name, with the URL prefix each is mounted at
+"""
+apps = {'interface': '/', 'addData': '/import/'}
+
+
+def load_apps():
+    """
+    Import every app, timing each step of the start
+
+    Both apps share the config.json of the working directory, the Utils and Ledger modules
+    and the imported libraries, so only the first app pays for loading them
+
+    :return: Tuple of a dictionary of module names to imported app modules and a
+             dictionary of startup step names to seconds
+    """
+
+    timings = {}
+    start = time.perf_counter()
+    load_config()
+    timings['config'] = time.perf_counter() - start
+
+    modules = {}
+    for name, prefix in apps.items():
+        mount_prefixes[name] = prefix
+        step_start = time.perf_counter()
+        modules[name] = importlib.import_module(name)
+        timings[name] = time.perf_counter() - step_start
+    timings['total'] = time.perf_counter() - start
+
+    return modules, timings
+
+
+def startup_report(timings: dict):
+    """
+    Summarize how long the apps took to start
+
+    :param timings: Dictionary of startup step names to seconds
+    :return: Dictionary of the seconds spent in each step and whether the PDF stack was
+             loaded, which should only happen once a statement is read
+    """
+
+    return {
+        'seconds': {step: round(seconds, 4) for step, seconds in timings.items()},
+        'pdf_stack_loaded': 'pdfplumber' in sys.modules,
+        'modules_loaded': len(sys.modules),
+    }
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serve both UIs from one process')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8050, help='Port to listen on')
+    parser.add_argument('--measure', action='store_true',
+                        help='Print the startup report as JSON and exit without serving')
+    args = parser.parse_args()
+
+    modules, timings = load_apps()
+    report = startup_report(timings)
+    if args.measure:
+        print(json.dumps(report))
+        raise SystemExit(0)
+
+    for step, seconds in report['seconds'].items():
+        print(f'{step:>10}: {seconds * 1000:.1f} ms')
+
+    # The first app is served at the root and reports the startup times
+    root_app = modules[next(iter(apps))].app
+    root_app.server.add_url_rule('/startup', 'startup', lambda: report)
+    application = DispatcherMiddleware(root_app.server, {
+        prefix.rstrip('/'): modules[name].app.server
+        for name, prefix in apps.items() if prefix != '/'})
+    run_simple(args.host, args.port, application, threaded=True)
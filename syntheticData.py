@@ -0,0 +1,214 @@
+"""Synthetic statements and ledgers for benchmarks."""
+import datetime
+import os
+import random
+import numpy as np
+import pandas as pd
+
+"""
+Stores used for synthetic transactions
+"""
+synthetic_stores = [
+    'GROCERY OUTLET #{}', 'CORNER COFFEE', 'CITY GAS {}', 'ONLINE MARKETPLACE',
+    'PHARMACY #{}', 'HARDWARE DEPOT', 'STREAMING SERVICE', 'PIZZA PLACE {}',
+    'BOOKSTORE', 'TRANSIT AUTHORITY',
+]
+
+"""
+Line marking the end of transactions in synthetic statements
+"""
+synthetic_end_marker = 'Important Disclosures'
+
+"""
+Line separating purchases from payments in synthetic statements
+"""
+synthetic_negative_separator = 'Payments and Other Credits'
+
+
+def synthetic_store(rng: random.Random):
+    """
+    Pick a store name, with a store number for some stores
+
+    :param rng: Random number generator
+    :return: Store name
+    """
+
+    return rng.choice(synthetic_stores).format(rng.randint(100, 999))
+
+
+def synthetic_transaction_lines(statement_date: datetime.date, count: int, layout: str,
+                                rng: random.Random):
+    """
+    Create transaction lines in one of the supported statement layouts
+
+    :param statement_date: Date of the statement, transactions fall in the month before
+    :param count: Number of transaction lines
+    :param layout: Either 'slash' for MM/DD dates or 'month' for Mon DD dates
+    :param rng: Random number generator
+    :return: List of lines
+    """
+
+    lines = []
+    for _ in range(count):
+        date = statement_date - datetime.timedelta(days=rng.randint(1, 30))
+        amount = f'{rng.uniform(1, 500):,.2f}'
+        if layout == 'slash':
+            lines.append(f'{date:%m/%d} {synthetic_store(rng)} {amount}')
+        else:
+            posted = date + datetime.timedelta(days=1)
+            lines.append(f'{posted:%b %d} {date:%b %d} {synthetic_store(rng)} ${amount}')
+
+    return lines
+
+
+def synthetic_statement_lines(statement_date: datetime.date, count: int, layout: str,
+                              negative_separator: bool = False, seed: int = 0):
+    """
+    Create the lines of a synthetic statement
+
+    :param statement_date: Date of the statement
+    :param count: Number of transaction lines
+    :param layout: Either 'slash' for MM/DD dates or 'month' for Mon DD dates
+    :param negative_separator: Whether to add a payments section after a separator line
+    :param seed: Seed for the random number generator
+    :return: List of pages, each a list of lines
+    """
+
+    rng = random.Random(seed)
+    lines = [
+        'Synthetic Bank',
+        f'Statement Closing Date {statement_date:%Y-%m-%d}',
+        'Account Summary',
+        'Transactions',
+    ]
+    lines += synthetic_transaction_lines(statement_date, count, layout, rng)
+    if negative_separator:
+        lines.append(synthetic_negative_separator)
+        lines += synthetic_transaction_lines(statement_date, max(1, count // 10), layout, rng)
+
+    # Split into pages and add a disclosures page at the back
+    pages = [lines[i:i + 60] for i in range(0, len(lines), 60)]
+    pages.append([synthetic_end_marker] + ['Terms and conditions apply.'] * 40)
+
+    return pages
+
+
+def escape_pdf_text(text: str):
+    """
+    Escape text for a PDF string literal
+
+    :param text: Text to escape
+    :return: Escaped text
+    """
+
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(filepath: str, pages: list):
+    """
+    Write a minimal text-only PDF
+
+    :param filepath: Path of the PDF to write
+    :param pages: List of pages, each a list of lines
+    """
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # Page tree, filled in once the page objects are numbered
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>',
+    ]
+    page_ids = []
+    for lines in pages:
+        text = ' T* '.join(f'({escape_pdf_text(line)}) Tj' for line in lines)
+        content = f'BT /F1 9 Tf 11 TL 36 756 Td {text} ET'.encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+                       % len(objects))
+        page_ids.append(len(objects))
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+    objects[1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode()
+
+    # Write the objects followed by the cross reference table of their offsets
+    data = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for object_id, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n%s\nendobj\n' % (object_id, body)
+    xref_offset = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        data += b'%010d 00000 n \n' % offset
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' \
+        % (len(objects) + 1, xref_offset)
+
+    with open(filepath, 'wb') as f:
+        f.write(data)
+
+
+def write_synthetic_statements(folder: str, count: int, transactions: int = 50,
+                               statement_date: datetime.date = datetime.date(2022, 3, 1)):
+    """
+    Write synthetic statements covering both layouts, credit accounts and accounts with a
+    Negative Separator
+
+    :param folder: Folder to write the statements to
+    :param count: Number of statements per account
+    :param transactions: Number of transaction lines per statement
+    :param statement_date: Date of the first statement, later ones are a month apart
+    :return: Dictionary of account names to account configuration for the statements
+    """
+
+    accounts = {
+        'Slash Checking': {'Statement Prefix': 'SlashChecking', 'Type': 'Debit',
+                           'layout': 'slash', 'separator': False},
+        'Month Credit': {'Statement Prefix': 'MonthCredit', 'Type': 'Credit',
+                         'layout': 'month', 'separator': False},
+        'Separated Credit': {'Statement Prefix': 'SeparatedCredit', 'Type': 'Credit',
+                             'layout': 'slash', 'separator': True,
+                             'Negative Separator': synthetic_negative_separator},
+    }
+
+    os.makedirs(folder, exist_ok=True)
+    for seed, (account_name, account_info) in enumerate(accounts.items()):
+        for month in range(count):
+            date = statement_date + datetime.timedelta(days=31 * month)
+            pages = synthetic_statement_lines(date, transactions, account_info['layout'],
+                                              account_info['separator'], seed * 1000 + month)
+            write_pdf(os.path.join(folder, f'{account_info["Statement Prefix"]}_{date:%Y-%m-%d}.pdf'),
+                      pages)
+
+    for account_info in accounts.values():
+        account_info['End Marker'] = synthetic_end_marker
+        del account_info['layout'], account_info['separator']
+
+    return accounts
+
+
+def synthetic_ledger(rows: int, seed: int = 0):
+    """
+    Create a synthetic ledger sorted by date and account
+
+    :param rows: Number of transactions
+    :param seed: Seed for the random number generator
+    :return: DataFrame containing transactions
+    """
+
+    rng = np.random.default_rng(seed)
+    stores = np.array([store.format(number) for store in synthetic_stores
+                       for number in (101, 202, 303)])
+    categories = np.array(['Food', 'Transport', 'Shopping', 'Bills', 'Income'])
+
+    transactions_df = pd.DataFrame({
+        'date': pd.Timestamp('2015-01-01') + pd.to_timedelta(
+            rng.integers(0, 365 * 7, rows), unit='D'),
+        'store': rng.choice(stores, rows),
+        'description': '',
+        'account': rng.choice(np.array(['Checking', 'Savings', 'Credit A', 'Credit B']), rows),
+        'amount': np.round(rng.normal(-40, 120, rows), 2),
+        'category': rng.choice(categories, rows),
+        'subcategory': rng.choice(np.array(['Misc', 'Regular', 'One-off']), rows),
+        'notes': '',
+    })
+
+    return transactions_df.sort_values(['date', 'account'], kind='mergesort', ignore_index=True)
@@ -0,0 +1,42 @@
+"""Tests for incremental rescans of the statement catalog."""
+import datetime
+import os
+
+import Catalog
+from Catalog import StatementCatalog
+
+accounts = {'Checking': {'Statement Prefix': 'Checking', 'Type': 'Debit'},
+            'Visa': {'Statement Prefix': 'Visa', 'Type': 'Credit'}}
+
+
+def test_rescan_only_reads_changed_directories(tmp_path, monkeypatch):
+    root = tmp_path / 'statements'
+    for folder, filename in (('Checking', 'Checking_2022-01-31.pdf'),
+                             ('Checking/2022', 'Checking_2022-02-28.pdf'),
+                             ('Visa', 'Visa_2022-01-15.pdf')):
+        os.makedirs(root / folder, exist_ok=True)
+        (root / folder / filename).write_bytes(filename.encode())
+    catalog = StatementCatalog(str(tmp_path / 'catalog.sqlite'), str(root), accounts)
+    assert catalog.rescan() == 3
+
+    hashed = []
+    hash_file = Catalog.hash_file
+    monkeypatch.setattr(Catalog, 'hash_file', lambda path: hashed.append(path) or
+                        hash_file(path))
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: listed.append(path) or scandir(path))
+
+    # Nothing changed, so no directory is listed and no file is hashed
+    assert catalog.rescan() == 0
+    assert listed == [] and hashed == []
+
+    # A new statement in a subfolder is found by listing only that subfolder
+    (root / 'Checking' / '2022' / 'Checking_2022-03-31.pdf').write_bytes(b'march')
+    assert catalog.rescan() == 1
+    assert listed == [os.path.join(str(root), 'Checking', '2022')]
+    assert len(hashed) == 1
+
+    assert catalog.find_statements(datetime.date(2022, 2, 1)) == [
+        (os.path.join('Checking', '2022', 'Checking_2022-02-28.pdf'), 'Checking'),
+        (os.path.join('Checking', '2022', 'Checking_2022-03-31.pdf'), 'Checking')]
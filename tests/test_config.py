@@ -0,0 +1,25 @@
+"""Tests for validating config.json."""
+from Config import validate_config
+
+accounts = {'Checking': {'Statement Prefix': 'Checking', 'Type': 'Debit'}}
+categories = {'Food': {'Subcategories': ['Groceries']}}
+
+
+def test_valid_config_has_no_problems():
+    config = {'Paths': {'Statement Root': 'statements', 'Transactions csv': 'ledger.csv',
+                        'Statement Cache': 'statement_cache', 'Job Queue': 'jobs',
+                        'Pending Store': 'pending'},
+              'Accounts': accounts, 'Categories': categories}
+
+    assert validate_config(config) == []
+
+
+def test_paths_are_checked():
+    config = {'Paths': {'Transactions store': 'ledger.sqlite', 'Statement Cache': 256,
+                        'Job Queue': None, 'Pending Store': ''},
+              'Accounts': accounts, 'Categories': categories}
+
+    assert validate_config(config) == ['Paths needs a Statement Root',
+                                       'Statement Cache in Paths must be a path',
+                                       'Pending Store in Paths must be a path',
+                                       'Job Queue in Paths must be a path']
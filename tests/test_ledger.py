@@ -0,0 +1,305 @@
+"""Tests for crash recovery, concurrent compaction and in-memory updates of the ledger."""
+import json
+import os
+import subprocess
+import sys
+import threading
+import numpy as np
+import pandas as pd
+
+from Ledger import LedgerWriter, MerchantIndex, ResidentLedger, TransactionIndex, \
+    convert_ledger
+from Records import TransactionBatch
+
+
+def make_rows(count: int, start: int = 0):
+    return pd.DataFrame({
+        'date': pd.date_range('2022-01-01', periods=count, freq='D') +
+        pd.to_timedelta(start, unit='D'),
+        'store': [f'Store {number}' for number in range(start, start + count)],
+        'account': 'Checking',
+        'amount': [-1.0 - number for number in range(start, start + count)],
+        'category': '',
+        'subcategory': '',
+    })
+
+
+def make_ledger(tmp_path, rows: int = 10, compact_segments: int = 10 ** 9):
+    path = str(tmp_path / 'ledger.csv')
+    make_rows(rows).to_csv(path, index=False)
+    return LedgerWriter(path, compact_segments)
+
+
+def test_journaled_rows_are_written_on_open(tmp_path):
+    writer = make_ledger(tmp_path)
+    rows = make_rows(3, start=100).to_json(orient='records', date_format='iso')
+    with open(os.path.join(writer.segment_folder, 'journal.jsonl'), 'w') as f:
+        f.write(f'{{"segment": "segment-00000000000000000001.csv", "rows": {rows}}}\n')
+        f.write('{"segment": "segment-0000')  # Torn record of an unacknowledged write
+
+    assert len(LedgerWriter(writer.path).read()) == 13
+
+
+def test_rows_journaled_by_a_crashed_process_survive_later_writes(tmp_path):
+    writer = make_ledger(tmp_path)
+
+    # Another process journals its rows and crashes before writing the segment
+    rows = make_rows(3, start=100).to_json(orient='records', date_format='iso')
+    with open(os.path.join(writer.segment_folder, 'journal.jsonl'), 'w') as f:
+        f.write(f'{{"segment": "segment-00000000000000000001.csv", "rows": {rows}}}\n')
+    writer.append(make_rows(2, start=200))
+
+    assert len(writer.read()) == 15
+    assert len(LedgerWriter(writer.path).read()) == 15
+
+
+def test_unfinished_swap_keeps_segments(tmp_path):
+    writer = make_ledger(tmp_path)
+    writer.append(make_rows(3, start=100))
+
+    # Crash after journaling a swap whose merged file was already removed
+    with open(os.path.join(writer.segment_folder, 'compaction.json'), 'w') as f:
+        json.dump({'name': '1-1', 'segments': writer.segments(),
+                   'previous': writer._stat(writer.path), 'compacted': [1, 1]}, f)
+
+    assert len(LedgerWriter(writer.path).read()) == 13
+
+
+def test_finished_swap_drops_segments(tmp_path):
+    writer = make_ledger(tmp_path)
+    writer.append(make_rows(3, start=100))
+    segments = writer.segments()
+    previous_signature = writer._stat(writer.path)
+    writer.storage.write(writer.read(), writer.path)
+
+    # Crash after the swap but before the segments were removed
+    with open(os.path.join(writer.segment_folder, 'compaction.json'), 'w') as f:
+        json.dump({'name': '1-1', 'segments': segments, 'previous': previous_signature,
+                   'compacted': writer._stat(writer.path)}, f)
+
+    assert len(LedgerWriter(writer.path).read()) == 13
+
+
+def test_open_keeps_merges_of_running_processes(tmp_path):
+    writer = make_ledger(tmp_path)
+    running = f'{writer.path}.compacted-{os.getpid()}-1'
+    finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True, check=True)
+    dead = f'{writer.path}.compacted-{int(finished.stdout)}-1'
+    for path in (running, dead):
+        open(path, 'w').close()
+
+    LedgerWriter(writer.path)
+
+    assert os.path.exists(running)
+    assert not os.path.exists(dead)
+
+
+def test_open_during_compaction_keeps_rows(tmp_path):
+    writer = make_ledger(tmp_path, rows=1000)
+    for start in range(0, 30, 3):
+        writer.append(make_rows(3, start=2000 + start))
+
+    # Another process opens the ledger between the merge and the swap
+    exclusive = writer.file_lock.exclusive
+
+    def open_then_lock():
+        LedgerWriter(writer.path)
+        return exclusive()
+
+    writer.file_lock.exclusive = open_then_lock
+    writer.compact()
+
+    assert writer.segments() == []
+    assert len(LedgerWriter(writer.path).read()) == 1030
+
+
+def test_concurrent_writes_and_compactions_keep_rows(tmp_path):
+    writer = make_ledger(tmp_path, compact_segments=4)
+    ledger = ResidentLedger(writer)
+
+    def write(thread: int):
+        for number in range(15):
+            ledger.add(make_rows(1, start=1000 * (thread + 1) + number))
+
+    threads = [threading.Thread(target=write, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.compact()
+
+    assert len(ledger.transactions) == 70
+    assert len(LedgerWriter(writer.path).read()) == 70
+
+
+def test_added_rows_are_merged_like_a_reload(tmp_path):
+    writer = make_ledger(tmp_path, rows=40)
+    ledger = ResidentLedger(writer)
+    random = np.random.default_rng(0)
+    for batch in range(5):
+        entries_df = make_rows(8, start=1000 * batch)
+        entries_df['date'] = pd.Timestamp('2022-01-01') + \
+            pd.to_timedelta(random.integers(-5, 50, len(entries_df)), unit='D')
+        entries_df['account'] = random.choice(['Checking', 'Savings', 'Card'],
+                                              len(entries_df))
+        entries_df['category'] = random.choice(['Food', 'Rent', ''], len(entries_df))
+        ledger.add(entries_df)
+
+    reloaded = ResidentLedger(LedgerWriter(writer.path))
+    columns = ['date', 'store', 'account', 'amount']
+    pd.testing.assert_frame_equal(ledger.transactions[columns].astype({'account': str}),
+                                  reloaded.transactions[columns].astype({'account': str}))
+    assert np.array_equal(ledger.ledger_index.dates, reloaded.ledger_index.dates)
+    for column, index in reloaded.ledger_index.positions.items():
+        assert index.keys() == ledger.ledger_index.positions[column].keys()
+        for value, positions in index.items():
+            assert np.array_equal(ledger.ledger_index.positions[column][value], positions)
+    assert ledger.reloads == 1
+
+
+def test_own_compactions_do_not_reload(tmp_path):
+    writer = make_ledger(tmp_path, compact_segments=3)
+    ledger = ResidentLedger(writer)
+    writing = True
+
+    def read():
+        while writing:
+            ledger.account_balances
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for number in range(30):
+        ledger.add(make_rows(1, start=1000 + number))
+        if writer._compaction is not None:
+            writer._compaction.join()
+    writing = False
+    reader.join()
+
+    assert len(ledger.transactions) == 40
+    assert ledger.reloads == 1
+
+
+def test_merchant_updates_match_a_rebuild():
+    ledger_df = make_rows(6)
+    ledger_df['store'] = ['Grocer 1', 'Grocer 2', 'Cafe 9', 'Cafe 9', 'Grocer 3', 'Gas']
+    ledger_df['category'] = ['Food', 'Food', 'Food', 'Fun', 'Home', '']
+    entries_df = make_rows(3, start=10)
+    entries_df['store'] = ['Cafe 9', 'Grocer 4', 'Gas']
+    entries_df['category'] = ['Fun', 'Home', 'Car']
+
+    merchants = MerchantIndex(ledger_df)
+    assert merchants.lookup(pd.Series(['CAFE #9']))['category'].tolist() == ['Food']
+    merchants.update(entries_df)
+    rebuilt = MerchantIndex(pd.concat([ledger_df, entries_df], ignore_index=True))
+
+    assert merchants.best == rebuilt.best
+    assert merchants.counts == rebuilt.counts
+    stores = pd.Series(['CAFE #9', 'Grocer 7', 'Gas', 'Unknown'])
+    assert merchants.lookup(stores)['category'].tolist() == ['Fun', 'Food', 'Car', None]
+
+
+def test_unsorted_ledger_file_is_sorted_on_load(tmp_path):
+    path = str(tmp_path / 'ledger.csv')
+    rows_df = make_rows(3)
+    rows_df['date'] = pd.to_datetime(['2022-03-01', '2022-01-01', '2022-02-01'])
+    rows_df.to_csv(path, index=False)
+    ledger = ResidentLedger(LedgerWriter(path))
+
+    january = ledger.query('2022-01-01', '2022-01-31')
+    assert january['date'].tolist() == [pd.Timestamp('2022-01-01')]
+    ledger.add(make_rows(1, start=45))
+    assert ledger.transactions['date'].is_monotonic_increasing
+    assert ledger.query('2022-02-01', '2022-02-28')['store'].tolist() == \
+        ['Store 2', 'Store 45']
+
+    unsorted = str(tmp_path / 'unsorted.csv')
+    converted = str(tmp_path / 'converted.csv')
+    rows_df.to_csv(unsorted, index=False)
+    convert_ledger(unsorted, converted)
+    assert pd.read_csv(converted)['date'].tolist() == \
+        ['2022-01-01', '2022-02-01', '2022-03-01']
+
+
+def test_duplicate_index_is_built_on_first_import(tmp_path):
+    ledger = ResidentLedger(make_ledger(tmp_path))
+    assert ledger.transaction_index is None
+
+    batch = TransactionBatch(pd.concat([make_rows(3, start=8), make_rows(1, start=9)],
+                                       ignore_index=True))
+    assert [record['store'] for record in ledger.filter_new(batch).to_records()] == \
+        ['Store 10', 'Store 9']
+    ledger.add(make_rows(2, start=10))
+    rebuilt = TransactionIndex(ledger.transactions)
+    assert np.array_equal(ledger.transaction_index.keys, rebuilt.keys)
+    assert np.array_equal(ledger.transaction_index.key_counts, rebuilt.key_counts)
+    assert [record['store'] for record in ledger.filter_new(batch).to_records()] == \
+        ['Store 9']
+
+
+def test_merchant_index_is_built_on_first_use(tmp_path):
+    ledger = ResidentLedger(make_ledger(tmp_path))
+    ledger.add(make_rows(1, start=50).assign(store='Cafe 9', category='Food'))
+    assert ledger.merchants is None
+
+    assert ledger.merchant_categories.lookup(pd.Series(['CAFE #12']))['category'] \
+        .tolist() == ['Food']
+    ledger.add(make_rows(2, start=60).assign(store='Cafe 9', category='Fun'))
+    assert ledger.merchant_categories.lookup(pd.Series(['CAFE #12']))['category'] \
+        .tolist() == ['Fun']
+
+
+def test_queries_include_rows_buffered_in_the_tail(tmp_path):
+    writer = make_ledger(tmp_path, rows=40)
+    ledger = ResidentLedger(writer)
+    frame = ledger.transactions
+    random = np.random.default_rng(1)
+    for batch in range(3):
+        entries_df = make_rows(5, start=1000 * batch)
+        entries_df['date'] = pd.Timestamp('2022-01-01') + \
+            pd.to_timedelta(random.integers(0, 40, len(entries_df)), unit='D')
+        entries_df['account'] = random.choice(['Checking', 'Card'], len(entries_df))
+        entries_df['category'] = random.choice(['Food', ''], len(entries_df))
+        ledger.add(entries_df)
+
+    # Small writes leave the sorted frame alone until it is read
+    assert ledger._transactions_df is frame
+    assert ledger.stats()['rows'] == 55
+    reloaded = ResidentLedger(LedgerWriter(writer.path))
+    columns = ['date', 'store', 'account']
+    for start, end, accounts, categories in [(None, None, None, None),
+                                             ('2022-01-10', '2022-01-20', None, None),
+                                             (None, '2022-01-15', ['Card'], None),
+                                             ('2022-01-05', None, ['Checking'], ['Food'])]:
+        expected = reloaded.query(start, end, accounts, categories, columns)
+        found = ledger.query(start, end, accounts, categories, columns)
+        assert found.astype({'account': str}).to_dict('records') == \
+            expected.astype({'account': str}).to_dict('records')
+
+
+def test_rollups_match_a_groupby_after_adding_rows(tmp_path):
+    ledger = ResidentLedger(make_ledger(tmp_path, rows=40))
+    rows = make_rows(50, start=30).assign(
+        account=['Checking', 'Visa'] * 25,
+        category=['Food', '', 'Travel', 'Food', 'Home'] * 10,
+        subcategory=['Groceries', '', 'Flights', 'Restaurants', 'Rent'] * 10)
+    ledger.add(rows.iloc[:20])
+    ledger.add(rows.iloc[20:])
+
+    # The cube keeps uncategorized transactions under empty names
+    transactions_df = ledger.transactions.fillna({'category': '', 'subcategory': ''})
+    dates = pd.to_datetime(transactions_df['date'])
+    transactions_df = transactions_df.assign(month=dates.dt.year * 100 + dates.dt.month)
+    for by in ('account', 'category', 'subcategory'):
+        for accounts, start_month in ((None, None), (['Visa'], 202203)):
+            expected = transactions_df
+            if accounts is not None:
+                expected = expected[expected['account'].isin(accounts) &
+                                    (expected['month'] >= start_month)]
+            expected = expected.groupby(['month', by], sort=True) \
+                .agg(count=('amount', 'size'), amount=('amount', 'sum')).reset_index()
+
+            totals = ledger.category_rollups.query(by, accounts, start_month=start_month)
+            assert totals[['month', by, 'count']].values.tolist() == \
+                expected[['month', by, 'count']].values.tolist()
+            assert np.allclose(totals['amount'], expected['amount'])
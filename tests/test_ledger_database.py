@@ -0,0 +1,63 @@
+"""Tests that the SQLite ledger answers like the resident ledger."""
+import pandas as pd
+
+from Ledger import LedgerWriter, ResidentLedger
+from LedgerDatabase import SqliteLedger
+from Records import TransactionBatch
+
+columns = ['date', 'store', 'account', 'amount', 'category', 'subcategory']
+
+
+def make_rows(count: int):
+    return pd.DataFrame({
+        'date': pd.date_range('2022-01-01', periods=count, freq='2D').repeat(2)[:count],
+        'store': [f'Store {number % 7}' for number in range(count)],
+        'account': ['Checking', 'Visa', 'Savings'] * (count // 3) + ['Checking'] * (count % 3),
+        'amount': [round(-1.25 * number + 100, 2) for number in range(count)],
+        'category': ['Food', '', 'Home', 'Travel'] * (count // 4) + [''] * (count % 4),
+        'subcategory': ['Groceries', '', 'Rent', 'Flights'] * (count // 4) + [''] * (count % 4),
+    })
+
+
+def comparable(transactions_df: pd.DataFrame):
+    transactions_df = transactions_df[columns].astype(object) \
+        .fillna({'category': '', 'subcategory': ''})
+    return transactions_df.assign(date=pd.to_datetime(transactions_df['date']),
+                                  amount=transactions_df['amount'].astype(float)) \
+        .astype({'store': str, 'account': str, 'category': str, 'subcategory': str}) \
+        .reset_index(drop=True)
+
+
+def test_sqlite_ledger_matches_resident_ledger(tmp_path):
+    rows = make_rows(60)
+    path = str(tmp_path / 'ledger.csv')
+    rows.iloc[:0].to_csv(path, index=False)
+    resident = ResidentLedger(LedgerWriter(path))
+    database = SqliteLedger(str(tmp_path / 'ledger.sqlite'))
+    for ledger in (resident, database):
+        ledger.add(rows.iloc[:25])
+        ledger.add(rows.iloc[25:])
+
+    assert database.account_balances.cents == resident.account_balances.cents
+    assert database.stats()['rows'] == resident.stats()['rows'] == 60
+
+    for query in ({}, {'start': '2022-01-15', 'end': '2022-02-10'},
+                  {'accounts': ['Visa', 'Savings']}, {'categories': ['', 'Food']},
+                  {'start': '2022-02-01', 'accounts': ['Checking'], 'categories': ['Home']}):
+        expected = comparable(resident.query(**query))
+        found = comparable(database.query(**query))
+        assert len(found) == len(expected) > 0
+        pd.testing.assert_frame_equal(found, expected, check_dtype=False)
+
+    # Repeats beyond the copies already in the ledger are kept, also across batches
+    entries_df = pd.concat([rows.iloc[[0, 1, 1]], make_rows(2).assign(store='New store')])
+    entries_df['date'] = entries_df['date'].dt.date
+    entries_df = entries_df.reset_index(drop=True)
+    new_entries = {}
+    for name, ledger in (('resident', resident), ('database', database)):
+        seen = {}
+        new_entries[name] = [ledger.filter_new(TransactionBatch(entries_df), seen).to_frame()
+                             for _ in range(2)]
+    for resident_df, database_df in zip(new_entries['resident'], new_entries['database']):
+        pd.testing.assert_frame_equal(comparable(database_df), comparable(resident_df))
+    assert [len(new_df) for new_df in new_entries['database']] == [3, 5]
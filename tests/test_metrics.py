@@ -0,0 +1,19 @@
+"""Tests for the metrics routes served by the apps."""
+import flask
+
+from Ledger import LedgerWriter, ResidentLedger
+from Metrics import metrics, register_metrics_routes
+
+
+def test_metrics_routes(tmp_path):
+    (tmp_path / 'ledger.csv').write_text('date,store,account,amount,category,subcategory\n'
+                                         '2022-03-01,CAFE,Checking,-3.5,Food,Coffee\n')
+    ledger = ResidentLedger(LedgerWriter(str(tmp_path / 'ledger.csv')))
+    collected = []
+    server = flask.Flask(__name__)
+    register_metrics_routes(server, ledger, lambda: collected.append(True))
+    client = server.test_client()
+
+    assert client.get('/metrics').get_json() == metrics.snapshot()
+    assert collected == [True]
+    assert client.get('/ledger-stats').get_json()['rows'] == 1
@@ -0,0 +1,172 @@
+"""Tests for parsing statements into transaction batches."""
+import datetime
+import os
+
+import pytest
+
+from Ledger import MerchantIndex, TransactionIndex
+from Metrics import metrics
+from Records import TransactionBatch
+from StatementCache import StatementCache, hash_matchers
+from syntheticData import write_pdf
+import Utils
+from Utils import categorize_entries, discover_statements, entry_matchers, find_entries, \
+    find_entries_batch, iter_pdf_pages, open_ledger, open_statement_stores, \
+    parse_statement, parse_statements, save_imported_entries
+
+accounts = {'Checking': {'Statement Prefix': 'Checking', 'Type': 'Debit'}}
+
+"""
+Statement whose summary page has a line that looks like a transaction of another layout
+"""
+summary_then_transactions = [
+    ['Account Summary', 'Payment Due Date Apr 15 Minimum Payment $35.00'],
+    ['03/02 GROCER 12 45.10', 'Some footer', '03/05 CAFE 3.50'],
+]
+
+
+def parsed_fields(entries):
+    return [(entry['date'].month, entry['date'].day, entry['store'], entry['amount'])
+            for entry in entries]
+
+
+def test_nothing_to_parse_gives_empty_batch(tmp_path):
+    for workers in (1, 2):
+        data, errors = parse_statements(str(tmp_path), [], accounts, workers)
+        assert len(data) == 0
+        assert errors == {}
+        assert data.to_records() == []
+
+
+def test_unknown_statements_give_empty_batch(tmp_path):
+    data, errors = parse_statements(str(tmp_path), ['Savings_2022-03-01.pdf'], accounts, 2)
+
+    assert len(data) == 0
+    assert list(errors) == ['Savings_2022-03-01.pdf']
+
+
+def test_batches_filter_and_categorize():
+    lines = ['03/01 GROCER 12 $12.50', '03/02 GROCER 12 $12.50', '03/03 CAFE $4.00']
+    entries = find_entries_batch(lines, statement_date=datetime.date(2022, 3, 31))
+    entries.stamp('account', 'Checking')
+    ledger_df = entries.take([0]).to_frame().assign(category='Food', subcategory='Groceries')
+
+    seen = {}
+    new_entries = TransactionIndex(ledger_df).filter_new(entries, seen)
+    categorize_entries(MerchantIndex(ledger_df), new_entries)
+
+    records = new_entries.sorted().to_records()
+    assert [record['store'] for record in records] == ['GROCER 12', 'CAFE']
+    assert [record['category'] for record in records] == ['Food', None]
+    assert records[0]['date'] == datetime.date(2022, 3, 2)
+    assert len(TransactionBatch().sorted()) == 0
+
+
+def test_pages_and_regions_are_selected(tmp_path):
+    write_pdf(str(tmp_path / 'statement.pdf'),
+              [['1 first', '1 second'], ['2 first'], ['3 first', '3 second', '3 third']])
+
+    # Negative pages count from the end, and pages past either end are left out
+    assert list(iter_pdf_pages(str(tmp_path), 'statement.pdf', pages=[-1, 1, 9, -9])) == \
+        [['1 first', '1 second'], ['3 first', '3 second', '3 third']]
+
+    # Regions are read in order and clamped to the page
+    assert list(iter_pdf_pages(str(tmp_path), 'statement.pdf', pages=[3],
+                               regions=[[-100, 49, 1000, 1000], [0, -100, 1000, 38.5]])) == \
+        [['3 third', '3 first']]
+
+
+def test_open_ledger_without_csv_path(tmp_path):
+    ledger = open_ledger({'Paths': {'Transactions store': str(tmp_path / 'ledger.sqlite')}})
+
+    assert ledger.stats()['rows'] == 0
+
+
+def test_open_ledger_shares_one_ledger_per_path(tmp_path):
+    for name in ('ledger.csv', 'other.csv'):
+        (tmp_path / name).write_text('date,store,account,amount,category,subcategory\n')
+    config = {'Paths': {'Transactions csv': str(tmp_path / 'ledger.csv')}}
+
+    assert open_ledger(config) is open_ledger(dict(config))
+    assert open_ledger({'Paths': {'Transactions csv': str(tmp_path / 'other.csv')}}) is not \
+        open_ledger(config)
+
+
+def test_discover_statements_with_and_without_catalog(tmp_path):
+    root = tmp_path / 'statements'
+    root.mkdir()
+    for filename in ('Checking_2022-02-28.pdf', 'Checking_2022-03-31.pdf', 'notes.txt'):
+        (root / filename).write_bytes(filename.encode())
+    min_date = datetime.datetime(2022, 3, 1)
+
+    files, account_names = discover_statements(None, str(root), min_date)
+    assert files == ['Checking_2022-03-31.pdf']
+    assert account_names is None
+
+    config = {'Paths': {'Statement Catalog': str(tmp_path / 'catalog.sqlite')},
+              'Accounts': accounts}
+    statement_catalog, statement_cache = open_statement_stores(config, str(root))
+    assert statement_cache is None
+    files, account_names = discover_statements(statement_catalog, str(root), min_date)
+    assert account_names == {'Checking_2022-03-31.pdf': 'Checking'}
+
+    # Ingested statements are not found again
+    ledger = open_ledger({'Paths': {'Transactions store': str(tmp_path / 'ledger.sqlite')}})
+    save_imported_entries(ledger, [], statement_catalog, files)
+    assert discover_statements(statement_catalog, str(root), min_date) == ([], {})
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_process_opens_its_own_ledger(tmp_path):
+    (tmp_path / 'ledger.csv').write_text('date,store,account,amount,category,subcategory\n')
+    config = {'Paths': {'Transactions csv': str(tmp_path / 'ledger.csv')}}
+    parent_ledger = open_ledger(config)
+
+    # Fork while another thread holds the locks, as a request thread may during an import
+    with Utils._opened_ledgers_lock, metrics._lock:
+        pid = os.fork()
+        if pid == 0:
+            ok = False
+            try:
+                with metrics.capture():
+                    ok = open_ledger(config) is not parent_ledger
+            finally:
+                os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+
+
+def test_layout_is_detected_over_the_whole_statement(monkeypatch):
+    monkeypatch.setattr(Utils, 'iter_pdf_pages',
+                        lambda *args: iter(summary_then_transactions))
+    expected = parsed_fields(find_entries(sum(summary_then_transactions, [])))
+
+    lines, entries, layout = parse_statement('', 'Checking_2022-03-31.pdf', 'Checking',
+                                             accounts['Checking'], keep_lines=True)
+    assert layout == 0
+    assert parsed_fields(entries.to_records()) == expected
+
+    # Cached lines are parsed as a single page and give the same transactions
+    _, cached_entries, _ = parse_statement('', 'Checking_2022-03-31.pdf', 'Checking',
+                                           accounts['Checking'], lines)
+    assert parsed_fields(cached_entries.to_records()) == expected
+
+
+def test_layout_pinned_from_a_summary_line_is_replaced(tmp_path, monkeypatch):
+    monkeypatch.setattr(Utils, 'iter_pdf_pages',
+                        lambda *args: iter(summary_then_transactions))
+    monkeypatch.setattr(Utils.matcher_engine, 'pinned', {})
+    filename = 'Checking_2022-03-31.pdf'
+    (tmp_path / filename).write_bytes(b'statement')
+    pins_key = f'pinned-{hash_matchers(entry_matchers)}'
+    cache = StatementCache(str(tmp_path / 'cache'))
+    cache.put(pins_key, {'Checking': 1})
+    cache.flush()
+
+    data, errors = parse_statements(str(tmp_path), [filename], accounts, 1, cache)
+
+    assert errors == {}
+    assert parsed_fields(data.to_records()) == \
+        parsed_fields(find_entries(sum(summary_then_transactions, [])))
+    assert StatementCache(str(tmp_path / 'cache')).get(pins_key) == {'Checking': 0}
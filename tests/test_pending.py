@@ -0,0 +1,59 @@
+"""Tests for the pending rows of the preview tables."""
+import datetime
+import diskcache
+import pandas as pd
+import pytest
+
+from Pending import PendingStore, filter_rows
+
+
+def test_filter_rows_with_case_prefixes():
+    rows_df = pd.DataFrame({
+        'store': ['Grocer', 'grocer outlet', 'Cafe'],
+        'amount': [-5.0, -12.5, -3.0],
+    })
+
+    assert filter_rows(rows_df, '{store} scontains Grocer')['store'].tolist() == ['Grocer']
+    assert filter_rows(rows_df, '{store} icontains GROCER')['store'].tolist() == \
+        ['Grocer', 'grocer outlet']
+    assert filter_rows(rows_df, '{store} s= "Cafe"')['store'].tolist() == ['Cafe']
+    assert filter_rows(rows_df, '{store} ieq "cafe"')['store'].tolist() == ['Cafe']
+    assert filter_rows(rows_df, '{amount} s< -4 && {store} icontains outlet')['store'] \
+        .tolist() == ['grocer outlet']
+
+
+def test_edited_rows_sort_with_imported_rows(tmp_path):
+    store = PendingStore(diskcache.Cache(str(tmp_path)))
+    store.add('session', [
+        {'date': datetime.date(2022, 3, 5), 'store': 'Grocer'},
+        {'date': datetime.date(2022, 3, 1), 'store': 'Cafe'},
+        {'date': pd.Timestamp('2022-03-3'), 'store': 'Bakery'},
+    ])
+    page, _ = store.page('session', 0, 10)
+    edited = [{**row, 'date': '2022-03-04T00:00:00'} if row['store'] == 'Cafe' else row
+              for row in page]
+    store.apply_edits('session', edited, page)
+
+    page, _ = store.page('session', 0, 10)
+    assert [(row['date'], row['store']) for row in page] == [
+        ('2022-03-03', 'Bakery'), ('2022-03-04', 'Cafe'), ('2022-03-05', 'Grocer')]
+
+
+def test_rows_stay_pending_until_written(tmp_path):
+    store = PendingStore(diskcache.Cache(str(tmp_path)))
+    store.add('session', [{'date': '2022-03-01', 'store': 'Cafe'}])
+
+    store.add('session', [], ['2022-03-01.pdf'])
+
+    with pytest.raises(OSError):
+        with store.writing('session') as (rows, statements):
+            assert rows == [{'date': '2022-03-01', 'store': 'Cafe'}]
+            assert statements == ['2022-03-01.pdf']
+            raise OSError('disk full')
+    assert len(store.get('session')) == 1
+
+    with store.writing('session') as (rows, statements):
+        store.add('session', [{'date': '2022-03-02', 'store': 'Grocer'}], ['2022-04-01.pdf'])
+    assert [row['store'] for row in store.get('session')] == ['Grocer']
+    with store.writing('session') as (rows, statements):
+        assert statements == ['2022-04-01.pdf']
@@ -0,0 +1,49 @@
+"""Tests for sharing cached statements and pinned layouts between import processes."""
+import multiprocessing
+import os
+
+from StatementCache import StatementCache, hash_matchers
+from syntheticData import write_synthetic_statements
+from Utils import entry_matchers, parse_statements
+
+
+def test_values_cached_by_another_process_are_found(tmp_path):
+    cache = StatementCache(str(tmp_path))
+    other = StatementCache(str(tmp_path))
+    other.put('key', [1, 2])
+    other.flush()
+
+    assert cache.get('key') == [1, 2]
+    cache.put('mine', 3)
+    cache.flush()
+    assert set(StatementCache(str(tmp_path)).index) == {'key', 'mine'}
+
+
+def import_in_child(folder: str, cache: StatementCache, accounts: dict, results):
+    data, errors = parse_statements(folder, sorted(os.listdir(folder)), accounts, 2, cache)
+    results.put((len(data), errors, cache.stats()['hits']))
+
+
+def test_later_imports_reuse_earlier_jobs(tmp_path):
+    folder = str(tmp_path / 'statements')
+    accounts = write_synthetic_statements(folder, 2)
+    cache_folder = str(tmp_path / 'cache')
+    cache = StatementCache(cache_folder)
+
+    # Each import runs in a process forked from the app, like its background jobs
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    runs = []
+    for _ in range(2):
+        process = context.Process(target=import_in_child,
+                                  args=(folder, cache, accounts, results))
+        process.start()
+        runs.append(results.get(timeout=120))
+        process.join()
+
+    (rows, errors, _), (cached_rows, _, hits) = runs
+    assert errors == {}
+    assert cached_rows == rows
+    assert hits >= len(os.listdir(folder))
+    pinned = StatementCache(cache_folder).get(f'pinned-{hash_matchers(entry_matchers)}')
+    assert set(pinned) == set(accounts)